@@ -1,12 +1,17 @@
 import abc
 from task_creator import TaskCreator
-from stack import stack
+from stack import NetworkStack, stack as default_stack
+from typing import Optional
 from adapter_interface import NetworkAdapterInterface
 
 
 class TaskNetworkAdapter(NetworkAdapterInterface, TaskCreator):
-    def __init__(self):
+    def __init__(self, stack: Optional[NetworkStack] = None):
+        """
+        @param stack - the stack this adapter passes its packets to. the global stack if not given
+        """
         super().__init__()
+        self.stack = stack if stack is not None else default_stack
         self.create_task(self.handle_packets())
 
     async def handle_packets(self):
@@ -15,7 +20,7 @@ class TaskNetworkAdapter(NetworkAdapterInterface, TaskCreator):
         Gets a packet using abstract get_packet and add it to the stack
         """
         packet = await self.get_packet()
-        stack.add_packet(packet, self)
+        self.stack.add_packet(packet, self)
         self.create_task(self.handle_packets())
 
     @abc.abstractmethod
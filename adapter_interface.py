@@ -1,6 +1,6 @@
 import abc
 from ip_utils import IPAddress
-from typing import Optional
+from typing import Optional, List
 
 
 class NetworkAdapterInterface(abc.ABC):
@@ -44,3 +44,12 @@ class NetworkAdapterInterface(abc.ABC):
         :param packet: the packet to send
         """
         pass
+
+    async def send_many(self, packets: List[bytes]):
+        """
+        send a batch of packets through the adapter.
+        adapters that can send a batch more efficiently than packet by packet should override this
+        :param packets: the packets to send, in order
+        """
+        for packet in packets:
+            await self.send(packet)
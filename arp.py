@@ -1,8 +1,9 @@
 from typing import Optional
+import asyncio
 import struct
 from io import BytesIO
 
-from stack import NetworkAdapterInterface, stack
+from stack import NetworkAdapterInterface, NetworkStack
 from protocol import Protocol
 from ethernet import Ethernet, MacResolverInterface
 from consts import IPV4_PROTOCOL_ID
@@ -10,6 +11,7 @@ from arp_table import ARPTable
 import consts
 from ip_utils import IPAddress
 from packet import Packet
+from stats import DropReason
 
 
 class ARP(Protocol, MacResolverInterface):
@@ -20,10 +22,13 @@ class ARP(Protocol, MacResolverInterface):
     REPLY_OPCODE = 2
     PROTOCOL_STRUCT = struct.Struct('>HHBBH')
     ETHERNET_ID = 1
+    # seconds to wait for a reply before giving up on sending the packet (like the 3 probes of linux, a second each)
+    RESOLVE_TIMEOUT = 3
 
-    def __init__(self):
+    def __init__(self, stack: Optional[NetworkStack] = None):
+        super().__init__(stack)
         self._arp_tables = {}
-        stack.get_protocol(Ethernet).set_mac_resolver(self)
+        self.stack.get_protocol(Ethernet).set_mac_resolver(self)
 
     async def build(self, adapter: NetworkAdapterInterface, packet: bytes, options) -> bytes:
         assert packet == b'', 'packet given to arp layer should be empty'
@@ -55,7 +60,7 @@ class ARP(Protocol, MacResolverInterface):
                 or ipv4_id != IPV4_PROTOCOL_ID \
                 or mac_length != Ethernet.MAC_LENGTH \
                 or ip_length != IPAddress.ADDRESS_LENGTH:
-            return None
+            return self.drop(packet, DropReason.UNSUPPORTED)
 
         src_mac = Ethernet.parse_mac(packet_io.read(Ethernet.MAC_LENGTH))
         src_ip = IPAddress(packet_io.read(IPAddress.ADDRESS_LENGTH))
@@ -63,12 +68,12 @@ class ARP(Protocol, MacResolverInterface):
         dst_ip = IPAddress(packet_io.read(IPAddress.ADDRESS_LENGTH))
 
         if dst_ip != adapter.ip or (not Ethernet.relevant_mac(adapter, dst_mac) and dst_mac != '00:00:00:00:00:00'):
-            return None
+            return self.drop(packet, DropReason.WRONG_ADDRESS)
 
         self.add_arp_entry(adapter, src_ip, src_mac)
 
         if opcode == self.REQUEST_OPCODE:
-            await stack.send(ARP, expected_adapter=adapter, arp_opcode=self.REPLY_OPCODE, dst_ip=src_ip)
+            await self.stack.send(ARP, expected_adapter=adapter, arp_opcode=self.REPLY_OPCODE, dst_ip=src_ip)
 
     def _get_arp_table(self, adapter: NetworkAdapterInterface):
         return self._arp_tables.setdefault(adapter, ARPTable())
@@ -87,5 +92,9 @@ class ARP(Protocol, MacResolverInterface):
             return result
 
         # we got a coroutine, which means there's no available mac for this ip. send arp request and wait for the result
-        await stack.send(ARP, arp_opcode=ARP.REQUEST_OPCODE, dst_ip=dst_ip, expected_adapter=adapter)
-        return await result
+        await self.stack.send(ARP, arp_opcode=ARP.REQUEST_OPCODE, dst_ip=dst_ip, expected_adapter=adapter)
+        try:
+            return await asyncio.wait_for(result, self.RESOLVE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.drop(None, DropReason.ARP_TIMEOUT)
+            raise
@@ -0,0 +1,101 @@
+"""
+Compare the receive rate (packets per second) of SnifferNetworkAdapter and RingNetworkAdapter.
+A veth pair is created, a separate process floods one side with udp packets, and the stack listens on the other side
+with the adapter being measured. Must run as root.
+
+    python benchmark/adapter_pps.py [--duration SECONDS] [--payload-size BYTES]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import struct
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from stack import stack
+from ip_utils import IPAddress
+from udp_socket import UDPSocket
+from utils import calculate_checksum
+from os_utils.sniffer_adapter import SnifferNetworkAdapter
+from os_utils.ring_adapter import RingNetworkAdapter
+
+ADAPTER_NAME = 'bench_adapter'
+PEER_NAME = 'bench_peer'
+ADAPTER_MAC = 'aa:bb:cc:dd:ee:ff'
+PEER_MAC = 'aa:bb:cc:dd:ee:00'
+ADAPTER_IP = '10.1.1.1'
+PEER_IP = '10.1.1.2'
+NETMASK = '255.255.255.0'
+PORT = 4000
+# the max frame size, with the ethernet header
+MTU = 1514
+
+
+def build_frame(payload_size: int) -> bytes:
+    udp = struct.pack('>HHHH', PORT, PORT, 8 + payload_size, 0) + b'\x00' * payload_size
+    ip = struct.pack('>BBHHHBBHII', 0x45, 0, 20 + len(udp), 0, 0, 64, socket.IPPROTO_UDP, 0,
+                     int(IPAddress(PEER_IP)), int(IPAddress(ADAPTER_IP)))
+    ip = ip[:10] + struct.pack('>H', calculate_checksum(ip)) + ip[12:]
+    ethernet = bytes.fromhex(ADAPTER_MAC.replace(':', '')) + bytes.fromhex(PEER_MAC.replace(':', '')) + b'\x08\x00'
+    return ethernet + ip + udp
+
+
+def flood(frame: bytes, stop):
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+    sock.bind((PEER_NAME, 0))
+    while not stop.is_set():
+        for _ in range(1000):
+            try:
+                sock.send(frame)
+            except OSError:
+                pass
+
+
+async def measure(adapter_type: type, duration: float) -> int:
+    adapter = adapter_type(ADAPTER_NAME, ADAPTER_MAC, IPAddress(ADAPTER_IP), IPAddress(NETMASK), None, MTU)
+    stack.add_adapter(adapter)
+    received = 0
+    with UDPSocket(recv_queue_length=1 << 16, recv_buffer_size=1 << 26) as sock:
+        sock.bind(ADAPTER_IP, PORT)
+        # let the adapter reach a steady state before counting
+        await sock.recvmany(1 << 16, timeout=1)
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            received += len(await sock.recvmany(1 << 16, timeout=end - time.perf_counter()))
+        adapter.close()
+        # the stack finishes with the packets it already got before the port is closed
+        await adapter.wait_closed()
+        stack.remove_adapter(adapter)
+    return received
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--payload-size', type=int, default=64)
+    args = parser.parse_args()
+
+    os.system(f'ip link add {ADAPTER_NAME} type veth peer name {PEER_NAME}')
+    os.system(f'ip link set dev {ADAPTER_NAME} address {ADAPTER_MAC}')
+    os.system(f'ip link set dev {PEER_NAME} address {PEER_MAC}')
+    os.system(f'ip link set dev {ADAPTER_NAME} up')
+    os.system(f'ip link set dev {PEER_NAME} up')
+    stop = multiprocessing.Event()
+    sender = multiprocessing.Process(target=flood, args=(build_frame(args.payload_size), stop))
+    sender.start()
+    try:
+        for adapter_type in (SnifferNetworkAdapter, RingNetworkAdapter):
+            received = asyncio.run(measure(adapter_type, args.duration))
+            print(f'{adapter_type.__name__}: {received / args.duration:.0f} pps')
+    finally:
+        stop.set()
+        sender.join()
+        os.system(f'ip link delete {ADAPTER_NAME}')
+
+
+if __name__ == '__main__':
+    main()
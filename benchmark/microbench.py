@@ -0,0 +1,262 @@
+"""
+Microbenchmarks of the hot paths of the stack, on in-memory adapters (no root, kernel or scapy needed):
+the receive path (a frame through all the protocols to a socket), the send path, a round trip between two stacks,
+calculate_checksum, RouteTable.route and ARPTable.get_mac, for a matrix of payload sizes.
+Every case reports packets per second, ns per packet, p50/p99 latency and bytes allocated per packet.
+
+The results can be saved as a JSON baseline, and compared to a baseline: the run fails if a case got slower (in ns per
+packet) or allocates more than the baseline by more than the threshold.
+
+    python benchmark/microbench.py [--count N] [--payload-size BYTES ...] [--case NAME ...]
+                                   [--save-baseline JSON] [--baseline JSON] [--threshold FRACTION]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Callable, List, Optional
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from stack import NetworkStack
+from ip_utils import IPAddress
+from udp_socket import UDPSocket
+from udp import UDP
+from arp import ARP
+from arp_table import ARPTable, ARPEntry
+from route_table import RouteTable
+from utils import calculate_checksum
+from wire_adapter import WireNetworkAdapter
+from pcap_adapter import PcapWriterAdapter
+
+LOCAL_MAC = '02:00:00:00:00:01'
+REMOTE_MAC = '02:00:00:00:00:02'
+LOCAL_IP = '10.0.0.1'
+REMOTE_IP = '10.0.0.2'
+NETMASK = IPAddress('255.255.255.0')
+PORT = 4000
+# ethernet, ipv4 and udp
+HEADERS_SIZE = 14 + 20 + 8
+DEFAULT_PAYLOAD_SIZES = [16, 512, 1472]
+DEFAULT_COUNT = 5000
+WARMUP_COUNT = 200
+ALLOCATION_COUNT = 200
+
+
+class Case:
+    """
+    A benchmarked operation. op does the operation once, and is a coroutine function if is_async is set
+    """
+    def __init__(self, name: str, payload_size: Optional[int], op: Callable, is_async: bool = False):
+        self.name = name
+        self.payload_size = payload_size
+        self.op = op
+        self.is_async = is_async
+
+    @property
+    def key(self) -> str:
+        return self.name if self.payload_size is None else f'{self.name}/{self.payload_size}'
+
+
+async def measure(case: Case, count: int) -> dict:
+    op = case.op
+    for _ in range(WARMUP_COUNT):
+        await op() if case.is_async else op()
+
+    latencies = [0] * count
+    perf_counter_ns = time.perf_counter_ns
+    start = perf_counter_ns()
+    if case.is_async:
+        for i in range(count):
+            op_start = perf_counter_ns()
+            await op()
+            latencies[i] = perf_counter_ns() - op_start
+    else:
+        for i in range(count):
+            op_start = perf_counter_ns()
+            op()
+            latencies[i] = perf_counter_ns() - op_start
+    elapsed = perf_counter_ns() - start
+
+    # tracemalloc slows everything down, so allocations are measured in a separate pass
+    allocated = 0
+    tracemalloc.start()
+    try:
+        for _ in range(ALLOCATION_COUNT):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            await op() if case.is_async else op()
+            _, peak = tracemalloc.get_traced_memory()
+            allocated += peak - before
+    finally:
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'packets_per_second': count * 1e9 / elapsed,
+        'ns_per_packet': elapsed / count,
+        'p50_ns': latencies[count // 2],
+        'p99_ns': latencies[min(count - 1, count * 99 // 100)],
+        'allocated_bytes_per_packet': allocated / ALLOCATION_COUNT,
+    }
+
+
+async def build_udp_frame(payload: bytes) -> bytes:
+    """
+    Build the frame the remote side would send to the local adapter, with a stack of its own
+    """
+    sender_stack = NetworkStack()
+    sender = PcapWriterAdapter(REMOTE_MAC, IPAddress(REMOTE_IP), NETMASK)
+    sender_stack.add_adapter(sender)
+    sender_stack.get_protocol(ARP).add_arp_entry(sender, IPAddress(LOCAL_IP), LOCAL_MAC)
+    _, frame = await sender_stack.build(UDP, IPAddress(LOCAL_IP), src_port=PORT, dst_port=PORT, data=payload)
+    return frame
+
+
+class Benchmarks:
+    """
+    The stacks, adapters and sockets the cases run on
+    """
+    def __init__(self):
+        # the arp entries added here must not expire in the middle of a long run
+        ARPEntry.UP_TO_DATE_TIMEOUT = float('inf')
+
+        # a stack receiving frames pushed by hand, and sending into a sink
+        self.stack = NetworkStack()
+        self.adapter = PcapWriterAdapter(LOCAL_MAC, IPAddress(LOCAL_IP), NETMASK)
+        self.stack.add_adapter(self.adapter)
+        self.stack.get_protocol(ARP).add_arp_entry(self.adapter, IPAddress(REMOTE_IP), REMOTE_MAC)
+        self.socket = UDPSocket(stack=self.stack)
+        self.socket.bind(None, PORT)
+
+        # two stacks connected by a wire
+        local_stack = NetworkStack()
+        remote_stack = NetworkStack()
+        self.local, self.remote = WireNetworkAdapter.pair(
+            dict(mac=LOCAL_MAC, ip=IPAddress(LOCAL_IP), netmask=NETMASK, stack=local_stack),
+            dict(mac=REMOTE_MAC, ip=IPAddress(REMOTE_IP), netmask=NETMASK, stack=remote_stack))
+        local_stack.add_adapter(self.local)
+        remote_stack.add_adapter(self.remote)
+        local_stack.get_protocol(ARP).add_arp_entry(self.local, self.remote.ip, self.remote.mac)
+        remote_stack.get_protocol(ARP).add_arp_entry(self.remote, self.local.ip, self.local.mac)
+        self.local_socket = UDPSocket(stack=local_stack)
+        self.local_socket.bind(None, PORT)
+        self.remote_socket = UDPSocket(stack=remote_stack)
+        self.remote_socket.bind(None, PORT)
+
+        self.route_table = RouteTable()
+        for i in range(8):
+            self.route_table.add_adapter(
+                PcapWriterAdapter(LOCAL_MAC, IPAddress(f'10.0.{i}.1'), NETMASK, IPAddress(f'10.0.{i}.254')))
+        self.arp_table = ARPTable()
+        for i in range(256):
+            self.arp_table.update(IPAddress(f'10.0.0.{i}'), REMOTE_MAC)
+
+    async def cases(self, payload_sizes: List[int]) -> List[Case]:
+        cases = []
+        for payload_size in payload_sizes:
+            payload = b'x' * payload_size
+            cases.append(self._rx_case(await build_udp_frame(payload)))
+            cases.append(self._tx_case(payload))
+            cases.append(self._round_trip_case(payload))
+            cases.append(Case('checksum', payload_size, lambda data=payload: calculate_checksum(data)))
+
+        route_ip = IPAddress('10.0.5.7')
+        cases.append(Case('route', None, lambda: self.route_table.route(route_ip)))
+        arp_ip = IPAddress('10.0.0.2')
+        cases.append(Case('arp_get_mac', None, lambda: self.arp_table.get_mac(arp_ip)))
+        return cases
+
+    def _rx_case(self, frame: bytes) -> Case:
+        frames = [frame]
+
+        async def rx():
+            await self.stack.handle_packets(frames, self.adapter)
+            await self.socket.recvfrom()
+        return Case('rx', len(frame) - HEADERS_SIZE, rx, is_async=True)
+
+    def _tx_case(self, payload: bytes) -> Case:
+        async def tx():
+            await self.socket.sendto(payload, REMOTE_IP, PORT)
+        return Case('tx', len(payload), tx, is_async=True)
+
+    def _round_trip_case(self, payload: bytes) -> Case:
+        async def round_trip():
+            await self.local_socket.sendto(payload, REMOTE_IP, PORT)
+            await self.remote_socket.recvfrom()
+        return Case('round_trip', len(payload), round_trip, is_async=True)
+
+    def close(self):
+        self.socket.close()
+        self.local_socket.close()
+        self.remote_socket.close()
+        self.local.close()
+        self.remote.close()
+
+
+async def run(args) -> dict:
+    benchmarks = Benchmarks()
+    results = {}
+    try:
+        print(f'{"case":<20}{"pps":>12}{"ns/packet":>12}{"p50 ns":>10}{"p99 ns":>10}{"bytes/packet":>14}')
+        for case in await benchmarks.cases(args.payload_size or DEFAULT_PAYLOAD_SIZES):
+            if args.case and case.name not in args.case:
+                continue
+            result = results[case.key] = await measure(case, args.count)
+            print(f'{case.key:<20}{result["packets_per_second"]:>12.0f}{result["ns_per_packet"]:>12.0f}'
+                  f'{result["p50_ns"]:>10}{result["p99_ns"]:>10}{result["allocated_bytes_per_packet"]:>14.0f}')
+    finally:
+        benchmarks.close()
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """
+    Returns a description of every regression of the results compared to the baseline
+    """
+    regressions = []
+    for key, result in results.items():
+        base = baseline['results'].get(key)
+        if base is None:
+            continue
+        for metric in ('ns_per_packet', 'allocated_bytes_per_packet'):
+            # a few bytes of noise in the allocations of a case that barely allocates is not a regression
+            limit = base[metric] * (1 + threshold) + (64 if metric == 'allocated_bytes_per_packet' else 0)
+            if result[metric] > limit:
+                regressions.append(f'{key}: {metric} {result[metric]:.0f} > {base[metric]:.0f} (+{threshold:.0%})')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=DEFAULT_COUNT, help='the number of packets of every case')
+    parser.add_argument('--payload-size', type=int, action='append', help='a payload size to measure (repeatable)')
+    parser.add_argument('--case', action='append', help='run only the cases with this name (repeatable)')
+    parser.add_argument('--save-baseline', help='save the results as a JSON baseline')
+    parser.add_argument('--baseline', help='a JSON baseline to compare the results to')
+    parser.add_argument('--threshold', type=float, default=0.25, help='the allowed slowdown, as a fraction')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(), 'results': results}, f,
+                      indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f'regression: {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
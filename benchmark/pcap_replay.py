@@ -0,0 +1,58 @@
+"""
+Replay a capture through the stack and report the throughput of the receive path.
+The replies of the stack can be recorded to another pcap file.
+
+    python benchmark/pcap_replay.py CAPTURE --mac MAC --ip IP [--netmask NETMASK] [--port PORT ...] [--output PCAP]
+                                    [--realtime] [--batch-size N]
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from stack import stack
+from ip_utils import IPAddress
+from udp_socket import UDPSocket
+from pcap_adapter import PcapReplayAdapter
+
+
+async def replay(args) -> PcapReplayAdapter:
+    adapter = PcapReplayAdapter(args.capture, args.mac, IPAddress(args.ip), IPAddress(args.netmask),
+                                output_path=args.output, realtime=args.realtime, batch_size=args.batch_size)
+    stack.add_adapter(adapter)
+    # open the ports the capture is sent to, so its packets are delivered and not answered with icmp errors
+    sockets = []
+    for port in args.port:
+        sock = UDPSocket(recv_queue_length=1 << 20, recv_buffer_size=1 << 30)
+        sock.bind(args.ip, port)
+        sockets.append(sock)
+    try:
+        await adapter.done
+    finally:
+        for sock in sockets:
+            sock.close()
+        stack.remove_adapter(adapter)
+        adapter.close()
+    return adapter
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('capture')
+    parser.add_argument('--mac', required=True, help='the mac the capture is sent to')
+    parser.add_argument('--ip', required=True, help='the ip the capture is sent to')
+    parser.add_argument('--netmask', default='255.255.255.0')
+    parser.add_argument('--port', type=int, action='append', default=[], help='a udp port to listen on')
+    parser.add_argument('--output', help='a pcap file to record the packets sent by the stack')
+    parser.add_argument('--realtime', action='store_true', help='replay at the pace of the capture')
+    parser.add_argument('--batch-size', type=int, default=PcapReplayAdapter.DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    adapter = asyncio.run(replay(args))
+    print(adapter.report())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Compare the receive path with and without the checksum validation stage.
+The stage only runs in parallel on a free threaded python build (python3.13t and later), so run this with both builds.
+On a build with the GIL the stage is forced on, to show its overhead.
+
+    python benchmark/validation_stage.py [--count N] [--payload-size BYTES] [--batch-size N] [--workers N]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from scapy.all import Ether, IP, UDP as SCAPY_UDP
+
+from stack import stack
+from ip_utils import IPAddress
+from udp_socket import UDPSocket
+from pcap_adapter import PcapWriterAdapter
+from validation import ValidationStage, gil_enabled
+
+MAC = '02:00:00:00:00:01'
+IP_ADDRESS = '10.0.0.1'
+SRC_IP_ADDRESS = '10.0.0.2'
+PORT = 4000
+
+
+def build_frames(count: int, payload_size: int):
+    frame = (Ether(src='02:00:00:00:00:02', dst=MAC) / IP(src=SRC_IP_ADDRESS, dst=IP_ADDRESS) /
+             SCAPY_UDP(sport=PORT, dport=PORT) / (b'x' * payload_size)).build()
+    return [frame] * count
+
+
+async def run(frames, batch_size: int, validation_stage) -> float:
+    adapter = PcapWriterAdapter(MAC, IPAddress(IP_ADDRESS), IPAddress('255.255.255.0'))
+    stack.add_adapter(adapter)
+    stack.set_validation_stage(validation_stage)
+    sock = UDPSocket(recv_queue_length=len(frames), recv_buffer_size=1 << 30)
+    sock.bind(IP_ADDRESS, PORT)
+    try:
+        start = time.perf_counter()
+        for i in range(0, len(frames), batch_size):
+            await stack.handle_packets(frames[i:i + batch_size], adapter)
+        return time.perf_counter() - start
+    finally:
+        sock.close()
+        stack.set_validation_stage(None)
+        stack.remove_adapter(adapter)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=20000)
+    parser.add_argument('--payload-size', type=int, default=1024)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    print(f'python {sys.version.split()[0]}, gil {"enabled" if gil_enabled() else "disabled"}, '
+          f'{args.workers} workers')
+    frames = build_frames(args.count, args.payload_size)
+
+    elapsed = asyncio.run(run(frames, args.batch_size, None))
+    print(f'checksums in the protocols: {args.count / elapsed:.0f} pps')
+
+    validation_stage = ValidationStage(args.workers, enabled=True)
+    try:
+        elapsed = asyncio.run(run(frames, args.batch_size, validation_stage))
+    finally:
+        validation_stage.close()
+    print(f'validation stage:           {args.count / elapsed:.0f} pps')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import asyncio
+import time
+from typing import List
+
+from adapter_interface import NetworkAdapterInterface
+from stack import NetworkStack, stack as default_stack
+
+
+class BusyPoller:
+    """
+    Run-to-completion mode, for deployments that care about latency and can spare a core.
+    Instead of waiting for the event loop to wake a task for every batch of packets, the poller spins on its adapters,
+    reading their packets without blocking, and pushes every packet through all the protocols right away. A socket with
+    a receive callback (`UDPSocket.set_recv_callback`) gets the packet in the same iteration.
+    Adapters must have a `poll(max_count)` method that returns the waiting packets without blocking (like
+    SnifferNetworkAdapter and TapNetworkAdapter). Once polled, an adapter stops passing packets to the stack by itself.
+
+    The poller runs as a task of the loop of the stack, so it should have a loop (and a thread) of its own to get a
+    core. Every spin_count polls, it gives up the loop so timers and other tasks can run: for one iteration if there
+    were packets, or for idle_sleep seconds if the adapters were idle.
+    """
+    DEFAULT_BATCH_SIZE = 64
+    DEFAULT_SPIN_COUNT = 1000
+
+    def __init__(self, stack: NetworkStack = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                 spin_count: int = DEFAULT_SPIN_COUNT, idle_sleep: float = 0.0):
+        """
+        @param stack - the stack to pass the packets to. the global stack if not given
+        @param batch_size - the max number of packets read from an adapter in one poll
+        """
+        self.stack = stack if stack is not None else default_stack
+        self.batch_size = batch_size
+        self.spin_count = spin_count
+        self.idle_sleep = idle_sleep
+        self._adapters = []  # type: List[NetworkAdapterInterface]
+        self._running = False
+        self.polled_packets = 0
+        # packets a protocol had to wait for something to handle, so they were finished in a task
+        self.deferred_packets = 0
+
+    def add_adapter(self, adapter: NetworkAdapterInterface):
+        self._adapters.append(adapter)
+
+    def remove_adapter(self, adapter: NetworkAdapterInterface):
+        self._adapters.remove(adapter)
+
+    def poll_once(self) -> int:
+        """
+        Poll every adapter once and handle the packets it had. Returns the number of packets handled
+        """
+        count = 0
+        for adapter in self._adapters:
+            packets = adapter.poll(self.batch_size)
+            if not packets:
+                continue
+
+            received_time = time.perf_counter_ns()
+            for packet in packets:
+                if not self.stack.handle_packet_now(packet, adapter, received_time):
+                    self.deferred_packets += 1
+            count += len(packets)
+
+        self.polled_packets += count
+        return count
+
+    async def run(self):
+        """
+        Poll the adapters until `stop` is called
+        """
+        self._running = True
+        while self._running:
+            busy = False
+            for _ in range(self.spin_count):
+                if self.poll_once():
+                    busy = True
+            await asyncio.sleep(0 if busy else self.idle_sleep)
+
+    def stop(self):
+        self._running = False
@@ -0,0 +1,233 @@
+import time
+from array import array
+from typing import Optional, Iterable, Iterator, List, NamedTuple
+
+from stack import NetworkStack, NetworkAdapterInterface, ProtocolInterface, stack as default_stack
+from packet import Packet
+from stats import DropReason
+from tracing import Tracer
+from pcap import PcapWriter
+from ethernet import Ethernet
+from ipv4 import IPv4
+from consts import IPV4_PROTOCOL_ID
+
+
+class CapturedFrame(NamedTuple):
+    """
+    A frame kept by a CaptureRing. frame may be cut to the snaplen of the ring, original_length is its real length.
+    protocol and reason are the protocol that dropped the frame and why, or None if the frame wasn't dropped
+    """
+    timestamp: int
+    sent: bool
+    frame: bytes
+    original_length: int
+    protocol: Optional[str]
+    reason: Optional[DropReason]
+
+    @property
+    def description(self) -> str:
+        if self.reason is not None:
+            return f'dropped by {self.protocol}: {self.reason.value}'
+        return 'sent' if self.sent else 'received'
+
+
+class CaptureRing:
+    """
+    Keeps the last frames the stack received and sent, with the reason of every frame it dropped, like a tcpdump that
+    sees what the stack sees. The frames can be dumped to a pcapng file (with the drop reasons as frame comments) at
+    any time.
+    The ring takes a fixed amount of memory, allocated up front: up to max_packets frames, and up to max_bytes bytes of
+    frames, whichever is reached first. Older frames are overwritten by new ones.
+    Frames can be filtered by protocol (like [UDP, ARP]) and by udp port (source or destination).
+    The ring gets the frames from the tracer of the stack (one is set if the stack has none) between `start` and `stop`.
+    While it's stopped, it costs nothing.
+    """
+    DEFAULT_MAX_PACKETS = 4096
+    DEFAULT_MAX_BYTES = 4 << 20
+    ETHERTYPE_OFFSET = 12
+    IP_OFFSET = 14
+    IP_PROTOCOL_OFFSET = IP_OFFSET + 9
+    UDP_PROTOCOL_ID = 17
+
+    def __init__(self, max_packets: int = DEFAULT_MAX_PACKETS, max_bytes: int = DEFAULT_MAX_BYTES,
+                 snaplen: int = 65535, protocols: Optional[Iterable[type]] = None,
+                 ports: Optional[Iterable[int]] = None, stack: NetworkStack = None):
+        """
+        @param protocols - keep only frames of these protocol types (protocols above Ethernet or above IPv4)
+        @param ports - keep only udp frames from or to these ports
+        @param stack - the stack to capture. the global stack if not given
+        """
+        self.stack = stack if stack is not None else default_stack
+        self.max_packets = max_packets
+        self.snaplen = min(snaplen, max_bytes)
+        self._data = bytearray(max_bytes)
+        self._offsets = array('q', bytes(8 * max_packets))
+        self._lengths = array('q', bytes(8 * max_packets))
+        self._original_lengths = array('q', bytes(8 * max_packets))
+        self._timestamps = array('q', bytes(8 * max_packets))
+        self._sent = array('b', bytes(max_packets))
+        # 0 for frames that weren't dropped, and the index of the protocol name / drop reason + 1 for dropped ones
+        self._protocols = array('b', bytes(max_packets))
+        self._reasons = array('b', bytes(max_packets))
+        self._protocol_names = []  # type: List[str]
+        self._reason_list = list(DropReason)
+        self._start = 0
+        self._count = 0
+        self._write_offset = 0
+        # the last received packet and the number of its record, to mark it if it's dropped
+        self._last_packet = None  # type: Optional[Packet]
+        self._last_record = -1
+        self._record_count = 0
+
+        self._ethertypes = None
+        self._ip_protocols = None
+        if protocols is not None:
+            self._ethertypes = {protocol.PROTOCOL_ID for protocol in protocols if protocol.NEXT_PROTOCOL is Ethernet}
+            self._ip_protocols = {protocol.PROTOCOL_ID for protocol in protocols if protocol.NEXT_PROTOCOL is IPv4}
+        self._ports = set(ports) if ports is not None else None
+        self._filtered = protocols is not None or ports is not None
+
+        self._tracer = None  # type: Optional[Tracer]
+        self._own_tracer = False
+
+    def __len__(self):
+        return self._count
+
+    def start(self):
+        if self._tracer is not None:
+            return
+        if self.stack.tracer is None:
+            self.stack.set_tracer(Tracer())
+            self._own_tracer = True
+        self._tracer = self.stack.tracer
+        self._tracer.register_to_received_callback(self._received)
+        self._tracer.register_to_dropped_callback(self._dropped)
+        self._tracer.register_to_sent_callback(self._sent_frame)
+
+    def stop(self):
+        if self._tracer is None:
+            return
+        self._tracer.unregister_from_received_callback(self._received)
+        self._tracer.unregister_from_dropped_callback(self._dropped)
+        self._tracer.unregister_from_sent_callback(self._sent_frame)
+        if self._own_tracer and self.stack.tracer is self._tracer and not self._tracer.has_callbacks:
+            self.stack.set_tracer(None)
+        self._tracer = None
+        self._own_tracer = False
+        self._last_packet = None
+
+    def _received(self, packet: Packet, adapter: NetworkAdapterInterface):
+        if self._filtered and not self._matches(packet.all_packet):
+            return
+        self._last_packet = packet
+        self._last_record = self._add(packet.all_packet, False)
+
+    def _dropped(self, protocol: ProtocolInterface, packet: Optional[Packet], reason: DropReason):
+        if packet is None or (self._filtered and not self._matches(packet.all_packet)):
+            return
+        if packet is not self._last_packet or self._record_count - self._last_record >= self._count:
+            # the received frame is gone (or another packet was received since), so the drop gets a frame of its own
+            self._last_record = self._add(packet.all_packet, False)
+        slot = (self._start + self._count - 1 - (self._record_count - self._last_record)) % self.max_packets
+        self._protocols[slot] = self._protocol_index(type(protocol).__name__) + 1
+        self._reasons[slot] = self._reason_list.index(reason) + 1
+        self._last_packet = None
+
+    def _sent_frame(self, adapter: NetworkAdapterInterface, frame: bytes):
+        if self._filtered and not self._matches(frame):
+            return
+        self._add(frame, True)
+
+    def _protocol_index(self, name: str) -> int:
+        if name not in self._protocol_names:
+            self._protocol_names.append(name)
+        return self._protocol_names.index(name)
+
+    def _matches(self, frame: bytes) -> bool:
+        if len(frame) < self.IP_OFFSET:
+            return False
+        ethertype = (frame[self.ETHERTYPE_OFFSET] << 8) + frame[self.ETHERTYPE_OFFSET + 1]
+        ip_protocol = None
+        if ethertype == IPV4_PROTOCOL_ID and len(frame) > self.IP_PROTOCOL_OFFSET:
+            ip_protocol = frame[self.IP_PROTOCOL_OFFSET]
+
+        if self._ethertypes is not None and ethertype not in self._ethertypes \
+                and ip_protocol not in self._ip_protocols:
+            return False
+
+        if self._ports is not None:
+            if ip_protocol != self.UDP_PROTOCOL_ID:
+                return False
+            udp_offset = self.IP_OFFSET + (frame[self.IP_OFFSET] & 0xf) * 4
+            if len(frame) < udp_offset + 4:
+                return False
+            src_port = (frame[udp_offset] << 8) + frame[udp_offset + 1]
+            dst_port = (frame[udp_offset + 2] << 8) + frame[udp_offset + 3]
+            if src_port not in self._ports and dst_port not in self._ports:
+                return False
+        return True
+
+    def _add(self, frame: bytes, sent: bool) -> int:
+        """
+        Keep the frame in the ring, instead of the oldest frames if there is no room.
+        Returns the number of the new record
+        """
+        captured = min(len(frame), self.snaplen)
+        offset = self._write_offset
+        if offset + captured > len(self._data):
+            # the frame doesn't fit before the end of the buffer, so the frames there are dropped, and it's written at
+            # the start of the buffer
+            while self._count and self._offsets[self._start] >= offset:
+                self._evict()
+            offset = 0
+        while self._count and (self._count == self.max_packets or
+                               (self._offsets[self._start] < offset + captured and
+                                offset < self._offsets[self._start] + self._lengths[self._start])):
+            self._evict()
+
+        slot = (self._start + self._count) % self.max_packets
+        self._data[offset:offset + captured] = frame[:captured]
+        self._offsets[slot] = offset
+        self._lengths[slot] = captured
+        self._original_lengths[slot] = len(frame)
+        self._timestamps[slot] = time.time_ns()
+        self._sent[slot] = sent
+        self._protocols[slot] = 0
+        self._reasons[slot] = 0
+        self._write_offset = offset + captured
+        self._count += 1
+        self._record_count += 1
+        return self._record_count
+
+    def _evict(self):
+        self._start = (self._start + 1) % self.max_packets
+        self._count -= 1
+
+    def __iter__(self) -> Iterator[CapturedFrame]:
+        """
+        Iterate over the kept frames, from the oldest
+        """
+        for i in range(self._count):
+            slot = (self._start + i) % self.max_packets
+            offset = self._offsets[slot]
+            protocol = self._protocols[slot]
+            reason = self._reasons[slot]
+            yield CapturedFrame(self._timestamps[slot], bool(self._sent[slot]),
+                                bytes(self._data[offset:offset + self._lengths[slot]]), self._original_lengths[slot],
+                                self._protocol_names[protocol - 1] if protocol else None,
+                                self._reason_list[reason - 1] if reason else None)
+
+    def dump(self, path: str, pcapng: bool = True):
+        """
+        Write the kept frames to a file. A pcapng file keeps the description of every frame (like the drop reason) as
+        its comment, a pcap file keeps only the frames
+        """
+        with PcapWriter(path, self.snaplen, pcapng=pcapng) as writer:
+            for captured in self:
+                writer.write(captured.frame, captured.timestamp, captured.description, captured.original_length)
+
+    def clear(self):
+        self._start = 0
+        self._count = 0
+        self._write_offset = 0
+        self._last_packet = None
@@ -5,9 +5,10 @@ import codecs
 
 import consts
 from protocol import Protocol
-from stack import NetworkAdapterInterface
+from stack import NetworkAdapterInterface, NetworkStack
 from ip_utils import IPAddress
 from packet import Packet
+from stats import DropReason
 
 
 class MacResolverInterface(abc.ABC):
@@ -26,7 +27,8 @@ class Ethernet(Protocol):
     MAC_LENGTH = 6
     _PROTOCOL_ID_STRUCT = struct.Struct('>H')
 
-    def __init__(self):
+    def __init__(self, stack: Optional[NetworkStack] = None):
+        super().__init__(stack)
         self._mac_resolver = None  # type: Optional[MacResolverInterface]
 
     def set_mac_resolver(self, mac_resolver: MacResolverInterface):
@@ -65,7 +67,7 @@ class Ethernet(Protocol):
         dst_mac = self.parse_mac(data[:self.MAC_LENGTH])
 
         if not self.relevant_mac(adapter, dst_mac):
-            return None
+            return self.drop(packet, DropReason.WRONG_MAC)
 
         src_mac = self.parse_mac(data[self.MAC_LENGTH:self.MAC_LENGTH*2])
         protocol_id_start = 2 * self.MAC_LENGTH
@@ -0,0 +1,207 @@
+import heapq
+import random
+import time
+from array import array
+from typing import Optional, List, Dict, Tuple, NamedTuple
+
+from stack import NetworkStack, stack as default_stack
+from udp import UDP, DatagramHandler
+from ip_utils import IPAddress
+
+
+class FlowKey(NamedTuple):
+    protocol: int
+    src_ip: int
+    src_port: int
+    dst_ip: int
+    dst_port: int
+
+    def __str__(self):
+        return f'{IPAddress(self.src_ip)}:{self.src_port} -> {IPAddress(self.dst_ip)}:{self.dst_port} ' \
+               f'(protocol {self.protocol})'
+
+
+class HeavyHitter(NamedTuple):
+    flow: FlowKey
+    packets: int
+    bytes: int
+
+
+class CountMinSketch:
+    """
+    Estimates how many times every key was counted, in a fixed amount of memory whatever the number of keys.
+    An estimate is never below the real count, and is above it by at most 2 / width of the total count, with
+    probability 1 - 2 ** -depth.
+    Every row hashes the key with a multiply-shift hash of its own, so the width is rounded up to a power of two.
+    """
+    HASH_MASK = (1 << 64) - 1
+
+    def __init__(self, width: int = 1024, depth: int = 4):
+        self._bits = max(1, (width - 1).bit_length())
+        self.width = 1 << self._bits
+        self.depth = depth
+        self._rows = [array('q', bytes(8 * self.width)) for _ in range(depth)]
+        # fixed odd multipliers, so the same key gets the same indexes in every sketch
+        self._multipliers = [random.Random(row).getrandbits(64) | 1 for row in range(depth)]
+
+    def _indexes(self, key: tuple) -> List[int]:
+        key_hash = hash(key) & self.HASH_MASK
+        shift = 64 - self._bits
+        return [((key_hash * multiplier) & self.HASH_MASK) >> shift for multiplier in self._multipliers]
+
+    def add(self, key: tuple, count: int = 1) -> int:
+        """
+        Count the key. Returns its new estimate
+        """
+        estimate = None
+        for row, index in zip(self._rows, self._indexes(key)):
+            row[index] += count
+            if estimate is None or row[index] < estimate:
+                estimate = row[index]
+        return estimate
+
+    def estimate(self, key: tuple) -> int:
+        return min(row[index] for row, index in zip(self._rows, self._indexes(key)))
+
+    def clear(self):
+        for row in self._rows:
+            row[:] = array('q', bytes(8 * self.width))
+
+
+class TopK:
+    """
+    The k keys with the highest counts, out of the keys it was told about.
+    A min heap finds the smallest of the k quickly. Updated counts are pushed again instead of being fixed in place,
+    and the heap is rebuilt when the stale entries pile up, so it never grows beyond a few times k.
+    """
+    def __init__(self, k: int):
+        if k < 1:
+            raise ValueError(f"invalid k {k}")
+        self.k = k
+        self._counts = {}  # type: Dict[tuple, int]
+        self._heap = []  # type: List[Tuple[int, tuple]]
+
+    def __len__(self):
+        return len(self._counts)
+
+    def update(self, key: tuple, count: int):
+        """
+        Set the count of the key, which is kept if it's one of the top k
+        """
+        counts = self._counts
+        if key not in counts:
+            if len(counts) >= self.k:
+                # drop stale entries until the top of the heap is the real smallest count
+                while self._heap[0][0] != counts.get(self._heap[0][1]):
+                    heapq.heappop(self._heap)
+                if count <= self._heap[0][0]:
+                    return
+                del counts[heapq.heappop(self._heap)[1]]
+        counts[key] = count
+        heapq.heappush(self._heap, (count, key))
+        if len(self._heap) > 4 * self.k:
+            self._heap = [(key_count, counted_key) for counted_key, key_count in counts.items()]
+            heapq.heapify(self._heap)
+
+    def keys(self) -> List[tuple]:
+        return list(self._counts)
+
+    def clear(self):
+        self._counts.clear()
+        self._heap.clear()
+
+
+class FlowSlot:
+    """
+    The counts of a single slot of the sliding window
+    """
+    def __init__(self, k: int, width: int, depth: int):
+        self.epoch = -1
+        self.packets = CountMinSketch(width, depth)
+        self.bytes = CountMinSketch(width, depth)
+        self.top_packets = TopK(k)
+        self.top_bytes = TopK(k)
+
+    def clear(self, epoch: int):
+        self.epoch = epoch
+        self.packets.clear()
+        self.bytes.clear()
+        self.top_packets.clear()
+        self.top_bytes.clear()
+
+
+class FlowAccounting(DatagramHandler):
+    """
+    Finds the flows (by their 5-tuple) that send or receive the most packets and bytes, in fixed memory whatever the
+    number of flows.
+    The last `window` seconds are split to `slots` slots. Every slot counts the packets and the bytes of every flow in
+    count-min sketches, and keeps the top k flows by each. The heavy hitters of the window are the top flows of its
+    slots, by the sum of their estimates in all the slots.
+    Flows are counted from the UDP datagrams the stack delivers to sockets and sends between `start` and `stop`, and
+    their bytes are the sizes of the datagrams. Packets the stack drops are not counted.
+    """
+    DEFAULT_WINDOW = 60.0
+    DEFAULT_SLOTS = 6
+    DEFAULT_K = 16
+
+    def __init__(self, window: float = DEFAULT_WINDOW, slots: int = DEFAULT_SLOTS, k: int = DEFAULT_K,
+                 width: int = 1024, depth: int = 4, stack: NetworkStack = None):
+        """
+        @param k - the number of heavy hitters kept by every slot
+        @param width, depth - the size of the count-min sketches
+        @param stack - the stack to count the flows of. the global stack if not given
+        """
+        self.stack = stack if stack is not None else default_stack
+        self.slot_duration = window / slots
+        self.k = k
+        self._slots = [FlowSlot(k, width, depth) for _ in range(slots)]
+        self._started = False
+
+    def start(self):
+        if not self._started:
+            self.stack.get_protocol(UDP).register_to_datagram_callback(self)
+            self._started = True
+
+    def stop(self):
+        if self._started:
+            self.stack.get_protocol(UDP).unregister_from_datagram_callback(self)
+            self._started = False
+
+    def handle_datagram(self, src_ip: int, src_port: int, dst_ip: int, dst_port: int, size: int):
+        self.add(FlowKey(UDP.PROTOCOL_ID, src_ip, src_port, dst_ip, dst_port), size)
+
+    def _slot(self, now: float) -> FlowSlot:
+        epoch = int(now / self.slot_duration)
+        slot = self._slots[epoch % len(self._slots)]
+        if slot.epoch != epoch:
+            slot.clear(epoch)
+        return slot
+
+    def add(self, flow: FlowKey, size: int, now: Optional[float] = None):
+        """
+        Count a packet of the flow
+        @param now - the time of the packet, in time.monotonic units. now if not given
+        """
+        slot = self._slot(time.monotonic() if now is None else now)
+        slot.top_packets.update(flow, slot.packets.add(flow))
+        slot.top_bytes.update(flow, slot.bytes.add(flow, size))
+
+    def heavy_hitters(self, by_bytes: bool = False, count: Optional[int] = None,
+                      now: Optional[float] = None) -> List[HeavyHitter]:
+        """
+        The flows with the most packets (or bytes) in the window, from the heaviest. count is k if not given
+        """
+        epoch = int((time.monotonic() if now is None else now) / self.slot_duration)
+        slots = [slot for slot in self._slots if epoch - len(self._slots) < slot.epoch <= epoch]
+        flows = set()
+        for slot in slots:
+            flows.update((slot.top_bytes if by_bytes else slot.top_packets).keys())
+
+        hitters = [HeavyHitter(flow, sum(slot.packets.estimate(flow) for slot in slots),
+                               sum(slot.bytes.estimate(flow) for slot in slots)) for flow in flows]
+        hitters.sort(key=lambda hitter: hitter.bytes if by_bytes else hitter.packets, reverse=True)
+        return hitters[:count if count is not None else self.k]
+
+    def report(self, by_bytes: bool = False, count: Optional[int] = None) -> str:
+        return '\n'.join(f'{hitter.flow}: {hitter.packets} packets, {hitter.bytes} bytes'
+                         for hitter in self.heavy_hitters(by_bytes, count))
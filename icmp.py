@@ -1,34 +1,142 @@
-from stack import NetworkAdapterInterface
+from stack import NetworkAdapterInterface, NetworkStack
 from protocol import Protocol
 from ipv4 import IPv4, TTLExceededHandler
-from utils import calculate_checksum
-from typing import Optional, Tuple
-from stack import stack
+from ethernet import Ethernet
+from utils import calculate_checksum, update_checksum
+from typing import Optional, Tuple, List
 from packet import Packet
+from stats import DropReason
+from ip_utils import IPAddress
+from rate_limiter import TokenBucket, KeyedRateLimiter
 
+import abc
 import struct
+import time
 from enum import Enum
 
 
 class ICMPCodes(Enum):
+    ECHO_REPLY = 0
     DESTINATION_UNREACHABLE = 3
+    ECHO_REQUEST = 8
     TTL_EXCEEDED = 11
 
 
+class EchoProbeHandler:
+    @abc.abstractmethod
+    def handle_echo_probe(self, src_ip: IPAddress, identifier: int, sequence: int, processing_time: Optional[int]):
+        """
+        this function will be called for every echo request we reply to.
+        processing_time is the time in nanoseconds from the moment the request got to the stack until the reply was
+        given to the adapter, or None if the stack doesn't know when the request arrived
+        """
+        pass
+
+
+class DestinationUnreachableHandler:
+    @abc.abstractmethod
+    def handle_destination_unreachable(self, code: int, src_ip: IPAddress, dst_ip: IPAddress, protocol: int,
+                                       data: memoryview):
+        """
+        this function will be called for every destination unreachable error we get.
+        src_ip, dst_ip and protocol are taken from the ip header of the packet that caused the error (the packet that
+        we sent), and data is the part of that packet after its ip header (usually only the first 8 bytes)
+        """
+        pass
+
+
 class ICMP(Protocol, TTLExceededHandler):
     NEXT_PROTOCOL = IPv4
     PROTOCOL_ID = 1
 
-    HEADER_STRUCT = struct.Struct('BBH')
+    HEADER_STRUCT = struct.Struct('>BBH')
+    ECHO_STRUCT = struct.Struct('>BBHHH')
 
     ERROR_CODES = (ICMPCodes.DESTINATION_UNREACHABLE, ICMPCodes.TTL_EXCEEDED)
 
-    def __init__(self):
+    # like linux net.ipv4.icmp_ratelimit (with its burst) and net.ipv4.icmp_msgs_per_sec/icmp_msgs_burst
+    DESTINATION_ERROR_RATE = 1
+    DESTINATION_ERROR_BURST = 6
+    GLOBAL_ERROR_RATE = 1000
+    GLOBAL_ERROR_BURST = 50
+    # an error packet (with its ip header) should not be longer than 576 bytes (RFC 1812)
+    MAX_ERROR_PACKET_SIZE = 576 - 20 - 8
+    ECHO_REPLY_RATE = 1000
+    ECHO_REPLY_BURST = 50
+
+    def __init__(self, stack: Optional[NetworkStack] = None):
+        super().__init__(stack)
         self._builders = {
             ICMPCodes.TTL_EXCEEDED: self._build_ttl_exceeded,
             ICMPCodes.DESTINATION_UNREACHABLE: self._build_icmp_destination_unreachable
         }
-        stack.get_protocol(IPv4).register_to_ttl_exceeded_callback(self)
+        self.set_error_rate_limit(self.DESTINATION_ERROR_RATE, self.DESTINATION_ERROR_BURST, self.GLOBAL_ERROR_RATE,
+                                  self.GLOBAL_ERROR_BURST)
+        self.rate_limited_errors = 0
+        self.set_echo_rate_limit(self.ECHO_REPLY_RATE, self.ECHO_REPLY_BURST)
+        self.rate_limited_echo_replies = 0
+        self._echo_probe_handlers = []  # type: List[EchoProbeHandler]
+        self._destination_unreachable_handlers = []  # type: List[DestinationUnreachableHandler]
+        self.stack.get_protocol(IPv4).register_to_ttl_exceeded_callback(self)
+
+    def set_echo_rate_limit(self, rate: float, burst: float):
+        """
+        Limit the rate of the echo replies we send. rate is in packets per second
+        """
+        self._echo_limiter = TokenBucket(rate, burst)
+
+    def register_to_echo_probe_callback(self, handler: EchoProbeHandler):
+        self._echo_probe_handlers.append(handler)
+
+    def register_to_destination_unreachable_callback(self, handler: DestinationUnreachableHandler):
+        self._destination_unreachable_handlers.append(handler)
+
+    def set_error_rate_limit(self, destination_rate: float, destination_burst: float, global_rate: float,
+                             global_burst: float):
+        """
+        Limit the rate of the icmp errors we send, per destination and in total. rates are in packets per second
+        """
+        self._destination_limiter = KeyedRateLimiter(destination_rate, destination_burst)
+        self._global_limiter = TokenBucket(global_rate, global_burst)
+
+    def send_error(self, dst_ip: IPAddress, icmp_type: ICMPCodes, error_packet: bytes, **options) -> bool:
+        """
+        Send an icmp error in the background, if the rate limit allows it.
+        This never waits, so it can be called while handling an incoming packet.
+        Returns False if the error was not sent because of the rate limit
+        """
+        if not self._consume_error_tokens(dst_ip):
+            return False
+        self.stack.create_task(self.stack.send(ICMP, dst_ip=dst_ip, icmp_type=icmp_type,
+                                               error_packet=error_packet[:self.MAX_ERROR_PACKET_SIZE], **options))
+        return True
+
+    def send_packet_error(self, packet: Packet, icmp_type: ICMPCodes, **options) -> bool:
+        """
+        Send an icmp error about a packet we got back to its source, like `send_error`.
+        The error quotes the ip header of the packet and the data from the current layer, which are copied only if the
+        rate limit allows the error
+        """
+        ip = packet.get_layer('ip')
+        if not self._consume_error_tokens(ip.attributes['src']):
+            return False
+        error_packet = bytes(ip.data) + bytes(packet.current_packet[:self.MAX_ERROR_PACKET_SIZE - len(ip.data)])
+        self.stack.create_task(self.stack.send(ICMP, dst_ip=ip.attributes['src'], icmp_type=icmp_type,
+                                               error_packet=error_packet, **options))
+        return True
+
+    def _consume_error_tokens(self, dst_ip: IPAddress) -> bool:
+        """
+        Take a token from both the destination and the global limiters, or from none of them if one of them is empty
+        """
+        key = int(dst_ip)
+        if not self._destination_limiter.allows(key) or not self._global_limiter.allows():
+            self.rate_limited_errors += 1
+            self.drop(None, DropReason.RATE_LIMITED)
+            return False
+        self._destination_limiter.consume(key)
+        self._global_limiter.consume()
+        return True
 
     async def handle_ttl_exceeded(self, packet: Packet):
         """
@@ -37,9 +145,7 @@ class ICMP(Protocol, TTLExceededHandler):
         This response packet has the data from ip layer and up and the error_packet, so get that information from the
         incoming packet.
         """
-        ip = packet.get_layer('ip')
-        await stack.send(ICMP, dst_ip=ip.attributes['src'], icmp_type=ICMPCodes.TTL_EXCEEDED,
-                         error_packet=ip.data + packet.current_packet)
+        self.send_packet_error(packet, ICMPCodes.TTL_EXCEEDED)
 
     @staticmethod
     def _pack(type: ICMPCodes, code: int, data: bytes):
@@ -68,5 +174,91 @@ class ICMP(Protocol, TTLExceededHandler):
         return packet + builder(options)
 
     async def handle(self, packet: Packet, adapter: NetworkAdapterInterface) -> Optional[int]:
-        # nothing to do with incoming icmp packet
-        pass
+        data = packet.current_packet
+        if len(data) >= self.ECHO_STRUCT.size and data[0] == ICMPCodes.ECHO_REQUEST.value:
+            await self._reply_to_echo_request(packet, adapter)
+        elif len(data) >= self.HEADER_STRUCT.size and data[0] == ICMPCodes.DESTINATION_UNREACHABLE.value:
+            self._handle_destination_unreachable(packet)
+        return None
+
+    def _handle_destination_unreachable(self, packet: Packet):
+        """
+        Find the packet we sent that caused the error and pass it to the registered handlers.
+        The handlers may fail a socket because of the error, so a corrupted error is dropped
+        """
+        data = packet.current_packet
+        ip_header = packet.get_layer('ip').data
+        # the frame may be padded after the ip packet
+        total_length, = struct.unpack_from('>H', ip_header, 2)
+        if calculate_checksum(data[:total_length - len(ip_header)]) != 0:
+            return self.drop(packet, DropReason.BAD_CHECKSUM)
+
+        # the error packet is after the header and 4 unused bytes
+        error_packet = data[self.HEADER_STRUCT.size + 4:]
+        if len(error_packet) < IPv4.PROTOCOL_STRUCT.size:
+            return
+
+        version_and_header_length, _, _, _, _, _, protocol, _, src_ip, dst_ip = \
+            IPv4.PROTOCOL_STRUCT.unpack_from(error_packet)
+        header_length = (version_and_header_length & 0xf) * 4
+        if version_and_header_length >> 4 != IPv4.VERSION or len(error_packet) < header_length:
+            return
+
+        for handler in self._destination_unreachable_handlers:
+            handler.handle_destination_unreachable(data[1], IPAddress(src_ip), IPAddress(dst_ip), protocol,
+                                                   error_packet[header_length:])
+
+    async def _reply_to_echo_request(self, packet: Packet, adapter: NetworkAdapterInterface):
+        """
+        Reply to an echo request by turning the received frame into the reply in place: the addresses are swapped,
+        the icmp type and the ttl are replaced, and the checksums are updated incrementally.
+        The request checksum isn't verified. The incremental update keeps a bad checksum bad, so the sender will drop
+        a reply to a corrupted request.
+        """
+        if not self._echo_limiter.consume():
+            self.rate_limited_echo_replies += 1
+            return self.drop(packet, DropReason.RATE_LIMITED)
+
+        ip_layer = packet.get_layer('ip')
+        icmp_offset = len(packet.all_packet) - len(packet.current_packet)
+        ip_offset = icmp_offset - len(ip_layer.data)
+        frame = bytearray(packet.all_packet)
+
+        # ethernet - reply to the sender from our mac
+        frame[0:6] = frame[6:12]
+        frame[6:12] = Ethernet.build_mac(adapter.mac)
+
+        # ip - swapping the addresses doesn't change the checksum, but the ttl does
+        frame[ip_offset + 12:ip_offset + 16], frame[ip_offset + 16:ip_offset + 20] = \
+            frame[ip_offset + 16:ip_offset + 20], frame[ip_offset + 12:ip_offset + 16]
+        old_ttl_word = (frame[ip_offset + 8] << 8) + frame[ip_offset + 9]
+        frame[ip_offset + 8] = IPv4.TTL
+        self._update_checksum(frame, ip_offset + 10, old_ttl_word, (frame[ip_offset + 8] << 8) + frame[ip_offset + 9])
+
+        # icmp - echo request becomes echo reply
+        old_type_word = (frame[icmp_offset] << 8) + frame[icmp_offset + 1]
+        frame[icmp_offset] = ICMPCodes.ECHO_REPLY.value
+        self._update_checksum(frame, icmp_offset + 2, old_type_word, (frame[icmp_offset] << 8) + frame[icmp_offset + 1])
+
+        frame = bytes(frame)
+        # the reply isn't built by the stack, so it's counted here in every protocol of the frame
+        layer_sizes = ((self, len(packet.current_packet)), (self.stack.get_protocol(IPv4), len(frame) - ip_offset),
+                       (self.stack.get_protocol(Ethernet), len(frame)))
+        for protocol, size in layer_sizes:
+            protocol.counters.tx_packets += 1
+            protocol.counters.tx_bytes += size
+        self.stack.count_sent(adapter, [frame])
+        await adapter.send(frame)
+
+        if self._echo_probe_handlers:
+            processing_time = None
+            if packet.received_time is not None:
+                processing_time = time.perf_counter_ns() - packet.received_time
+            _, _, _, identifier, sequence = self.ECHO_STRUCT.unpack_from(packet.current_packet)
+            for handler in self._echo_probe_handlers:
+                handler.handle_echo_probe(ip_layer.attributes['src'], identifier, sequence, processing_time)
+
+    @staticmethod
+    def _update_checksum(frame: bytearray, offset: int, old_word: int, new_word: int):
+        checksum = (frame[offset] << 8) + frame[offset + 1]
+        frame[offset:offset + 2] = struct.pack('>H', update_checksum(checksum, old_word, new_word))
@@ -1,34 +1,60 @@
 from __future__ import annotations
 
-from typing import Union
+from typing import Union, Optional
 import ipaddress
+import socket
 
 
 class IPAddress:
+    """
+    An IPv4 address.
+    The address is kept in the form it was created from (string or integer), and the other form is calculated only
+    when it's needed, so parsing an address from a packet doesn't cost any string formatting.
+    """
     ADDRESS_LENGTH = 4
 
+    __slots__ = ('_ip', '_int')
+
     def __init__(self, ip: Union[str, bytes, int, IPAddress]):
-        if isinstance(ip, bytes):
-            ip = '.'.join(str(part) for part in ip)
+        self._ip = None  # type: Optional[str]
+        self._int = None  # type: Optional[int]
+        if isinstance(ip, (bytes, bytearray, memoryview)):
+            assert len(ip) == self.ADDRESS_LENGTH
+            self._int = int.from_bytes(ip, 'big')
         elif isinstance(ip, int):
-            ip = str(ipaddress.IPv4Address(ip))
+            self._int = ip
         elif isinstance(ip, IPAddress):
-            ip = str(ip)
-        assert isinstance(ip, str)
-        self._ip = ip
+            self._ip = ip._ip
+            self._int = ip._int
+        else:
+            assert isinstance(ip, str)
+            self._ip = ip
 
     def __bytes__(self):
-        assert len(self._ip.split('.')) == self.ADDRESS_LENGTH
-        return bytes(map(int, self._ip.split('.')))
+        return int(self).to_bytes(self.ADDRESS_LENGTH, 'big')
 
     def __int__(self):
-        return int(ipaddress.IPv4Address(self._ip))
+        if self._int is None:
+            self._int = int(ipaddress.IPv4Address(self._ip))
+        return self._int
 
     def __str__(self):
+        if self._ip is None:
+            self._ip = socket.inet_ntoa(self._int.to_bytes(self.ADDRESS_LENGTH, 'big'))
         return self._ip
 
+    def __repr__(self):
+        return f'IPAddress({str(self)!r})'
+
     def __eq__(self, other: Union[IPAddress, str, bytes, int]):
-        return self._ip == IPAddress(other)._ip
+        if not isinstance(other, IPAddress):
+            other = IPAddress(other)
+        if self._ip is not None and other._ip is not None:
+            return self._ip == other._ip
+        return int(self) == int(other)
+
+    def __hash__(self):
+        return hash(int(self))
 
     def in_network(self, ip: IPAddress, netmask: IPAddress):
         return (int(ip) & int(netmask)) == (int(self) & int(netmask))
@@ -1,14 +1,14 @@
 from typing import Optional, Tuple, List
 import struct
-from io import BytesIO
 import abc
 
 from ip_utils import IPAddress
-from stack import NetworkAdapterInterface
+from stack import NetworkAdapterInterface, NetworkStack
 from protocol import Protocol
 from ethernet import Ethernet
 from utils import calculate_checksum
 from packet import Packet
+from stats import DropReason
 from consts import IPV4_PROTOCOL_ID
 
 # This will add arp to the stack
@@ -33,7 +33,8 @@ class IPv4(Protocol):
     PROTOCOL_STRUCT = struct.Struct('>BBHHHBBHII')
     DF_FLAG = 0x4000
 
-    def __init__(self):
+    def __init__(self, stack: Optional[NetworkStack] = None):
+        super().__init__(stack)
         self._ttl_exceeded_handlers = []  # type: List[TTLExceededHandler]
 
     def register_to_ttl_exceeded_callback(self, handler: TTLExceededHandler):
@@ -49,31 +50,31 @@ class IPv4(Protocol):
         return ip_header + packet
 
     async def handle(self, packet: Packet, adapter: NetworkAdapterInterface) -> Optional[int]:
-        packet_io = BytesIO(packet.current_packet)
-        header_data = packet_io.read(self.PROTOCOL_STRUCT.size)
+        header_data = bytes(packet.current_packet[:self.PROTOCOL_STRUCT.size])
         version_and_header_length, options, total_length, identification, flags_and_fragment_offset, ttl, protocol, header_checksum, src_ip, dst_ip = self.PROTOCOL_STRUCT.unpack(header_data)
 
-        calculated_checksum = calculate_checksum(header_data[:10] + b'\x00' * 2 + header_data[12:])
-        if header_checksum != calculated_checksum:
-            return None
+        if not packet.checksum_verified:
+            calculated_checksum = calculate_checksum(header_data[:10] + b'\x00' * 2 + header_data[12:])
+            if header_checksum != calculated_checksum:
+                return self.drop(packet, DropReason.BAD_CHECKSUM)
 
         # support only basic IP header, with no options or fragmentation
         if version_and_header_length != (self.VERSION << 4) + self.HEADER_LENGTH \
                 or options != 0 \
                 or (flags_and_fragment_offset != 0 and flags_and_fragment_offset != self.DF_FLAG):
-            return None
+            return self.drop(packet, DropReason.UNSUPPORTED)
 
         src_ip = IPAddress(src_ip)
         dst_ip = IPAddress(dst_ip)
 
         if dst_ip != adapter.ip:
-            return None
+            return self.drop(packet, DropReason.WRONG_ADDRESS)
 
-        packet.add_layer('ip', {'src': src_ip, 'dst': dst_ip}, packet_io.tell())
+        packet.add_layer('ip', {'src': src_ip, 'dst': dst_ip}, self.PROTOCOL_STRUCT.size)
 
         if ttl == 0:
             for handler in self._ttl_exceeded_handlers:
                 await handler.handle_ttl_exceeded(packet)
-            return None
+            return self.drop(packet, DropReason.TTL_EXCEEDED)
 
         return protocol
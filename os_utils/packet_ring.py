@@ -0,0 +1,182 @@
+import asyncio
+import contextlib
+import mmap
+import socket
+import struct
+from typing import Callable, List, Optional, Tuple
+
+
+class PacketRing:
+    """
+    AF_PACKET socket with memory mapped RX and TX rings (TPACKET_V3).
+    The kernel writes received frames to blocks of the RX ring, and we read them in place, without a syscall or a copy
+    per frame. Frames to send are written to the TX ring, and a single syscall sends all of them.
+    """
+    ETH_P_ALL = 3
+    SOL_PACKET = 263
+    PACKET_RX_RING = 5
+    PACKET_VERSION = 10
+    PACKET_TX_RING = 13
+    TPACKET_V3 = 2
+
+    TP_STATUS_KERNEL = 0
+    TP_STATUS_USER = 1
+    TP_STATUS_AVAILABLE = 0
+    TP_STATUS_SEND_REQUEST = 1
+    TP_STATUS_WRONG_FORMAT = 4
+
+    # struct tpacket_req3
+    REQ_STRUCT = struct.Struct('IIIIIII')
+    # block_status, num_pkts, offset_to_first_pkt from struct tpacket_block_desc (after version and offset_to_priv)
+    BLOCK_HEADER_STRUCT = struct.Struct('III')
+    BLOCK_HEADER_OFFSET = 8
+    # tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len, tp_status, tp_mac from struct tpacket3_hdr
+    FRAME_HEADER_STRUCT = struct.Struct('IIIIIIH')
+    FRAME_STATUS_OFFSET = 20
+    # TPACKET_ALIGN(sizeof(struct tpacket3_hdr)), where frames in the TX ring start
+    TX_DATA_OFFSET = 48
+
+    def __init__(self, device: str, block_size: int = 1 << 20, block_count: int = 16, frame_size: int = 2048,
+                 block_timeout: int = 10, tx_block_size: int = 1 << 16, tx_block_count: int = 16,
+                 before_bind: Optional[Callable[[socket.socket], None]] = None):
+        """
+        @param block_size - the size of every RX block. must be a multiple of the page size
+        @param block_count - the number of RX blocks
+        @param frame_size - the max size of a frame (with the ring headers)
+        @param block_timeout - the kernel gives us a block that isn't full after this many milliseconds
+        @param tx_block_size, tx_block_count - the size of the TX ring, which is divided to frames of frame_size
+        @param before_bind - called with the socket before it gets any frame, to attach a filter to it for example
+        """
+        # the socket gets no frames until it's bound with the protocol, so nothing gets in before the filter
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+        if before_bind is not None:
+            before_bind(self.sock)
+        self.sock.setsockopt(self.SOL_PACKET, self.PACKET_VERSION, self.TPACKET_V3)
+        self.sock.setsockopt(self.SOL_PACKET, self.PACKET_RX_RING, self.REQ_STRUCT.pack(
+            block_size, block_count, frame_size, block_size * block_count // frame_size, block_timeout, 0, 0))
+        self.sock.setsockopt(self.SOL_PACKET, self.PACKET_TX_RING, self.REQ_STRUCT.pack(
+            tx_block_size, tx_block_count, frame_size, tx_block_size * tx_block_count // frame_size, 0, 0, 0))
+        self.sock.bind((device, socket.htons(self.ETH_P_ALL)))
+        self.sock.setblocking(False)
+
+        self.block_size = block_size
+        self.block_count = block_count
+        self.frame_size = frame_size
+        self._tx_offset = block_size * block_count
+        self._tx_frames_per_block = tx_block_size // frame_size
+        self._tx_block_size = tx_block_size
+        self._tx_frame_count = self._tx_frames_per_block * tx_block_count
+        self._ring = mmap.mmap(self.sock.fileno(), self._tx_offset + tx_block_size * tx_block_count,
+                               mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self._view = memoryview(self._ring)
+        self._next_block = 0
+        self._next_tx_frame = 0
+        self.loop = asyncio.get_event_loop()
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def next_block(self) -> Optional[int]:
+        """
+        Returns the index of the next block the kernel gave us, or None if the kernel didn't fill it yet.
+        Every block is returned once, and should be given back to the kernel with `release_block`
+        """
+        block = self._next_block
+        status, = struct.unpack_from('I', self._ring, block * self.block_size + self.BLOCK_HEADER_OFFSET)
+        if not status & self.TP_STATUS_USER:
+            return None
+        self._next_block = (block + 1) % self.block_count
+        return block
+
+    def block_frames(self, block: int) -> List[memoryview]:
+        """
+        Get the frames in the given block, as memoryviews into the ring.
+        The memoryviews are valid only until the block is released
+        """
+        return [self._view[offset:offset + length]
+                for offset, length in self.parse_block(self._ring, block * self.block_size)]
+
+    @classmethod
+    def parse_block(cls, ring, block_offset: int) -> List[Tuple[int, int]]:
+        """
+        Find the frames in the block that starts at block_offset of the ring.
+        Returns the (offset in the ring, length) of every frame
+        """
+        _, frame_count, offset = cls.BLOCK_HEADER_STRUCT.unpack_from(ring, block_offset + cls.BLOCK_HEADER_OFFSET)
+        frames = []
+        offset += block_offset
+        for _ in range(frame_count):
+            next_offset, _, _, snaplen, _, _, mac = cls.FRAME_HEADER_STRUCT.unpack_from(ring, offset)
+            frames.append((offset + mac, snaplen))
+            offset += next_offset
+        return frames
+
+    def release_block(self, block: int, frames: List[memoryview] = ()):
+        """
+        Give the block back to the kernel. frames are the memoryviews returned from `block_frames`, which are released
+        """
+        for frame in frames:
+            with contextlib.suppress(BufferError):
+                frame.release()
+        struct.pack_into('I', self._ring, block * self.block_size + self.BLOCK_HEADER_OFFSET, self.TP_STATUS_KERNEL)
+
+    def _tx_frame_offset(self, frame: int) -> int:
+        block, index = divmod(frame, self._tx_frames_per_block)
+        return self._tx_offset + block * self._tx_block_size + index * self.frame_size
+
+    def write(self, data: bytes) -> bool:
+        """
+        Write a frame to the TX ring. It will be sent on the next `flush`.
+        Returns False if the ring is full
+        """
+        if len(data) > self.frame_size - self.TX_DATA_OFFSET:
+            raise ValueError(f"frame of {len(data)} bytes doesn't fit the ring")
+
+        offset = self._tx_frame_offset(self._next_tx_frame)
+        status, = struct.unpack_from('I', self._ring, offset + self.FRAME_STATUS_OFFSET)
+        if status not in (self.TP_STATUS_AVAILABLE, self.TP_STATUS_WRONG_FORMAT):
+            return False
+
+        self._ring[offset + self.TX_DATA_OFFSET:offset + self.TX_DATA_OFFSET + len(data)] = data
+        # tp_next_offset must be 0, tp_snaplen and tp_len are the length of the frame
+        self.FRAME_HEADER_STRUCT.pack_into(self._ring, offset, 0, 0, 0, len(data), len(data),
+                                           self.TP_STATUS_SEND_REQUEST, 0)
+        self._next_tx_frame = (self._next_tx_frame + 1) % self._tx_frame_count
+        return True
+
+    def flush(self):
+        """
+        Let the kernel send all the frames written to the TX ring
+        """
+        try:
+            self.sock.send(b'', socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            # the kernel is still sending, and will send the new frames too
+            pass
+
+    async def send_many(self, packets: List[bytes]):
+        """
+        Write all the packets to the TX ring and send them with a single syscall.
+        If the ring is full, waits for the kernel to send frames
+        """
+        for packet in packets:
+            while not self.write(packet):
+                self.flush()
+                await self._wait_for_writable()
+        self.flush()
+
+    async def send(self, data: bytes):
+        await self.send_many([data])
+
+    async def _wait_for_writable(self):
+        writable = self.loop.create_future()
+        self.loop.add_writer(self.sock.fileno(), lambda: writable.done() or writable.set_result(None))
+        try:
+            await writable
+        finally:
+            self.loop.remove_writer(self.sock.fileno())
+
+    def close(self):
+        self._view.release()
+        self._ring.close()
+        self.sock.close()
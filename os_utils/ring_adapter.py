@@ -0,0 +1,111 @@
+import asyncio
+import socket
+
+from os_utils.packet_ring import PacketRing
+from os_utils.socket_filter import SocketFilter
+from adapter_interface import NetworkAdapterInterface
+from task_creator import TaskCreator
+from stack import NetworkStack, stack as default_stack
+from ip_utils import IPAddress
+
+from typing import Optional, List
+
+
+class RingNetworkAdapter(NetworkAdapterInterface, TaskCreator):
+    """
+    An adapter like SnifferNetworkAdapter, that uses a memory mapped packet ring instead of a syscall per packet.
+    Received frames are handled as memoryviews into the ring, a block of frames at a time, and the block is given back
+    to the kernel when the stack is done with its frames.
+    """
+    def __init__(self, device: str, mac: str, ip: IPAddress, netmask: IPAddress, gateway: IPAddress, mtu: int,
+                 block_size: int = 1 << 20, block_count: int = 16, block_timeout: int = 10,
+                 stack: NetworkStack = None):
+        """
+        @param mtu - the max size of a frame, with its ethernet header (1514 for the usual ip mtu of 1500)
+        @param stack - the stack this adapter passes its frames to. the global stack if not given
+        """
+        super().__init__()
+        self.stack = stack if stack is not None else default_stack
+        self._mac = mac
+        self._ip = ip
+        self._netmask = netmask
+        self._gateway = gateway
+        self._mtu = mtu
+        # every frame needs room for the ring headers before it
+        frame_size = 1 << (mtu + PacketRing.TX_DATA_OFFSET - 1).bit_length()
+        self.filter = None  # type: Optional[SocketFilter]
+        self.ring = PacketRing(device, block_size, block_count, max(frame_size, 2048), block_timeout,
+                               before_bind=self._attach_filter)
+        self._receive_task = self.create_task(self.handle_packets())
+
+    def _attach_filter(self, sock: socket.socket):
+        self.filter = SocketFilter(sock, self._mac, self.stack)
+
+    async def handle_packets(self):
+        """
+        A task for packet processing
+        Waits for the kernel to fill a block, passes its frames to the stack and gives it back to the kernel
+        """
+        while True:
+            block = self.ring.next_block()
+            if block is None:
+                await self._wait_for_block()
+                continue
+
+            frames = self.ring.block_frames(block)
+            try:
+                await self.stack.handle_packets(frames, self)
+            finally:
+                self.ring.release_block(block, frames)
+            # handling a block may not wait for anything, so let other tasks run between blocks
+            await asyncio.sleep(0)
+
+    async def _wait_for_block(self):
+        ready = self.ring.loop.create_future()
+        self.ring.loop.add_reader(self.ring.fileno(), lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            self.ring.loop.remove_reader(self.ring.fileno())
+
+    @property
+    def mac(self) -> str:
+        return self._mac
+
+    def set_mac(self, mac: str):
+        self._mac = mac
+        self.filter.update(mac)
+
+    @property
+    def ip(self) -> IPAddress:
+        return self._ip
+
+    @property
+    def netmask(self) -> IPAddress:
+        return self._netmask
+
+    @property
+    def gateway(self) -> Optional[IPAddress]:
+        return self._gateway
+
+    async def send(self, packet: bytes):
+        await self.ring.send(packet)
+
+    async def send_many(self, packets: List[bytes]):
+        await self.ring.send_many(packets)
+
+    def close(self):
+        for task in list(self.tasks):
+            task.cancel()
+        self.filter.close()
+        if self._receive_task.done():
+            self.ring.close()
+        else:
+            # the frames of the current block are views into the ring, so it's closed when the task stops using them
+            self._receive_task.add_done_callback(lambda _: self.ring.close())
+
+    async def wait_closed(self):
+        """
+        Wait until the adapter stopped handling frames and the ring is closed
+        """
+        await asyncio.gather(*self.tasks, return_exceptions=True)
@@ -1,17 +1,95 @@
 import asyncio
 import socket
+from typing import Callable, List, Optional
+
+from os_utils.transmit_queue import TransmitQueue
 
 
 class Sniffer:
     ETH_P_ALL = 3
+    DEFAULT_BATCH_SIZE = 64
 
-    def __init__(self, device: str):
-        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(self.ETH_P_ALL))
-        self.sock.bind((device, 0))
+    def __init__(self, device: str, transmit_queue_length: int = TransmitQueue.DEFAULT_MAX_PACKETS,
+                 before_bind: Optional[Callable[[socket.socket], None]] = None):
+        """
+        @param transmit_queue_length - the max number of frames waiting to be sent. see `TransmitQueue`
+        @param before_bind - called with the socket before it gets any frame, to attach a filter to it for example
+        """
+        # the socket gets no frames until it's bound with the protocol, so nothing gets in before the filter
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+        if before_bind is not None:
+            before_bind(self.sock)
+        self.sock.bind((device, socket.htons(self.ETH_P_ALL)))
+        self.sock.setblocking(False)
         self.loop = asyncio.get_event_loop()
+        self.transmit_queue = TransmitQueue(self.sock, transmit_queue_length)
+        self._callback = None  # type: Optional[Callable[[List[bytes]], None]]
+        self._size = 0
+        self._batch_size = 0
+        # the error that stopped the reading, if there was one
+        self.error = None  # type: Optional[OSError]
+        # an error the socket reported after some packets of a batch were read, raised by the next read
+        self._pending_error = None  # type: Optional[OSError]
 
     async def recv(self, size: int):
         return await self.loop.sock_recv(self.sock, size)
 
+    def start_reading(self, callback: Callable[[List[bytes]], None], size: int,
+                      batch_size: int = DEFAULT_BATCH_SIZE):
+        """
+        Keep a reader registered on the socket, and every time it's readable, read all the waiting packets (up to
+        batch_size) without blocking and pass them to callback at once.
+        This saves registering the socket in the event loop for every packet, like `recv` does.
+        @param size - the max size of a packet
+        """
+        self._callback = callback
+        self._size = size
+        self._batch_size = batch_size
+        self.loop.add_reader(self.sock.fileno(), self._read_batch)
+
+    def stop_reading(self):
+        if self._callback is not None:
+            self.loop.remove_reader(self.sock.fileno())
+            self._callback = None
+
+    def _read_batch(self):
+        try:
+            packets = self.read_batch(self._size, self._batch_size)
+        except OSError as e:
+            # the device is gone (like ENETDOWN, or EBADF after it was removed). the socket would wake us up again with
+            # the same error, so we stop reading, and report the error the way the loop reports errors of tasks
+            self.stop_reading()
+            self.error = e
+            self.loop.call_exception_handler({'message': 'sniffer stopped reading', 'exception': e})
+            return
+        if packets:
+            self._callback(packets)
+
+    def read_batch(self, size: int, batch_size: int) -> List[bytes]:
+        """
+        Read the waiting packets, up to batch_size, without blocking.
+        Raises OSError if the socket failed before any packet was read. Packets that were read before a failure are
+        returned, and the failure is raised by the next read
+        """
+        if self._pending_error is not None:
+            error, self._pending_error = self._pending_error, None
+            raise error
+
+        packets = []
+        recv = self.sock.recv
+        try:
+            while len(packets) < batch_size:
+                packets.append(recv(size))
+        except BlockingIOError:
+            pass
+        except OSError as e:
+            if not packets:
+                raise
+            self._pending_error = e
+        return packets
+
     async def send(self, data: bytes):
-        await self.loop.sock_sendall(self.sock, data)
+        await self.transmit_queue.send(data)
+
+    async def send_many(self, packets: List[bytes]):
+        await self.transmit_queue.send_many(packets)
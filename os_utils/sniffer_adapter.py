@@ -1,27 +1,61 @@
+import asyncio
+import socket
+
 from os_utils.sniffer import Sniffer
-from adapter import TaskNetworkAdapter
+from os_utils.socket_filter import SocketFilter
+from os_utils.transmit_queue import TransmitQueue
+from adapter_interface import NetworkAdapterInterface
+from task_creator import TaskCreator
+from stack import NetworkStack, stack as default_stack
 from ip_utils import IPAddress
 
-from typing import Optional
+from typing import Optional, List
 
 
-class SnifferNetworkAdapter(TaskNetworkAdapter):
-    def __init__(self, device: str, mac: str, ip: IPAddress, netmask: IPAddress, gateway: IPAddress, mtu: int):
+class SnifferNetworkAdapter(NetworkAdapterInterface, TaskCreator):
+    def __init__(self, device: str, mac: str, ip: IPAddress, netmask: IPAddress, gateway: IPAddress, mtu: int,
+                 batch_size: int = Sniffer.DEFAULT_BATCH_SIZE,
+                 transmit_queue_length: int = TransmitQueue.DEFAULT_MAX_PACKETS, stack: NetworkStack = None):
+        """
+        @param mtu - the max size of a frame, with its ethernet header (1514 for the usual ip mtu of 1500)
+        @param batch_size - the max number of packets read from the socket and passed to the stack at once
+        @param transmit_queue_length - the max number of packets waiting to be sent. senders wait when it's full
+        @param stack - the stack this adapter passes its packets to. the global stack if not given
+        """
         super().__init__()
+        self.stack = stack if stack is not None else default_stack
         self._mac = mac
         self._ip = ip
         self._netmask = netmask
         self._gateway = gateway
         self._mtu = mtu
-        self.sniffer = Sniffer(device)
+        self.filter = None  # type: Optional[SocketFilter]
+        self.sniffer = Sniffer(device, transmit_queue_length, before_bind=self._attach_filter)
+        self.sniffer.start_reading(self._add_packets, self._mtu, batch_size)
+
+    def _attach_filter(self, sock: socket.socket):
+        self.filter = SocketFilter(sock, self._mac, self.stack)
 
-    async def get_packet(self):
-        return await self.sniffer.recv(self._mtu)
+    def _add_packets(self, packets):
+        # the adapter keeps the tasks of its packets, so `wait_closed` can wait for them
+        self.create_task(self.stack.handle_packets(packets, self))
+
+    def poll(self, max_count: int) -> List[bytes]:
+        """
+        Read up to max_count waiting packets without blocking, for busy polling (see `BusyPoller`).
+        Once the adapter is polled, it stops passing packets to the stack by itself
+        """
+        self.sniffer.stop_reading()
+        return self.sniffer.read_batch(self._mtu, max_count)
 
     @property
     def mac(self) -> str:
         return self._mac
 
+    def set_mac(self, mac: str):
+        self._mac = mac
+        self.filter.update(mac)
+
     @property
     def ip(self) -> IPAddress:
         return self._ip
@@ -36,4 +70,18 @@ class SnifferNetworkAdapter(TaskNetworkAdapter):
         return self._gateway
 
     async def send(self, packet: bytes):
-        await self.sniffer.send(packet)
\ No newline at end of file
+        await self.sniffer.send(packet)
+
+    async def send_many(self, packets: List[bytes]):
+        await self.sniffer.send_many(packets)
+
+    def close(self):
+        self.sniffer.stop_reading()
+        self.sniffer.transmit_queue.close()
+        self.filter.close()
+
+    async def wait_closed(self):
+        """
+        Wait until the stack is done with the packets the adapter got before it was closed
+        """
+        await asyncio.gather(*self.tasks, return_exceptions=True)
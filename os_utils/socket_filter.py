@@ -0,0 +1,110 @@
+import ctypes
+import socket
+import struct
+from typing import List, Tuple
+
+from ethernet import Ethernet
+from stack import NetworkStack
+import consts
+
+
+class SocketFilter:
+    """
+    A classic BPF filter (SO_ATTACH_FILTER) for an AF_PACKET socket of an adapter.
+    The kernel drops the frames the stack would drop anyway, before they're copied to us: frames we sent, frames to
+    other macs, and frames of ethertypes we have no protocol for.
+    The filter is regenerated when a protocol is registered to the stack of the adapter, or when `update` is called
+    with a new mac. To drop frames from the start, it should be attached before the socket is bound.
+    """
+    SO_ATTACH_FILTER = 26
+    SKF_AD_PKTTYPE = -0x1000 + 4
+    PACKET_OUTGOING = 4
+
+    BPF_LD_W_ABS = 0x20
+    BPF_LD_H_ABS = 0x28
+    BPF_LD_B_ABS = 0x30
+    BPF_JEQ_K = 0x15
+    BPF_RET_K = 0x06
+    INSTRUCTION_STRUCT = struct.Struct('HBBI')
+    # accept the whole frame
+    ACCEPT_SIZE = 0x40000
+
+    def __init__(self, sock: socket.socket, mac: str, stack: NetworkStack):
+        self.sock = sock
+        self.mac = mac
+        self.stack = stack
+        self.update()
+        self.stack.register_to_protocols_change(self.update)
+
+    def update(self, mac: str = None):
+        """
+        Build the filter again and attach it instead of the current one. Can be used to change the mac of the adapter
+        """
+        if mac is not None:
+            self.mac = mac
+        program = self.build(self.mac, self.stack.get_next_protocol_ids(Ethernet))
+        self.attach(self.sock, program)
+
+    @classmethod
+    def build(cls, mac: str, ethertypes: List[int]) -> List[Tuple[int, int, int, int]]:
+        """
+        Build a program that accepts frames that weren't sent by us, whose destination is the given mac or broadcast,
+        and whose ethertype is one of the given ethertypes.
+        Returns a list of (code, jump if true, jump if false, k) instructions
+        """
+        mac = Ethernet.build_mac(mac)
+        broadcast = Ethernet.build_mac(consts.BROADCAST_MAC)
+        # jumps are to labels (the strings in the program), and are converted to offsets in the end
+        program = [
+            (cls.BPF_LD_B_ABS, None, None, cls.SKF_AD_PKTTYPE & 0xffffffff),
+            (cls.BPF_JEQ_K, 'drop', None, cls.PACKET_OUTGOING),
+        ]
+        program += cls._match_mac(mac, on_mismatch='broadcast')
+        program.append('broadcast')
+        program += cls._match_mac(broadcast, on_mismatch='drop')
+        program += ['ethertype', (cls.BPF_LD_H_ABS, None, None, 12)]
+        program += [(cls.BPF_JEQ_K, 'accept', None, ethertype) for ethertype in ethertypes]
+        program += [
+            'drop',
+            (cls.BPF_RET_K, None, None, 0),
+            'accept',
+            (cls.BPF_RET_K, None, None, cls.ACCEPT_SIZE),
+        ]
+        return cls._resolve_labels(program)
+
+    @classmethod
+    def _match_mac(cls, mac: bytes, on_mismatch: str) -> list:
+        # a mac doesn't fit a single load, so compare its last 4 bytes and then its first 2 bytes
+        return [
+            (cls.BPF_LD_W_ABS, None, None, 2),
+            (cls.BPF_JEQ_K, None, on_mismatch, int.from_bytes(mac[2:], 'big')),
+            (cls.BPF_LD_H_ABS, None, None, 0),
+            (cls.BPF_JEQ_K, 'ethertype', on_mismatch, int.from_bytes(mac[:2], 'big')),
+        ]
+
+    @staticmethod
+    def _resolve_labels(program: list) -> List[Tuple[int, int, int, int]]:
+        labels = {}
+        instructions = []
+        for instruction in program:
+            if isinstance(instruction, str):
+                labels[instruction] = len(instructions)
+            else:
+                instructions.append(instruction)
+
+        def offset(label, position):
+            return 0 if label is None else labels[label] - position - 1
+
+        return [(code, offset(jump_true, i), offset(jump_false, i), k)
+                for i, (code, jump_true, jump_false, k) in enumerate(instructions)]
+
+    @classmethod
+    def attach(cls, sock: socket.socket, program: List[Tuple[int, int, int, int]]):
+        instructions = b''.join(cls.INSTRUCTION_STRUCT.pack(*instruction) for instruction in program)
+        buffer = ctypes.create_string_buffer(instructions)
+        # struct sock_fprog
+        sock_fprog = struct.pack('HL', len(program), ctypes.addressof(buffer))
+        sock.setsockopt(socket.SOL_SOCKET, cls.SO_ATTACH_FILTER, sock_fprog)
+
+    def close(self):
+        self.stack.unregister_from_protocols_change(self.update)
@@ -0,0 +1,163 @@
+import asyncio
+import fcntl
+import os
+import struct
+from typing import Callable, List, Optional
+
+from utils import calculate_checksum
+
+
+class TapQueue:
+    """
+    One queue of a tap device. Every queue has its own fd, and the kernel spreads the frames of the device between
+    the queues by their flow, so every queue can be read independently.
+    """
+    def __init__(self, fd: int, vnet_header_size: int):
+        self.fd = fd
+        self.vnet_header_size = vnet_header_size
+        self.loop = asyncio.get_event_loop()
+        self._callback = None
+        # the error that stopped the reading, if there was one
+        self.error = None  # type: Optional[OSError]
+        # an error the device reported after some frames of a batch were read, raised by the next read
+        self._pending_error = None  # type: Optional[OSError]
+
+    def start_reading(self, callback: Callable[[List[bytes]], None], size: int, batch_size: int):
+        """
+        Keep a reader registered on the queue, and every time it's readable, read all the waiting frames (up to
+        batch_size) and pass them to callback at once
+        """
+        self._callback = callback
+        self.loop.add_reader(self.fd, self._read_batch, size, batch_size)
+
+    def stop_reading(self):
+        if self._callback is not None:
+            self.loop.remove_reader(self.fd)
+            self._callback = None
+
+    def _read_batch(self, size: int, batch_size: int):
+        try:
+            frames = self.read_batch(size, batch_size)
+        except OSError as e:
+            # the device is gone (like EBADF or EIO after it was removed). the fd would wake us up again with the same
+            # error, so we stop reading, and report the error the way the loop reports errors of tasks
+            self.stop_reading()
+            self.error = e
+            self.loop.call_exception_handler({'message': 'tap queue stopped reading', 'exception': e})
+            return
+        if frames:
+            self._callback(frames)
+
+    def read_batch(self, size: int, batch_size: int) -> List[bytes]:
+        """
+        Read the waiting frames, up to batch_size, without blocking.
+        Raises OSError if the device failed before any frame was read. Frames that were read before a failure are
+        returned, and the failure is raised by the next read
+        """
+        if self._pending_error is not None:
+            error, self._pending_error = self._pending_error, None
+            raise error
+
+        frames = []
+        try:
+            while len(frames) < batch_size:
+                frames.append(os.read(self.fd, size + self.vnet_header_size))
+        except BlockingIOError:
+            pass
+        except OSError as e:
+            if not frames:
+                raise
+            self._pending_error = e
+
+        if self.vnet_header_size:
+            frames = [Tap.strip_vnet_header(frame, self.vnet_header_size) for frame in frames]
+        return frames
+
+    async def send(self, frame: bytes):
+        if self.vnet_header_size:
+            # no offloads were used, so the header is all zeros
+            frame = bytes(self.vnet_header_size) + frame
+
+        while True:
+            try:
+                os.write(self.fd, frame)
+                return
+            except BlockingIOError:
+                await self._wait_for_writable()
+
+    async def _wait_for_writable(self):
+        writable = self.loop.create_future()
+        self.loop.add_writer(self.fd, lambda: writable.done() or writable.set_result(None))
+        try:
+            await writable
+        finally:
+            self.loop.remove_writer(self.fd)
+
+    def close(self):
+        self.stop_reading()
+        os.close(self.fd)
+
+
+class Tap:
+    """
+    A tap device (/dev/net/tun). The kernel passes us only the frames that are routed to the device, and the frames we
+    write are received by the kernel as if they came from the device.
+    """
+    TUN_PATH = '/dev/net/tun'
+    TUNSETIFF = 0x400454ca
+    TUNSETVNETHDRSZ = 0x400454d8
+    IFF_TAP = 0x0002
+    IFF_MULTI_QUEUE = 0x0100
+    IFF_NO_PI = 0x1000
+    IFF_VNET_HDR = 0x4000
+    IFREQ_STRUCT = struct.Struct('16sH22x')
+
+    # struct virtio_net_hdr
+    VNET_HEADER_STRUCT = struct.Struct('=BBHHHH')
+    VNET_HDR_F_NEEDS_CSUM = 1
+
+    def __init__(self, name: str, queue_count: int = 1, vnet_header: bool = False):
+        """
+        Create the device (or attach to an existing one with the same flags) and open queue_count queues to it.
+        @param vnet_header - every frame starts with a virtio net header. The kernel can give us then frames whose
+                             checksum it didn't calculate, and we complete the checksum
+        """
+        self.name = name
+        flags = self.IFF_TAP | self.IFF_NO_PI
+        if queue_count > 1:
+            flags |= self.IFF_MULTI_QUEUE
+        if vnet_header:
+            flags |= self.IFF_VNET_HDR
+        vnet_header_size = self.VNET_HEADER_STRUCT.size if vnet_header else 0
+
+        self.queues = []  # type: List[TapQueue]
+        try:
+            for _ in range(queue_count):
+                fd = os.open(self.TUN_PATH, os.O_RDWR | os.O_NONBLOCK)
+                self.queues.append(TapQueue(fd, vnet_header_size))
+                fcntl.ioctl(fd, self.TUNSETIFF, self.IFREQ_STRUCT.pack(name.encode(), flags))
+                if vnet_header:
+                    fcntl.ioctl(fd, self.TUNSETVNETHDRSZ, struct.pack('i', vnet_header_size))
+        except OSError:
+            self.close()
+            raise
+
+    @classmethod
+    def strip_vnet_header(cls, frame: bytes, vnet_header_size: int) -> bytes:
+        """
+        Remove the virtio net header from the frame, and calculate the checksum if the kernel left it for us.
+        """
+        flags, _, _, _, csum_start, csum_offset = cls.VNET_HEADER_STRUCT.unpack_from(frame)
+        frame = frame[vnet_header_size:]
+        if flags & cls.VNET_HDR_F_NEEDS_CSUM:
+            # the checksum field has the sum of the pseudo header, so the checksum of the rest of the packet from
+            # csum_start is the full checksum
+            checksum = calculate_checksum(frame[csum_start:])
+            position = csum_start + csum_offset
+            frame = frame[:position] + struct.pack('>H', checksum) + frame[position + 2:]
+        return frame
+
+    def close(self):
+        for queue in self.queues:
+            queue.close()
+        self.queues = []
@@ -0,0 +1,80 @@
+from os_utils.tap import Tap
+from os_utils.sniffer import Sniffer
+from adapter_interface import NetworkAdapterInterface
+from task_creator import TaskCreator
+from stack import NetworkStack, stack as default_stack
+from ip_utils import IPAddress
+
+from typing import Optional, List
+
+
+class TapNetworkAdapter(NetworkAdapterInterface, TaskCreator):
+    """
+    An adapter over a tap device. Unlike SnifferNetworkAdapter, it gets only the frames the kernel routes to the
+    device, and needs no veth pair: the other side of the device is the kernel itself.
+    Every queue of the device is read independently, and its frames are passed to the stack in batches.
+    The device is created by the adapter, and should be brought up (`ip link set dev <device> up`) and given an
+    address in the network of the adapter to talk with the kernel.
+    """
+    # the offsets of the ip addresses and the ports in an ethernet frame with a basic ip header
+    FLOW_START = 26
+    FLOW_END = 38
+
+    def __init__(self, device: str, mac: str, ip: IPAddress, netmask: IPAddress, gateway: IPAddress, mtu: int,
+                 queue_count: int = 1, vnet_header: bool = False, batch_size: int = Sniffer.DEFAULT_BATCH_SIZE,
+                 stack: NetworkStack = None):
+        """
+        @param mtu - the max size of a frame, with its ethernet header (1514 for the usual ip mtu of 1500)
+        @param queue_count - the number of queues of the device (more than 1 uses IFF_MULTI_QUEUE)
+        @param vnet_header - use IFF_VNET_HDR. See `Tap`
+        @param batch_size - the max number of frames read from a queue and passed to the stack at once
+        @param stack - the stack this adapter passes its frames to. the global stack if not given
+        """
+        super().__init__()
+        self.stack = stack if stack is not None else default_stack
+        self._mac = mac
+        self._ip = ip
+        self._netmask = netmask
+        self._gateway = gateway
+        self._mtu = mtu
+        self.tap = Tap(device, queue_count, vnet_header)
+        for queue in self.tap.queues:
+            queue.start_reading(self._add_packets, self._mtu, batch_size)
+
+    def _add_packets(self, packets):
+        self.stack.add_packets(packets, self)
+
+    def poll(self, max_count: int) -> List[bytes]:
+        """
+        Read up to max_count waiting frames from all the queues without blocking, for busy polling (see `BusyPoller`).
+        Once the adapter is polled, it stops passing frames to the stack by itself
+        """
+        frames = []
+        for queue in self.tap.queues:
+            queue.stop_reading()
+            frames += queue.read_batch(self._mtu, max_count - len(frames))
+        return frames
+
+    @property
+    def mac(self) -> str:
+        return self._mac
+
+    @property
+    def ip(self) -> IPAddress:
+        return self._ip
+
+    @property
+    def netmask(self) -> IPAddress:
+        return self._netmask
+
+    @property
+    def gateway(self) -> Optional[IPAddress]:
+        return self._gateway
+
+    async def send(self, packet: bytes):
+        # keep the packets of a flow on the same queue, so they aren't reordered
+        queue = self.tap.queues[hash(packet[self.FLOW_START:self.FLOW_END]) % len(self.tap.queues)]
+        await queue.send(packet)
+
+    def close(self):
+        self.tap.close()
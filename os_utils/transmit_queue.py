@@ -0,0 +1,113 @@
+import asyncio
+import errno
+import socket
+from collections import deque
+from typing import Deque, List
+
+
+class TransmitQueue:
+    """
+    A transmit queue for a non-blocking socket.
+    A frame is sent right away when nothing is queued before it. If the socket would block, the frame is queued, and a
+    single writer sends the queued frames, a batch at a time, whenever the socket is writable.
+    When max_packets frames are queued, senders wait for room (or the frame is dropped, if drop_when_full is set).
+    Senders that still wait for room when the queue is closed get an OSError (EBADF), like a send on a closed socket.
+    """
+    DEFAULT_MAX_PACKETS = 1024
+    DEFAULT_BATCH_SIZE = 64
+
+    def __init__(self, sock: socket.socket, max_packets: int = DEFAULT_MAX_PACKETS,
+                 batch_size: int = DEFAULT_BATCH_SIZE, drop_when_full: bool = False):
+        self.sock = sock
+        self.max_packets = max_packets
+        self.batch_size = batch_size
+        self.drop_when_full = drop_when_full
+        self.loop = asyncio.get_event_loop()
+        self._queue = deque()  # type: Deque[bytes]
+        self._room_waiters = deque()  # type: Deque[asyncio.Future]
+        self._writing = False
+        # frames that couldn't be sent right away, and frames that were not sent at all
+        self.deferred_packets = 0
+        self.dropped_packets = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    async def send(self, frame: bytes):
+        if not self._queue:
+            try:
+                self.sock.send(frame)
+                return
+            except BlockingIOError:
+                pass
+            except OSError:
+                self.dropped_packets += 1
+                return
+
+        await self._enqueue(frame)
+
+    async def send_many(self, frames: List[bytes]):
+        for frame in frames:
+            await self.send(frame)
+
+    async def _enqueue(self, frame: bytes):
+        while len(self._queue) >= self.max_packets:
+            if self.drop_when_full:
+                self.dropped_packets += 1
+                return
+            waiter = self.loop.create_future()
+            self._room_waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # we were woken up for room we won't use, pass the wakeup on
+                    self._wake_room_waiters(1)
+                raise
+            finally:
+                if waiter in self._room_waiters:
+                    self._room_waiters.remove(waiter)
+
+        self._queue.append(frame)
+        self.deferred_packets += 1
+        if not self._writing:
+            self._writing = True
+            self.loop.add_writer(self.sock.fileno(), self._write_batch)
+
+    def _write_batch(self):
+        for _ in range(min(self.batch_size, len(self._queue))):
+            try:
+                self.sock.send(self._queue[0])
+            except BlockingIOError:
+                break
+            except OSError:
+                self.dropped_packets += 1
+            self._queue.popleft()
+
+        if not self._queue:
+            self.loop.remove_writer(self.sock.fileno())
+            self._writing = False
+
+        self._wake_room_waiters(self.max_packets - len(self._queue))
+
+    def _wake_room_waiters(self, room: int):
+        """
+        Wake up to `room` of the oldest senders that are still waiting for room
+        """
+        while room > 0 and self._room_waiters:
+            waiter = self._room_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                room -= 1
+
+    def close(self):
+        if self._writing:
+            self.loop.remove_writer(self.sock.fileno())
+            self._writing = False
+        self.dropped_packets += len(self._queue)
+        self._queue.clear()
+        for waiter in self._room_waiters:
+            if not waiter.done():
+                # not cancel(), since the senders weren't cancelled, they failed to send
+                waiter.set_exception(OSError(errno.EBADF, 'the transmit queue was closed'))
+        self._room_waiters.clear()
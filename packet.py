@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Dict, Optional
 
 
 class Layer:
@@ -13,11 +13,19 @@ class Packet:
     This object represents a packet while in processing stack.
     It starts with the packet as raw bytes, and as we process the packet, every layer should call "add_layer" to declare
     a part of the data as a layer.
+    The layers and the current packet are memoryviews over the raw packet, so processing the packet doesn't copy it.
     """
-    def __init__(self, packet: bytes):
-        self._rest_of_packet = packet
+    def __init__(self, packet: bytes, received_time: Optional[int] = None, checksum_verified: bool = False):
+        """
+        @param received_time - the time the packet got to the stack, in time.perf_counter_ns units
+        @param checksum_verified - the checksums of the packet were already verified (see `ValidationStage`), so the
+                                   protocols don't need to verify them again
+        """
+        self._rest_of_packet = memoryview(packet)
         self._all_packet = packet
         self._layers = {}  # type: Dict[str, Layer]
+        self.received_time = received_time
+        self.checksum_verified = checksum_verified
 
     def add_layer(self, name: str, attributes: dict, size: int, tail_size=0):
         """
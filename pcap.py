@@ -0,0 +1,223 @@
+import mmap
+import struct
+import time
+from typing import Iterator, Tuple, Optional
+
+
+class PcapFormatException(Exception):
+    pass
+
+
+class PcapReader:
+    """
+    Reads the ethernet frames of a pcap or pcapng file.
+    The file is memory mapped, and the frames are memoryviews into it, so reading doesn't copy them. The frames are
+    valid until the reader is closed.
+    """
+    PCAP_MAGIC_MICROSECONDS = 0xa1b2c3d4
+    PCAP_MAGIC_NANOSECONDS = 0xa1b23c4d
+    PCAPNG_SECTION_HEADER_BLOCK = 0x0a0d0d0a
+    PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+    PCAPNG_INTERFACE_DESCRIPTION_BLOCK = 1
+    PCAPNG_SIMPLE_PACKET_BLOCK = 3
+    PCAPNG_ENHANCED_PACKET_BLOCK = 6
+    PCAPNG_OPTION_END = 0
+    PCAPNG_OPTION_TIMESTAMP_RESOLUTION = 9
+    LINKTYPE_ETHERNET = 1
+
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        if len(self._view) < 4:
+            raise PcapFormatException('file is too short')
+
+    def __iter__(self) -> Iterator[Tuple[int, memoryview]]:
+        """
+        Iterate over the frames of the file, as (timestamp in nanoseconds, frame)
+        """
+        magic, = struct.unpack_from('=I', self._view)
+        if magic == self.PCAPNG_SECTION_HEADER_BLOCK:
+            return self._read_pcapng()
+        return self._read_pcap()
+
+    def _read_pcap(self) -> Iterator[Tuple[int, memoryview]]:
+        data = self._view
+        for endian in '<>':
+            magic, = struct.unpack_from(endian + 'I', data)
+            if magic in (self.PCAP_MAGIC_MICROSECONDS, self.PCAP_MAGIC_NANOSECONDS):
+                break
+        else:
+            raise PcapFormatException('not a pcap or pcapng file')
+
+        fraction = 1 if magic == self.PCAP_MAGIC_NANOSECONDS else 1000
+        linktype, = struct.unpack_from(endian + 'I', data, 20)
+        if linktype & 0xffff != self.LINKTYPE_ETHERNET:
+            raise PcapFormatException(f'link type {linktype} is not ethernet')
+
+        record = struct.Struct(endian + 'IIII')
+        offset = 24
+        end = len(data)
+        while offset + record.size <= end:
+            seconds, fractions, captured_length, _ = record.unpack_from(data, offset)
+            offset += record.size
+            yield seconds * 1000000000 + fractions * fraction, data[offset:offset + captured_length]
+            offset += captured_length
+
+    def _read_pcapng(self) -> Iterator[Tuple[int, memoryview]]:
+        data = self._view
+        offset = 0
+        endian = '<'
+        # (link type, timestamp units per second) of every interface in the current section
+        interfaces = []
+        while offset + 12 <= len(data):
+            if struct.unpack_from('=I', data, offset)[0] == self.PCAPNG_SECTION_HEADER_BLOCK:
+                byte_order, = struct.unpack_from('<I', data, offset + 8)
+                endian = '<' if byte_order == self.PCAPNG_BYTE_ORDER_MAGIC else '>'
+                interfaces = []
+
+            block_type, block_length = struct.unpack_from(endian + 'II', data, offset)
+            if block_length < 12:
+                raise PcapFormatException('bad block length')
+            body = offset + 8
+
+            if block_type == self.PCAPNG_INTERFACE_DESCRIPTION_BLOCK:
+                linktype, = struct.unpack_from(endian + 'H', data, body)
+                units = self._timestamp_units(endian, body + 8, offset + block_length - 4)
+                interfaces.append((linktype, units))
+            elif block_type == self.PCAPNG_ENHANCED_PACKET_BLOCK:
+                interface, high, low, captured_length, _ = struct.unpack_from(endian + 'IIIII', data, body)
+                if interface >= len(interfaces):
+                    raise PcapFormatException(f'packet of interface {interface}, which has no description')
+                linktype, units = interfaces[interface]
+                if linktype == self.LINKTYPE_ETHERNET:
+                    timestamp = ((high << 32) | low) * 1000000000 // units
+                    yield timestamp, data[body + 20:body + 20 + captured_length]
+            elif block_type == self.PCAPNG_SIMPLE_PACKET_BLOCK:
+                original_length, = struct.unpack_from(endian + 'I', data, body)
+                captured_length = min(original_length, block_length - 16)
+                if not interfaces:
+                    raise PcapFormatException('simple packet in a section without an interface description')
+                if interfaces[0][0] == self.LINKTYPE_ETHERNET:
+                    # simple packets have no timestamp
+                    yield 0, data[body + 4:body + 4 + captured_length]
+
+            offset += block_length
+
+    def _timestamp_units(self, endian: str, offset: int, end: int) -> int:
+        """
+        Find the timestamp resolution in the options of an interface description block (microseconds by default)
+        """
+        while offset + 4 <= end:
+            code, length = struct.unpack_from(endian + 'HH', self._view, offset)
+            if code == self.PCAPNG_OPTION_END:
+                break
+            if code == self.PCAPNG_OPTION_TIMESTAMP_RESOLUTION:
+                resolution = self._view[offset + 4]
+                return 2 ** (resolution & 0x7f) if resolution & 0x80 else 10 ** resolution
+            offset += 4 + (length + 3) // 4 * 4
+        return 1000000
+
+    def close(self):
+        self._view.release()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+
+class PcapWriter:
+    """
+    Writes ethernet frames to a pcap file (with nanosecond timestamps), or to a pcapng file if pcapng is set. Only
+    pcapng files can keep a comment for every frame.
+    Frames are collected in a buffer, which is written to the file when it has more than buffer_size bytes, so writing
+    many small frames doesn't cost a syscall per frame.
+    """
+    HEADER_STRUCT = struct.Struct('=IHHiIII')
+    RECORD_STRUCT = struct.Struct('=IIII')
+    PCAPNG_SECTION_HEADER_STRUCT = struct.Struct('=IIIHHqI')
+    PCAPNG_INTERFACE_DESCRIPTION_STRUCT = struct.Struct('=IIHHIHHB3xHHI')
+    PCAPNG_ENHANCED_PACKET_STRUCT = struct.Struct('=IIIIIII')
+    PCAPNG_OPTION_STRUCT = struct.Struct('=HH')
+    PCAPNG_OPTION_COMMENT = 1
+    PCAPNG_NANOSECONDS_RESOLUTION = 9
+    DEFAULT_BUFFER_SIZE = 1 << 20
+
+    def __init__(self, path: str, snaplen: int = 65535, buffer_size: int = DEFAULT_BUFFER_SIZE, pcapng: bool = False):
+        self._file = open(path, 'wb')
+        self.snaplen = snaplen
+        self.buffer_size = buffer_size
+        self.pcapng = pcapng
+        if pcapng:
+            self._buffer = bytearray(self.PCAPNG_SECTION_HEADER_STRUCT.pack(
+                PcapReader.PCAPNG_SECTION_HEADER_BLOCK, self.PCAPNG_SECTION_HEADER_STRUCT.size,
+                PcapReader.PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1, self.PCAPNG_SECTION_HEADER_STRUCT.size))
+            self._buffer += self.PCAPNG_INTERFACE_DESCRIPTION_STRUCT.pack(
+                PcapReader.PCAPNG_INTERFACE_DESCRIPTION_BLOCK, self.PCAPNG_INTERFACE_DESCRIPTION_STRUCT.size,
+                PcapReader.LINKTYPE_ETHERNET, 0, snaplen, PcapReader.PCAPNG_OPTION_TIMESTAMP_RESOLUTION, 1,
+                self.PCAPNG_NANOSECONDS_RESOLUTION, PcapReader.PCAPNG_OPTION_END, 0,
+                self.PCAPNG_INTERFACE_DESCRIPTION_STRUCT.size)
+        else:
+            self._buffer = bytearray(self.HEADER_STRUCT.pack(PcapReader.PCAP_MAGIC_NANOSECONDS, 2, 4, 0, 0, snaplen,
+                                                             PcapReader.LINKTYPE_ETHERNET))
+
+    def write(self, frame: bytes, timestamp: Optional[int] = None, comment: Optional[str] = None,
+              original_length: Optional[int] = None):
+        """
+        Add a frame to the file
+        @param timestamp - the time of the frame in nanoseconds since the epoch. now if not given
+        @param comment - a comment about the frame. only kept in pcapng files
+        @param original_length - the length of the frame before it was cut, if it was
+        """
+        if timestamp is None:
+            timestamp = time.time_ns()
+        captured = frame[:self.snaplen]
+        if original_length is None:
+            original_length = len(frame)
+        if self.pcapng:
+            self._write_enhanced_packet(captured, original_length, timestamp, comment)
+        else:
+            seconds, nanoseconds = divmod(timestamp, 1000000000)
+            self._buffer += self.RECORD_STRUCT.pack(seconds, nanoseconds, len(captured), original_length)
+            self._buffer += captured
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def _write_enhanced_packet(self, captured: bytes, original_length: int, timestamp: int, comment: Optional[str]):
+        options = b''
+        if comment is not None:
+            value = comment.encode()
+            options = self.PCAPNG_OPTION_STRUCT.pack(self.PCAPNG_OPTION_COMMENT, len(value)) + self._pad(value) + \
+                self.PCAPNG_OPTION_STRUCT.pack(PcapReader.PCAPNG_OPTION_END, 0)
+        padded_length = (len(captured) + 3) // 4 * 4
+        block_length = self.PCAPNG_ENHANCED_PACKET_STRUCT.size + padded_length + len(options) + 4
+        self._buffer += self.PCAPNG_ENHANCED_PACKET_STRUCT.pack(
+            PcapReader.PCAPNG_ENHANCED_PACKET_BLOCK, block_length, 0, timestamp >> 32, timestamp & 0xffffffff,
+            len(captured), original_length)
+        self._buffer += self._pad(captured)
+        self._buffer += options
+        self._buffer += struct.pack('=I', block_length)
+
+    @staticmethod
+    def _pad(data: bytes) -> bytes:
+        return bytes(data) + b'\x00' * (-len(data) % 4)
+
+    def flush(self):
+        self._file.write(self._buffer)
+        self._file.flush()
+        self._buffer.clear()
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
@@ -0,0 +1,150 @@
+import asyncio
+import time
+from typing import Optional, List
+
+from adapter_interface import NetworkAdapterInterface
+from task_creator import TaskCreator
+from stack import NetworkStack, stack as default_stack
+from ip_utils import IPAddress
+from pcap import PcapReader, PcapWriter
+
+
+class PcapWriterAdapter(NetworkAdapterInterface):
+    """
+    An adapter that records every frame sent through it to a pcap file, instead of sending it.
+    If output_path is None, sent frames are dropped.
+    """
+    def __init__(self, mac: str, ip: IPAddress, netmask: IPAddress, gateway: Optional[IPAddress] = None,
+                 output_path: Optional[str] = None, buffer_size: int = PcapWriter.DEFAULT_BUFFER_SIZE):
+        self._mac = mac
+        self._ip = ip
+        self._netmask = netmask
+        self._gateway = gateway
+        self.writer = PcapWriter(output_path, buffer_size=buffer_size) if output_path is not None else None
+        self.sent_packets = 0
+
+    @property
+    def mac(self) -> str:
+        return self._mac
+
+    @property
+    def ip(self) -> IPAddress:
+        return self._ip
+
+    @property
+    def netmask(self) -> IPAddress:
+        return self._netmask
+
+    @property
+    def gateway(self) -> Optional[IPAddress]:
+        return self._gateway
+
+    async def send(self, packet: bytes):
+        self.sent_packets += 1
+        if self.writer is not None:
+            self.writer.write(packet)
+
+    async def send_many(self, packets: List[bytes]):
+        self.sent_packets += len(packets)
+        if self.writer is not None:
+            now = time.time_ns()
+            for packet in packets:
+                self.writer.write(packet, now)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class PcapReplayAdapter(PcapWriterAdapter, TaskCreator):
+    """
+    An adapter that receives the frames of a pcap or pcapng file, and records what is sent through it like
+    PcapWriterAdapter.
+    The frames are passed to the stack in batches, as fast as possible, or at the pace they were captured if realtime
+    is set. `done` is resolved when the whole file was handled, and `report` describes the throughput of the replay.
+    """
+    DEFAULT_BATCH_SIZE = 64
+
+    def __init__(self, input_path: str, mac: str, ip: IPAddress, netmask: IPAddress,
+                 gateway: Optional[IPAddress] = None, output_path: Optional[str] = None, realtime: bool = False,
+                 batch_size: int = DEFAULT_BATCH_SIZE, stack: NetworkStack = None):
+        """
+        @param batch_size - the max number of frames passed to the stack at once
+        @param stack - the stack this adapter passes its frames to. the global stack if not given
+        """
+        PcapWriterAdapter.__init__(self, mac, ip, netmask, gateway, output_path)
+        TaskCreator.__init__(self)
+        self.reader = PcapReader(input_path)
+        self.realtime = realtime
+        self.batch_size = batch_size
+        self.stack = stack if stack is not None else default_stack
+        self.received_packets = 0
+        self.received_bytes = 0
+        self.elapsed = 0.0
+        self.done = asyncio.get_event_loop().create_future()
+        self._replay_task = self.create_task(self.replay())
+
+    async def replay(self):
+        """
+        A task for packet processing
+        Passes the frames of the file to the stack, and resolves `done` in the end (with the error of the replay if it
+        failed, or cancelled if the replay was cancelled)
+        """
+        start = time.perf_counter()
+        first_timestamp = None
+        batch = []
+        try:
+            for timestamp, frame in self.reader:
+                if self.realtime:
+                    if first_timestamp is None:
+                        first_timestamp = timestamp
+                    delay = start + (timestamp - first_timestamp) / 1e9 - time.perf_counter()
+                    if delay > 0:
+                        await self._handle_batch(batch)
+                        await asyncio.sleep(delay)
+
+                batch.append(frame)
+                if len(batch) >= self.batch_size:
+                    await self._handle_batch(batch)
+            await self._handle_batch(batch)
+            self.done.set_result(None)
+        except Exception as e:
+            self.done.set_exception(e)
+            raise
+        finally:
+            self.elapsed = time.perf_counter() - start
+            if not self.done.done():
+                # the replay was cancelled, so whoever waits for it must not wait forever
+                self.done.cancel()
+
+    async def _handle_batch(self, batch: List[memoryview]):
+        if not batch:
+            return
+        self.received_packets += len(batch)
+        self.received_bytes += sum(len(frame) for frame in batch)
+        await self.stack.handle_packets(batch, self)
+        batch.clear()
+        # let other tasks (like the receivers of the packets) run between batches
+        await asyncio.sleep(0)
+
+    @property
+    def packets_per_second(self) -> float:
+        return self.received_packets / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.received_bytes / self.elapsed if self.elapsed else 0.0
+
+    def report(self) -> str:
+        return f'replayed {self.received_packets} packets ({self.received_bytes} bytes) in {self.elapsed:.3f}s: ' \
+               f'{self.packets_per_second:.0f} pps, {self.bytes_per_second:.0f} bytes/s'
+
+    def close(self):
+        for task in list(self.tasks):
+            task.cancel()
+        super().close()
+        if self._replay_task.done():
+            self.reader.close()
+        else:
+            # the frames of the replay are views into the reader, so it's closed when the replay stops using them
+            self._replay_task.add_done_callback(lambda _: self.reader.close())
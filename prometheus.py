@@ -0,0 +1,70 @@
+import asyncio
+import os
+from typing import Optional
+
+from stack import NetworkStack, stack as default_stack
+
+
+class PrometheusExporter:
+    """
+    Exports the counters of a stack (see `NetworkStack.stats`) in the prometheus text format, either to a file (for
+    the textfile collector of node_exporter) or to whoever connects to a local http server.
+    """
+    PREFIX = 'netstack'
+    COUNTERS = ('rx_packets', 'rx_bytes', 'tx_packets', 'tx_bytes')
+
+    def __init__(self, stack: NetworkStack = None):
+        """
+        @param stack - the stack to export. the global stack if not given
+        """
+        self.stack = stack if stack is not None else default_stack
+        self._server = None  # type: Optional[asyncio.AbstractServer]
+
+    def format(self) -> str:
+        stats = self.stack.stats()
+        lines = []
+        for kind, label in (('adapter', 'adapters'), ('protocol', 'protocols')):
+            for counter in self.COUNTERS + ('drops',):
+                name = f'{self.PREFIX}_{kind}_{counter}_total'
+                lines.append(f'# TYPE {name} counter')
+                for key, counters in stats[label].items():
+                    if counter != 'drops':
+                        lines.append(f'{name}{{{kind}="{key}"}} {counters[counter]}')
+                        continue
+                    for reason, count in counters['drops'].items():
+                        lines.append(f'{name}{{{kind}="{key}",reason="{reason}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str):
+        """
+        Write the counters to the given file. The file is replaced at once, so a reader never sees half of it
+        """
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(self.format())
+        os.replace(temp_path, path)
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 9100):
+        """
+        Start an http server that answers every request with the counters
+        """
+        self._server = await asyncio.start_server(self._handle_client, host, port)
+        return self._server
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # the request itself doesn't matter, only its end
+            await reader.readuntil(b'\r\n\r\n')
+            body = self.format().encode()
+            writer.write(b'HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n' +
+                         f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
@@ -0,0 +1,68 @@
+import time
+from typing import Dict, Hashable
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter.
+    The bucket gets `rate` tokens every second, up to `burst` tokens. Every allowed event consumes a token.
+    """
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last_update = time.monotonic()
+
+    def consume(self, tokens: float = 1) -> bool:
+        """
+        Try to consume tokens from the bucket.
+        Returns True if there were enough tokens, which means the event is allowed
+        """
+        if not self.allows(tokens):
+            return False
+        self._tokens -= tokens
+        return True
+
+    def allows(self, tokens: float = 1) -> bool:
+        """
+        Check if there are enough tokens in the bucket, without consuming them
+        """
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_update) * self.rate)
+        self._last_update = now
+        return self._tokens >= tokens
+
+
+class KeyedRateLimiter:
+    """
+    A token bucket per key (for example, per destination ip).
+    Only the max_keys most recently used keys are remembered, so the memory is bounded no matter how many keys are seen.
+    """
+    def __init__(self, rate: float, burst: float, max_keys: int = 4096):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = {}  # type: Dict[Hashable, TokenBucket]
+
+    def consume(self, key: Hashable, tokens: float = 1) -> bool:
+        """
+        Try to consume tokens from the bucket of the given key. See `TokenBucket.consume`
+        """
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) >= self.max_keys:
+                # forget the least recently used key
+                del self._buckets[next(iter(self._buckets))]
+        # reinsert, so the order of the dict is the order of the last use
+        self._buckets[key] = bucket
+        return bucket.consume(tokens)
+
+    def allows(self, key: Hashable, tokens: float = 1) -> bool:
+        """
+        Check if the bucket of the given key has enough tokens, without consuming them. See `TokenBucket.allows`
+        """
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return tokens <= self.burst
+        return bucket.allows(tokens)
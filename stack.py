@@ -1,13 +1,19 @@
 from __future__ import annotations
 import abc
-from typing import Optional, Type, List
-from treelib import Tree
+import asyncio
+import time
+import weakref
+from typing import Optional, Type, List, Tuple, Callable, Dict
+from treelib import Tree, Node
 
 from route_table import RouteTable, RouteEntry
 from ip_utils import IPAddress
 from adapter_interface import NetworkAdapterInterface
 from task_creator import TaskCreator
 from packet import Packet
+from validation import ValidationStage
+from stats import Counters, DropReason
+from tracing import Tracer
 
 
 class ProtocolInterface(abc.ABC):
@@ -15,6 +21,13 @@ class ProtocolInterface(abc.ABC):
     PROTOCOL_ID = None
     NEXT_PROTOCOL = None
 
+    def __init__(self, stack: Optional[NetworkStack] = None):
+        """
+        :param stack: the stack this protocol instance belongs to. the global stack if not given
+        """
+        self.stack = stack if stack is not None else get_default_stack()
+        self.counters = Counters()
+
     @abc.abstractmethod
     async def build(self, adapter: NetworkAdapterInterface, packet: bytes, options: dict) -> bytes:
         """
@@ -38,14 +51,38 @@ class ProtocolInterface(abc.ABC):
         """
         pass
 
+    def drop(self, packet: Optional[Packet], reason: DropReason):
+        """
+        Count a packet this protocol dropped. Returns None, so a handler can `return self.drop(packet, reason)`
+        :param packet: the dropped packet, or None if it wasn't a received packet (like a packet we failed to send)
+        """
+        self.counters.drop(reason)
+        if self.stack.tracer is not None:
+            self.stack.tracer.dropped(self, packet, reason)
+
 
 class NetworkStack(TaskCreator):
-    _protocols = Tree()
+    """
+    A network stack. Every stack has its own adapters, routes and protocol instances (with their tables and open
+    ports), so many stacks can live in one process, e.g. one per thread, or two stacks talking to each other in a test.
+    Protocol types are registered to all the stacks at once. `stack` is the default global stack.
+    """
+    # the registered protocol types, in registration order (so a protocol comes after the protocol below it)
+    _protocol_types = []  # type: List[Type[ProtocolInterface]]
+    _instances = weakref.WeakSet()
 
     def __init__(self):
         self._route_table = RouteTable()
         self._adapters = []  # type: List[NetworkAdapterInterface]
+        self._protocols = Tree()
+        self._protocols_change_callbacks = []  # type: List[Callable[[], None]]
+        self._validation_stage = None  # type: Optional[ValidationStage]
+        self._adapter_counters = {}  # type: Dict[NetworkAdapterInterface, Counters]
+        self.tracer = None  # type: Optional[Tracer]
         super().__init__()
+        self._instances.add(self)
+        for protocol in self._protocol_types:
+            self._add_protocol(protocol)
 
     def add_adapter(self, adapter: NetworkAdapterInterface):
         """
@@ -61,6 +98,7 @@ class NetworkStack(TaskCreator):
         """
         self._route_table.remove_adapter(adapter)
         self._adapters.remove(adapter)
+        self._adapter_counters.pop(adapter, None)
 
     def get_adapter(self, ip: str) -> NetworkAdapterInterface:
         """
@@ -80,19 +118,107 @@ class NetworkStack(TaskCreator):
     @classmethod
     def register_protocol(cls, protocol: Type[ProtocolInterface]):
         """
-        Register a protocol to the stack. This protocol can be used now for building and handling packets
+        Register a protocol to all the stacks, existing and future ones. Every stack creates its own instance of the
+        protocol, which can be used now for building and handling packets
         """
+        cls._protocol_types.append(protocol)
+        for instance in list(cls._instances):
+            instance._add_protocol(protocol)
+
+    def _add_protocol(self, protocol: Type[ProtocolInterface]):
         parent = None
         if protocol.NEXT_PROTOCOL is not None:
-            parent = cls._protocols.get_node(protocol.NEXT_PROTOCOL)
-        cls._protocols.create_node(identifier=protocol, parent=parent, data=protocol())
+            parent = self._protocols.get_node(protocol.NEXT_PROTOCOL)
+        self._protocols.create_node(identifier=protocol, parent=parent, data=protocol(self))
+        for callback in list(self._protocols_change_callbacks):
+            callback()
+
+    def register_to_protocols_change(self, callback: Callable[[], None]):
+        """
+        Call the given callback every time a protocol is registered to the stack
+        """
+        self._protocols_change_callbacks.append(callback)
+
+    def unregister_from_protocols_change(self, callback: Callable[[], None]):
+        self._protocols_change_callbacks.remove(callback)
+
+    def get_next_protocol_ids(self, protocol_type: type) -> List[int]:
+        """
+        Get the ids of the registered protocols above the given protocol (for example, the ethertypes we handle)
+        """
+        if not self._protocols.contains(protocol_type):
+            return []
+        return [node.data.PROTOCOL_ID for node in self._protocols.children(protocol_type)]
 
     def add_packet(self, packet: bytes, adapter: NetworkAdapterInterface):
         """
         Add a new packet to the stack.
         This should be called by adapters when they get a new packet
         """
-        self.create_task(self._handle_packet(packet, adapter))
+        self.create_task(self._handle_packet(packet, adapter, time.perf_counter_ns()))
+
+    def add_packets(self, packets: List[bytes], adapter: NetworkAdapterInterface):
+        """
+        Add a batch of new packets to the stack. They are handled in order, by a single task.
+        This should be called by adapters that read many packets at once
+        """
+        self.create_task(self.handle_packets(packets, adapter))
+
+    def handle_packet_now(self, packet: bytes, adapter: NetworkAdapterInterface,
+                          received_time: Optional[int] = None) -> bool:
+        """
+        Handle the packet right away, through all the protocols, without waiting for the loop.
+        If a protocol has to wait for something (like a mac resolution), the rest of the handling continues in a task.
+        Like in a task, an error of the handling is reported to the exception handler of the loop, and isn't raised.
+        Returns True if the packet was handled completely
+
+        The packet is handled in an eager task (see `create_eager_task`), so anything that looks for the current task
+        while handling the packet (like asyncio.timeout) gets the task of the packet, and not the task of the caller.
+        """
+        task = self.create_eager_task(self._handle_packet(packet, adapter, received_time))
+        if not task.done():
+            return False
+        if not task.cancelled() and task.exception() is not None:
+            self._report_handle_error(task.exception())
+        return True
+
+    @staticmethod
+    def _report_handle_error(error: Exception):
+        asyncio.get_running_loop().call_exception_handler({'message': 'Exception while handling a packet',
+                                                           'exception': error})
+
+    async def handle_packets(self, packets: List[bytes], adapter: NetworkAdapterInterface):
+        """
+        Handle the given packets in order, and return when the stack is done with them.
+        Packets may be memoryviews over a buffer of the adapter. The stack doesn't keep references to the packets after
+        this returns, so the adapter can reuse the buffer.
+        """
+        received_time = time.perf_counter_ns()
+        stage = self._validation_stage
+        if stage is not None and stage.enabled:
+            valid = await stage.validate(packets)
+            # the protocols verify the rejected packets again, so they are counted and dropped like without the stage
+            for packet, is_valid in zip(packets, valid):
+                await self._handle_packet(packet, adapter, received_time, checksum_verified=is_valid)
+            return
+
+        for packet in packets:
+            await self._handle_packet(packet, adapter, received_time)
+
+    def set_tracer(self, tracer: Optional[Tracer]):
+        """
+        Trace the packets of this stack with the given tracer. None to stop tracing
+        """
+        self.tracer = tracer
+
+    def set_validation_stage(self, stage: Optional[ValidationStage]):
+        """
+        Verify the checksums of the batches of packets passed to `handle_packets` (and `add_packets`) with the given
+        stage, before handling them. None to verify them in the protocols again.
+        Single packets (`add_packet` and `handle_packet_now`) don't go through the stage, and their checksums are
+        verified in the protocols
+        """
+        self._validation_stage = stage
 
     async def send(self, top_protocol: ProtocolInterface, dst_ip: IPAddress,
                    expected_adapter: NetworkAdapterInterface = None, **options):
@@ -105,6 +231,51 @@ class NetworkStack(TaskCreator):
         @param options - another information about the packet. it will be passed to the protocols of packet.
                          this information is different per every packet type
         """
+        adapter, packet = await self.build(top_protocol, dst_ip, expected_adapter, **options)
+        counters = self.adapter_counters(adapter)
+        counters.tx_packets += 1
+        counters.tx_bytes += len(packet)
+        if self.tracer is not None:
+            self.tracer.sent(adapter, packet)
+        await adapter.send(packet)
+
+    def count_sent(self, adapter: NetworkAdapterInterface, packets: List[bytes]):
+        """
+        Count packets that were given to the adapter without `send` (like a batch given to send_many)
+        """
+        counters = self.adapter_counters(adapter)
+        counters.tx_packets += len(packets)
+        counters.tx_bytes += sum(len(packet) for packet in packets)
+        if self.tracer is not None:
+            for packet in packets:
+                self.tracer.sent(adapter, packet)
+
+    def adapter_counters(self, adapter: NetworkAdapterInterface) -> Counters:
+        counters = self._adapter_counters.get(adapter)
+        if counters is None:
+            counters = self._adapter_counters[adapter] = Counters()
+        return counters
+
+    def stats(self) -> dict:
+        """
+        A snapshot of the counters of every adapter (by its ip) and every protocol (by its name).
+        Every counters dict has rx/tx packets and bytes, and the number of drops by their reason
+        """
+        return {
+            'adapters': {str(adapter.ip): counters.snapshot() for adapter, counters in self._adapter_counters.items()},
+            'protocols': {node.identifier.__name__: node.data.counters.snapshot()
+                          for node in self._protocols.all_nodes_itr()},
+        }
+
+    async def build(self, top_protocol: ProtocolInterface, dst_ip: IPAddress,
+                    expected_adapter: NetworkAdapterInterface = None, copies: int = 1,
+                    **options) -> Tuple[NetworkAdapterInterface, bytes]:
+        """
+        Build a packet without sending it. See `send` for the other parameters.
+        Returns the adapter that should send the packet and the built packet
+        @param copies - the number of packets of this size that will be sent with the headers of this packet (like
+                        segments that reuse its lower headers). they are all counted in the tx counters of the protocols
+        """
         options['dst_ip'] = dst_ip
         adapter, gateway = self._route_table.route(dst_ip)
         if gateway is not None:
@@ -113,42 +284,106 @@ class NetworkStack(TaskCreator):
 
         packet = b''
         protocol_node = self._protocols.get_node(top_protocol)
+        if self.tracer is not None and self.tracer.sample():
+            return adapter, await self._build_traced_packet(adapter, protocol_node, copies, options)
+
         while protocol_node is not None:
-            packet = await protocol_node.data.build(adapter, packet, options)
-            options['previous_protocol_id'] = protocol_node.data.PROTOCOL_ID
+            protocol = protocol_node.data
+            packet = await protocol.build(adapter, packet, options)
+            protocol.counters.tx_packets += copies
+            protocol.counters.tx_bytes += len(packet) * copies
+            options['previous_protocol_id'] = protocol.PROTOCOL_ID
             protocol_node = self._protocols.parent(protocol_node.identifier)
 
-        await adapter.send(packet)
+        return adapter, packet
 
-    @classmethod
-    def get_protocol(cls, protocol_type: type) -> ProtocolInterface:
+    async def _build_traced_packet(self, adapter: NetworkAdapterInterface, protocol_node: Node, copies: int,
+                                   options: dict) -> bytes:
+        """
+        `build` of a sampled packet, which records the time every protocol took to build its part
+        """
+        packet = b''
+        while protocol_node is not None:
+            protocol = protocol_node.data
+            start = time.perf_counter_ns()
+            packet = await protocol.build(adapter, packet, options)
+            self.tracer.record_build(protocol, time.perf_counter_ns() - start)
+            protocol.counters.tx_packets += copies
+            protocol.counters.tx_bytes += len(packet) * copies
+            options['previous_protocol_id'] = protocol.PROTOCOL_ID
+            protocol_node = self._protocols.parent(protocol_node.identifier)
+        return packet
+
+    def get_protocol(self, protocol_type: type) -> ProtocolInterface:
         """
         Get the protocol object of the given type
         """
-        return cls._protocols.get_node(protocol_type).data
+        return self._protocols.get_node(protocol_type).data
 
-    async def _handle_packet(self, packet_data: bytes, adapter: NetworkAdapterInterface):
+    async def _handle_packet(self, packet_data: bytes, adapter: NetworkAdapterInterface,
+                             received_time: Optional[int] = None, checksum_verified: bool = False):
         """
         The task implementation of handling a packet.
         Iterating through the protocols until handling the whole packet
         """
+        counters = self._adapter_counters.get(adapter)
+        if counters is None:
+            counters = self.adapter_counters(adapter)
+        counters.rx_packets += 1
+        counters.rx_bytes += len(packet_data)
+
         protocol_node = self._protocols.get_node(self._protocols.root)
-        packet = Packet(packet_data)
-        while True:
-            protocol_id = await protocol_node.data.handle(packet, adapter)
-            if protocol_id is None:
-                # handler decided to dump packet
-                break
-
-            next_protocol_candidates = [node for node in self._protocols.children(protocol_node.identifier)
-                                        if node.data.PROTOCOL_ID == protocol_id]
-            if len(next_protocol_candidates) == 0:
-                # no handlers for the packet
-                break
-            elif len(next_protocol_candidates) == 1:
-                protocol_node = next_protocol_candidates[0]
-            else:
-                raise Exception("too many handlers for packet")
+        packet = Packet(packet_data, received_time, checksum_verified)
+        if self.tracer is not None:
+            await self._handle_traced_packet(packet, adapter, protocol_node)
+            return
+
+        while protocol_node is not None:
+            protocol = protocol_node.data
+            protocol.counters.rx_packets += 1
+            protocol.counters.rx_bytes += len(packet.current_packet)
+            protocol_id = await protocol.handle(packet, adapter)
+            protocol_node = self._next_protocol_node(protocol_node, protocol_id, packet)
+
+    async def _handle_traced_packet(self, packet: Packet, adapter: NetworkAdapterInterface, protocol_node: Node):
+        """
+        `_handle_packet` with a tracer: the tracer gets the packet, and the time of every protocol is recorded if the
+        packet is sampled
+        """
+        tracer = self.tracer
+        tracer.received(packet, adapter)
+        sampled = tracer.sample()
+        while protocol_node is not None:
+            protocol = protocol_node.data
+            protocol.counters.rx_packets += 1
+            protocol.counters.rx_bytes += len(packet.current_packet)
+            start = time.perf_counter_ns() if sampled else 0
+            protocol_id = await protocol.handle(packet, adapter)
+            if sampled:
+                tracer.record_handle(protocol, time.perf_counter_ns() - start)
+            protocol_node = self._next_protocol_node(protocol_node, protocol_id, packet)
+
+    def _next_protocol_node(self, protocol_node: Node, protocol_id: Optional[int], packet: Packet) -> Optional[Node]:
+        """
+        Find the protocol that should handle the packet after the given one. None if the packet was handled completely
+        """
+        if protocol_id is None:
+            # handler decided to dump packet
+            return None
+
+        next_protocol_candidates = [node for node in self._protocols.children(protocol_node.identifier)
+                                    if node.data.PROTOCOL_ID == protocol_id]
+        if len(next_protocol_candidates) == 0:
+            # no handlers for the packet
+            return protocol_node.data.drop(packet, DropReason.UNKNOWN_PROTOCOL)
+        elif len(next_protocol_candidates) == 1:
+            return next_protocol_candidates[0]
+        else:
+            raise Exception("too many handlers for packet")
 
 
 stack = NetworkStack()
+
+
+def get_default_stack() -> NetworkStack:
+    return stack
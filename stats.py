@@ -0,0 +1,42 @@
+from enum import Enum
+from typing import Dict
+
+
+class DropReason(Enum):
+    WRONG_MAC = 'wrong_mac'
+    WRONG_ADDRESS = 'wrong_address'
+    BAD_CHECKSUM = 'bad_checksum'
+    UNSUPPORTED = 'unsupported'
+    UNKNOWN_PROTOCOL = 'unknown_protocol'
+    TTL_EXCEEDED = 'ttl_exceeded'
+    NO_PORT = 'no_port'
+    QUEUE_FULL = 'queue_full'
+    RATE_LIMITED = 'rate_limited'
+    ARP_TIMEOUT = 'arp_timeout'
+
+
+class Counters:
+    """
+    The counters of an adapter or a protocol, like the SNMP MIB counters of a kernel stack.
+    The counters are plain ints that the stack increments as packets pass, so they are cheap enough to be always on.
+    """
+    __slots__ = ('rx_packets', 'rx_bytes', 'tx_packets', 'tx_bytes', 'drops')
+
+    def __init__(self):
+        self.rx_packets = 0
+        self.rx_bytes = 0
+        self.tx_packets = 0
+        self.tx_bytes = 0
+        self.drops = {}  # type: Dict[DropReason, int]
+
+    def drop(self, reason: DropReason, count: int = 1):
+        self.drops[reason] = self.drops.get(reason, 0) + count
+
+    def snapshot(self) -> dict:
+        return {
+            'rx_packets': self.rx_packets,
+            'rx_bytes': self.rx_bytes,
+            'tx_packets': self.tx_packets,
+            'tx_bytes': self.tx_bytes,
+            'drops': {reason.value: count for reason, count in self.drops.items()},
+        }
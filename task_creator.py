@@ -1,12 +1,112 @@
 import asyncio
+import collections.abc
+import contextvars
+import sys
+
+# tasks that start running when they are created (asyncio.Task's eager_start) came in python 3.12
+EAGER_TASKS = sys.version_info >= (3, 12)
+
+
+class _StartedCoroutine(collections.abc.Coroutine):
+    """
+    A coroutine whose first step is run by hand, in the context of the task that runs the rest of it.
+    This is how `TaskCreator.create_eager_task` starts a task eagerly before python 3.12
+    """
+    def __init__(self, coroutine):
+        self._coroutine = coroutine
+        self._first_result = None
+        self._done = False
+        self._started = False
+
+    def start(self) -> asyncio.Future:
+        """
+        Run the coroutine until it has to wait for something.
+        Returns a done future with its outcome if it finished, and None if the task should run the rest of it
+        """
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._first_result = self._coroutine.send(None)
+            return None
+        except StopIteration as e:
+            future.set_result(e.value)
+        except asyncio.CancelledError:
+            future.cancel()
+        except Exception as e:
+            future.set_exception(e)
+        except BaseException:
+            # like KeyboardInterrupt, which is raised to the creator of the task
+            self._done = True
+            raise
+        self._done = True
+        return future
+
+    def send(self, value):
+        if self._done:
+            # the coroutine finished in its first step, and its outcome was given to the creator of the task
+            raise StopIteration
+        if not self._started:
+            # the task passes on what the coroutine waits for, like the coroutine yielded it to the task
+            self._started = True
+            return self._first_result
+        return self._coroutine.send(value)
+
+    def throw(self, *args):
+        if not self._started and isinstance(self._first_result, asyncio.Future):
+            # the task is cancelled before its first step, so it cancels what the coroutine waits for, like a task does
+            self._first_result.cancel()
+        self._started = True
+        return self._coroutine.throw(*args)
+
+    def close(self):
+        self._coroutine.close()
+
+    def __await__(self):
+        return self
 
 
 class TaskCreator:
     def __init__(self):
-        self.tasks = []
+        self.tasks = set()
 
     def create_task(self, coroutine):
-        self.tasks.append(asyncio.create_task(coroutine))
+        # keep a reference to the task until it's done, so it won't be garbage collected
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def create_eager_task(self, coroutine) -> asyncio.Future:
+        """
+        Like create_task, but the coroutine starts running right away, in its own task, until it has to wait for
+        something. The returned task may be done already.
+        Before python 3.12 (see EAGER_TASKS), the task is created first, and the first step runs as its current task
+        (like eager_start does it). If the coroutine finishes in that step, a done future with its outcome is returned
+        instead of the task, which then ends without doing anything
+        """
+        loop = asyncio.get_running_loop()
+        if EAGER_TASKS:
+            task = asyncio.Task(coroutine, loop=loop, eager_start=True)
+        else:
+            started = _StartedCoroutine(coroutine)
+            context = contextvars.copy_context()
+            task = loop.create_task(started, context=context)
+            current_task = asyncio.current_task(loop)
+            if current_task is not None:
+                asyncio.tasks._leave_task(loop, current_task)
+            asyncio.tasks._enter_task(loop, task)
+            try:
+                outcome = context.run(started.start)
+            finally:
+                asyncio.tasks._leave_task(loop, task)
+                if current_task is not None:
+                    asyncio.tasks._enter_task(loop, current_task)
+            if outcome is not None:
+                return outcome
+
+        if not task.done():
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        return task
 
     def __del__(self):
         # TODO: wait for tasks
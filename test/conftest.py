@@ -4,8 +4,11 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(os.path.dirname(__file__))
 
 import pytest
+from scapy.all import Ether, IP
+from scapy.all import UDP as SCAPY_UDP
 from test.network_adapter import MockNetworkAdapter
-from stack import stack
+from stack import stack, NetworkStack
+from arp import ARP
 from os_utils.sniffer_adapter import SnifferNetworkAdapter
 from os_utils.udp_echo_server import UDPEchoServer
 from ip_utils import IPAddress
@@ -20,6 +23,35 @@ ADAPTER_IP = '1.1.1.1'
 ADAPTER_GATEWAY = '1.1.1.254'
 ADAPTER_NETMASK = '255.255.255.0'
 
+# the remote host of the packets built by build_udp_packet
+TEST_SRC_IP = IPAddress('1.1.1.1')
+TEST_SRC_MAC = 'aa:aa:aa:aa:aa:aa'
+TEST_SRC_PORT = 1234
+TEST_DST_PORT = 4242
+
+
+def build_udp_packet(adapter: MockNetworkAdapter, payload: bytes, dst_port: int = TEST_DST_PORT, dst_mac: str = None,
+                     ttl: int = 64, ip_checksum: int = None, udp_checksum: int = None,
+                     src_port: int = TEST_SRC_PORT) -> bytes:
+    """
+    A udp frame from the test host to the adapter. The checksums are calculated unless they are given
+    """
+    return (Ether(src=TEST_SRC_MAC, dst=dst_mac or adapter.mac) /
+            IP(src=TEST_SRC_IP, dst=adapter.ip, ttl=ttl, chksum=ip_checksum) /
+            SCAPY_UDP(sport=src_port, dport=dst_port, chksum=udp_checksum) / payload).build()
+
+
+def new_stack(adapter: MockNetworkAdapter = None):
+    """
+    A stack of its own with a single adapter (a new MockNetworkAdapter if not given), which knows the mac of the test
+    host, so tests that change the stack (like its tracer or handlers) don't change the global stack
+    """
+    network_stack = NetworkStack()
+    adapter = adapter if adapter is not None else MockNetworkAdapter()
+    network_stack.add_adapter(adapter)
+    network_stack.get_protocol(ARP).add_arp_entry(adapter, TEST_SRC_IP, TEST_SRC_MAC)
+    return network_stack, adapter
+
 
 @pytest.fixture(autouse=True)
 def adapter():
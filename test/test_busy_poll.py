@@ -0,0 +1,140 @@
+import pytest
+import asyncio
+
+from ipv4 import IPv4, TTLExceededHandler
+from udp_socket import UDPSocket
+from busy_poll import BusyPoller
+from network_adapter import MockNetworkAdapter
+from conftest import TEST_SRC_IP, TEST_SRC_PORT, TEST_DST_PORT, build_udp_packet, new_stack
+
+
+class PollingAdapter(MockNetworkAdapter):
+    def __init__(self):
+        super().__init__()
+        self.pending = []
+
+    def poll(self, max_count: int):
+        packets, self.pending = self.pending[:max_count], self.pending[max_count:]
+        return packets
+
+
+class WaitingTTLExceededHandler(TTLExceededHandler):
+    """
+    waits for a future (if there is one) when a packet's ttl is exceeded, so the handling of the packet can't finish
+    synchronously
+    """
+    def __init__(self):
+        self.future = None
+        self.handled = 0
+
+    async def handle_ttl_exceeded(self, packet):
+        if self.future is not None:
+            await self.future
+            self.handled += 1
+
+
+def new_poller(**options):
+    """
+    a poller of a stack of its own, so handlers registered in the test don't stay in the global stack
+    """
+    network_stack, adapter = new_stack(PollingAdapter())
+    poller = BusyPoller(network_stack, **options)
+    poller.add_adapter(adapter)
+    return poller, adapter
+
+
+@pytest.mark.asyncio
+async def test_run_to_completion():
+    poller, adapter = new_poller(batch_size=2)
+    received = []
+    with UDPSocket(stack=poller.stack) as s:
+        s.bind(None, TEST_DST_PORT)
+        s.set_recv_callback(received.append)
+        adapter.pending = [build_udp_packet(adapter, bytes([i])) for i in range(3)]
+
+        # the packets get to the socket without letting the loop run
+        assert poller.poll_once() == 2
+        assert poller.poll_once() == 1
+        assert received == [(str(TEST_SRC_IP), TEST_SRC_PORT, bytes([i])) for i in range(3)]
+        assert poller.polled_packets == 3
+        assert poller.deferred_packets == 0
+
+
+@pytest.mark.asyncio
+async def test_deferred_packet():
+    poller, adapter = new_poller()
+    ttl_exceeded_handler = WaitingTTLExceededHandler()
+    poller.stack.get_protocol(IPv4).register_to_ttl_exceeded_callback(ttl_exceeded_handler)
+    ttl_exceeded_handler.future = asyncio.get_running_loop().create_future()
+    adapter.pending = [build_udp_packet(adapter, b'a', ttl=0)]
+    assert poller.poll_once() == 1
+    assert poller.deferred_packets == 1
+    assert ttl_exceeded_handler.handled == 0
+
+    # the handling continues when the handler is done waiting
+    ttl_exceeded_handler.future.set_result(None)
+    await asyncio.sleep(0.01)
+    assert ttl_exceeded_handler.handled == 1
+
+
+@pytest.mark.asyncio
+async def test_malformed_packet():
+    loop = asyncio.get_running_loop()
+    errors = []
+    loop.set_exception_handler(lambda _, context: errors.append(context['exception']))
+    try:
+        poller, adapter = new_poller()
+        received = []
+        with UDPSocket(stack=poller.stack) as s:
+            s.bind(None, TEST_DST_PORT)
+            s.set_recv_callback(received.append)
+            # an ethernet header and only 6 bytes of an ip header
+            truncated = build_udp_packet(adapter, b'a')[:14 + 6]
+            adapter.pending = [truncated, build_udp_packet(adapter, b'b')]
+
+            # the error is reported like an error of a task, and the next packets are still handled
+            assert poller.poll_once() == 2
+            assert len(errors) == 1
+            assert [data for _, _, data in received] == [b'b']
+    finally:
+        loop.set_exception_handler(None)
+
+
+@pytest.mark.asyncio
+async def test_timeout_in_handler():
+    class TimeoutTTLExceededHandler(TTLExceededHandler):
+        def __init__(self):
+            self.timed_out = False
+
+        async def handle_ttl_exceeded(self, packet):
+            try:
+                async with asyncio.timeout(0.01):
+                    await asyncio.get_running_loop().create_future()
+            except TimeoutError:
+                self.timed_out = True
+
+    poller, adapter = new_poller()
+    handler = TimeoutTTLExceededHandler()
+    poller.stack.get_protocol(IPv4).register_to_ttl_exceeded_callback(handler)
+    adapter.pending = [build_udp_packet(adapter, b'a', ttl=0)]
+    assert poller.poll_once() == 1
+    # the timeout belongs to the task of the packet, so it doesn't cancel the task that polled
+    await asyncio.sleep(0.05)
+    assert handler.timed_out
+
+
+@pytest.mark.asyncio
+async def test_run():
+    poller, adapter = new_poller(spin_count=10, idle_sleep=0.001)
+    received = asyncio.Queue()
+    with UDPSocket(stack=poller.stack) as s:
+        s.bind(None, TEST_DST_PORT)
+        s.set_recv_callback(received.put_nowait)
+        task = asyncio.create_task(poller.run())
+        try:
+            for i in range(3):
+                adapter.pending.append(build_udp_packet(adapter, bytes([i])))
+                assert (await asyncio.wait_for(received.get(), 1))[2] == bytes([i])
+        finally:
+            poller.stop()
+            await asyncio.wait_for(task, 1)
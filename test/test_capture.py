@@ -0,0 +1,85 @@
+from scapy.all import Ether, rdpcap
+from scapy.all import ARP as SCAPY_ARP
+import pytest
+import os
+import tempfile
+
+from arp import ARP
+from udp import UDP
+from udp_socket import UDPSocket
+from capture import CaptureRing
+from stats import DropReason
+from pcap import PcapReader
+from conftest import TEST_SRC_IP, TEST_SRC_MAC, TEST_SRC_PORT, TEST_DST_PORT, build_udp_packet, new_stack
+
+
+@pytest.mark.asyncio
+async def test_capture():
+    network_stack, adapter = new_stack()
+    ring = CaptureRing(stack=network_stack)
+    ring.start()
+    with UDPSocket(stack=network_stack) as s:
+        s.bind(None, TEST_DST_PORT)
+        packets = [build_udp_packet(adapter, b'delivered'), build_udp_packet(adapter, b'closed', TEST_DST_PORT + 1)]
+        await network_stack.handle_packets(packets, adapter)
+        await s.sendto(b'sent', str(TEST_SRC_IP), TEST_SRC_PORT)
+    sent = adapter.get_next_packet_nowait()
+    ring.stop()
+    assert network_stack.tracer is None
+    await network_stack.handle_packets(packets, adapter)
+
+    captured = list(ring)
+    assert [frame.frame for frame in captured] == packets + [sent]
+    assert [frame.description for frame in captured] == ['received', 'dropped by UDP: no_port', 'sent']
+    assert captured[1].reason == DropReason.NO_PORT
+    assert captured[0].timestamp <= captured[1].timestamp <= captured[2].timestamp
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'capture.pcapng')
+        ring.dump(path)
+        with PcapReader(path) as reader:
+            assert [(timestamp, bytes(frame)) for timestamp, frame in reader] == \
+                [(frame.timestamp, frame.frame) for frame in captured]
+        assert [packet.comment for packet in rdpcap(path)] == [b'received', b'dropped by UDP: no_port', b'sent']
+
+
+def test_fixed_memory():
+    network_stack, adapter = new_stack()
+    frames = [build_udp_packet(adapter, bytes(i)) for i in range(40)]
+
+    ring = CaptureRing(max_packets=8, stack=network_stack)
+    ring.start()
+    network_stack.count_sent(adapter, frames)
+    ring.stop()
+    assert [captured.frame for captured in ring] == frames[-8:]
+
+    ring = CaptureRing(max_bytes=500, snaplen=64, stack=network_stack)
+    ring.start()
+    network_stack.count_sent(adapter, frames)
+    ring.stop()
+    captured = list(ring)
+    assert [frame.frame for frame in captured] == [frame[:64] for frame in frames[-len(captured):]]
+    assert [frame.original_length for frame in captured] == [len(frame) for frame in frames[-len(captured):]]
+    assert sum(len(frame.frame) for frame in captured) <= 500
+    assert len(captured) >= 500 // 64 - 1
+
+
+@pytest.mark.asyncio
+async def test_filters():
+    network_stack, adapter = new_stack()
+    arp_frame = (Ether(src=TEST_SRC_MAC, dst=adapter.mac) /
+                 SCAPY_ARP(op=2, hwsrc=TEST_SRC_MAC, psrc=TEST_SRC_IP, hwdst=adapter.mac, pdst=adapter.ip)).build()
+    frames = [build_udp_packet(adapter, b'first'), arp_frame, build_udp_packet(adapter, b'other', TEST_DST_PORT + 1)]
+
+    udp_ring = CaptureRing(protocols=[UDP], stack=network_stack)
+    port_ring = CaptureRing(ports=[TEST_DST_PORT], stack=network_stack)
+    arp_ring = CaptureRing(protocols=[ARP], stack=network_stack)
+    for ring in (udp_ring, port_ring, arp_ring):
+        ring.start()
+    await network_stack.handle_packets(frames, adapter)
+    for ring in (udp_ring, port_ring, arp_ring):
+        ring.stop()
+
+    assert [frame.frame for frame in udp_ring] == [frames[0], frames[2]]
+    assert [frame.frame for frame in port_ring] == [frames[0]]
+    assert [frame.frame for frame in arp_ring] == [frames[1]]
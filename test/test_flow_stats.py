@@ -0,0 +1,79 @@
+import pytest
+import random
+
+from udp import UDP
+from udp_socket import UDPSocket
+from flow_stats import CountMinSketch, TopK, FlowAccounting, FlowKey
+from conftest import TEST_SRC_IP, TEST_SRC_PORT, TEST_DST_PORT, build_udp_packet, new_stack
+
+
+def test_count_min_sketch():
+    sketch = CountMinSketch(width=64, depth=4)
+    counts = {(i,): random.randrange(1, 20) for i in range(200)}
+    for key, count in counts.items():
+        sketch.add(key, count)
+
+    total = sum(counts.values())
+    errors = [sketch.estimate(key) - count for key, count in counts.items()]
+    assert min(errors) >= 0
+    assert sum(error <= 2 * total / 64 for error in errors) >= 0.9 * len(errors)
+
+    sketch.clear()
+    assert sketch.estimate((1,)) == 0
+
+
+def test_top_k():
+    top = TopK(3)
+    for key in range(100):
+        top.update((key,), key)
+    top.update((5,), 100)
+    assert sorted(top.keys()) == [(5,), (98,), (99,)]
+    assert len(top) == 3
+
+    with pytest.raises(ValueError):
+        TopK(0)
+
+
+def test_heavy_hitters():
+    accounting = FlowAccounting(window=10, slots=5, k=4, width=256)
+    heavy = FlowKey(17, 1, 1000, 2, 53)
+    large = FlowKey(17, 3, 1000, 2, 53)
+    for i in range(2000):
+        accounting.add(FlowKey(17, 100 + i, 2000, 2, 53), 60, now=1)
+        if i % 10 == 0:
+            accounting.add(heavy, 60, now=1)
+        if i % 100 == 0:
+            accounting.add(large, 1500, now=1)
+
+    by_packets = accounting.heavy_hitters(count=1, now=1)
+    assert by_packets[0].flow == heavy
+    assert by_packets[0].packets >= 200
+    assert accounting.heavy_hitters(by_bytes=True, count=1, now=1)[0].flow == large
+
+    # the window slides
+    accounting.add(heavy, 60, now=9)
+    assert accounting.heavy_hitters(count=1, now=9)[0].packets >= 201
+    assert accounting.heavy_hitters(count=1, now=11)[0].packets == 1
+    assert accounting.heavy_hitters(now=20) == []
+
+
+@pytest.mark.asyncio
+async def test_stack_flows():
+    network_stack, adapter = new_stack()
+    accounting = FlowAccounting(stack=network_stack)
+    accounting.start()
+    with UDPSocket(stack=network_stack) as s:
+        s.bind(None, TEST_DST_PORT)
+        frame = build_udp_packet(adapter, b'data')
+        await network_stack.handle_packets([frame] * 3, adapter)
+        # a packet to a closed port isn't counted
+        await network_stack.handle_packets([build_udp_packet(adapter, b'closed', TEST_DST_PORT + 1)], adapter)
+        await s.sendto(b'reply', str(TEST_SRC_IP), TEST_SRC_PORT)
+    accounting.stop()
+
+    hitters = accounting.heavy_hitters()
+    received = FlowKey(17, int(TEST_SRC_IP), TEST_SRC_PORT, int(adapter.ip), TEST_DST_PORT)
+    sent = FlowKey(17, int(adapter.ip), TEST_DST_PORT, int(TEST_SRC_IP), TEST_SRC_PORT)
+    assert [(hitter.flow, hitter.packets, hitter.bytes) for hitter in hitters] == \
+        [(received, 3, 3 * (UDP.PROTOCOL_STRUCT.size + 4)), (sent, 1, UDP.PROTOCOL_STRUCT.size + 5)]
+    assert str(received) in accounting.report()
@@ -2,8 +2,8 @@ from scapy.all import Ether, ICMP as SCAPY_ICMP, Raw, IP, IPerror
 import pytest
 
 from network_adapter import MockNetworkAdapter
-from stack import stack
-from icmp import ICMP, ICMPCodes
+from stack import NetworkStack, stack
+from icmp import ICMP, ICMPCodes, EchoProbeHandler
 from ip_utils import IPAddress
 from arp import ARP
 
@@ -56,3 +56,74 @@ async def test_port_unreachable(adapter: MockNetworkAdapter):
     assert icmp.type == ICMPCodes.DESTINATION_UNREACHABLE.value
     assert icmp.code == UNREACHABLE_CODE
     assert packet.getlayer(Raw).load == PAYLOAD
+
+
+@pytest.mark.asyncio
+async def test_error_rate_limit(adapter: MockNetworkAdapter):
+    icmp = stack.get_protocol(ICMP)
+    icmp.set_error_rate_limit(0, 2, 0, 3)
+    try:
+        other_ip = IPAddress('1.1.1.3')
+        sent = [icmp.send_error(TEST_DST_IP, ICMPCodes.TTL_EXCEEDED, PAYLOAD, dst_mac=TEST_DST_MAC) for _ in range(3)]
+        assert sent == [True, True, False], 'limited per destination'
+        sent = [icmp.send_error(other_ip, ICMPCodes.TTL_EXCEEDED, PAYLOAD, dst_mac=TEST_DST_MAC) for _ in range(2)]
+        assert sent == [True, False], 'limited globally'
+        assert icmp._destination_limiter.allows(int(other_ip)), 'a rejected error takes no destination token'
+
+        for _ in range(3):
+            assert_ttl_exceeded(Ether(await adapter.get_next_packet()))
+        assert adapter.sent_packets.empty()
+    finally:
+        icmp.set_error_rate_limit(ICMP.DESTINATION_ERROR_RATE, ICMP.DESTINATION_ERROR_BURST, ICMP.GLOBAL_ERROR_RATE,
+                                  ICMP.GLOBAL_ERROR_BURST)
+
+
+@pytest.mark.asyncio
+async def test_echo_reply():
+    class EchoProbeTestHandler(EchoProbeHandler):
+        def __init__(self):
+            self.probes = []
+
+        def handle_echo_probe(self, src_ip, identifier, sequence, processing_time):
+            self.probes.append((src_ip, identifier, sequence, processing_time))
+
+    # a stack of its own, so the handler doesn't stay registered in the global stack after the test
+    network_stack = NetworkStack()
+    adapter = MockNetworkAdapter()
+    network_stack.add_adapter(adapter)
+    handler = EchoProbeTestHandler()
+    network_stack.get_protocol(ICMP).register_to_echo_probe_callback(handler)
+
+    ether = Ether(src=TEST_DST_MAC, dst=adapter.mac)
+    ip = IP(src=str(TEST_DST_IP), dst=str(adapter.ip), ttl=10)
+    request = ether / ip / SCAPY_ICMP(type='echo-request', id=0x1234, seq=7) / PAYLOAD
+    network_stack.add_packet(request.build(), adapter)
+
+    reply = Ether(await adapter.get_next_packet())
+    assert reply.src == adapter.mac
+    assert reply.dst == TEST_DST_MAC
+    assert reply[IP].src == str(adapter.ip)
+    assert reply[IP].dst == str(TEST_DST_IP)
+    icmp = reply[SCAPY_ICMP]
+    assert icmp.type == ICMPCodes.ECHO_REPLY.value
+    assert (icmp.id, icmp.seq) == (0x1234, 7)
+    assert reply[Raw].load == PAYLOAD
+
+    # make sure the checksums that were updated in place are right
+    ip_checksum, icmp_checksum = reply[IP].chksum, icmp.chksum
+    del reply[IP].chksum
+    del reply[SCAPY_ICMP].chksum
+    rebuilt = Ether(reply.build())
+    assert rebuilt[IP].chksum == ip_checksum
+    assert rebuilt[SCAPY_ICMP].chksum == icmp_checksum
+
+    # the reply is counted in every layer, like a packet the stack built
+    stats = network_stack.stats()['protocols']
+    assert (stats['Ethernet']['tx_packets'], stats['Ethernet']['tx_bytes']) == (1, len(reply))
+    assert (stats['IPv4']['tx_packets'], stats['IPv4']['tx_bytes']) == (1, len(reply[IP]))
+    assert (stats['ICMP']['tx_packets'], stats['ICMP']['tx_bytes']) == (1, len(reply[SCAPY_ICMP]))
+
+    assert len(handler.probes) == 1
+    src_ip, identifier, sequence, processing_time = handler.probes[0]
+    assert (src_ip, identifier, sequence) == (TEST_DST_IP, 0x1234, 7)
+    assert processing_time > 0
@@ -0,0 +1,35 @@
+from os_utils.packet_ring import PacketRing
+
+
+BLOCK_SIZE = 4096
+FIRST_FRAME_OFFSET = 48
+# the frame data starts after the frame header, at an offset the kernel chooses
+MAC_OFFSET = 66
+
+
+def build_block(frames: list) -> bytearray:
+    block = bytearray(BLOCK_SIZE)
+    PacketRing.BLOCK_HEADER_STRUCT.pack_into(block, PacketRing.BLOCK_HEADER_OFFSET, PacketRing.TP_STATUS_USER,
+                                             len(frames), FIRST_FRAME_OFFSET)
+    offset = FIRST_FRAME_OFFSET
+    for i, frame in enumerate(frames):
+        frame_size = MAC_OFFSET + len(frame) + (-(MAC_OFFSET + len(frame)) % 16)
+        next_offset = frame_size if i < len(frames) - 1 else 0
+        PacketRing.FRAME_HEADER_STRUCT.pack_into(block, offset, next_offset, 0, 0, len(frame), len(frame),
+                                                 PacketRing.TP_STATUS_USER, MAC_OFFSET)
+        block[offset + MAC_OFFSET:offset + MAC_OFFSET + len(frame)] = frame
+        offset += frame_size
+    return block
+
+
+def test_parse_block():
+    frames = [b'a' * 60, b'b' * 1514, b'c' * 7]
+    ring = bytearray(BLOCK_SIZE) + build_block(frames)
+
+    parsed = PacketRing.parse_block(ring, BLOCK_SIZE)
+    assert [bytes(ring[offset:offset + length]) for offset, length in parsed] == frames
+    assert parsed[0][0] == BLOCK_SIZE + FIRST_FRAME_OFFSET + MAC_OFFSET
+
+
+def test_parse_empty_block():
+    assert PacketRing.parse_block(build_block([]), 0) == []
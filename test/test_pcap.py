@@ -0,0 +1,131 @@
+from scapy.all import Ether, IP, UDP as SCAPY_UDP, Raw, wrpcap, wrpcapng, rdpcap
+import pytest
+import asyncio
+import struct
+
+from stack import stack, NetworkAdapterInterface
+from ethernet import Ethernet, MacResolverInterface
+from arp import ARP
+from udp_socket import UDPSocket
+from pcap import PcapReader, PcapWriter, PcapFormatException
+from pcap_adapter import PcapReplayAdapter
+from ip_utils import IPAddress
+
+
+LOCAL_IP = '10.0.1.1'
+LOCAL_MAC = '02:00:00:00:01:01'
+REMOTE_IP = '10.0.1.2'
+REMOTE_MAC = '02:00:00:00:01:02'
+NETMASK = IPAddress('255.255.255.0')
+LOCAL_PORT = 5555
+REMOTE_PORT = 6666
+PACKET_COUNT = 10
+
+
+class RemoteMacResolver(MacResolverInterface):
+    async def get_mac(self, adapter: NetworkAdapterInterface, dst_ip: IPAddress) -> str:
+        assert dst_ip == REMOTE_IP
+        return REMOTE_MAC
+
+
+def build_packets():
+    packets = []
+    for i in range(PACKET_COUNT):
+        packet = Ether(src=REMOTE_MAC, dst=LOCAL_MAC) / IP(src=REMOTE_IP, dst=LOCAL_IP) / \
+                 SCAPY_UDP(sport=REMOTE_PORT, dport=LOCAL_PORT) / Raw(bytes([i]) * (i + 1))
+        packet.time = 1000 + i / 100
+        packets.append(packet)
+    return packets
+
+
+@pytest.mark.parametrize('write', [wrpcap, wrpcapng])
+def test_reader(tmp_path, write):
+    packets = build_packets()
+    path = str(tmp_path / 'capture')
+    write(path, packets)
+    with PcapReader(path) as reader:
+        frames = [(timestamp, bytes(frame)) for timestamp, frame in reader]
+    assert frames == [(int(round(packet.time * 1000000)) * 1000, bytes(packet)) for packet in packets]
+
+
+def pcapng_block(block_type: int, body: bytes) -> bytes:
+    body += bytes(-len(body) % 4)
+    return struct.pack('<II', block_type, len(body) + 12) + body + struct.pack('<I', len(body) + 12)
+
+
+@pytest.mark.parametrize('blocks', [
+    # a packet of an interface that has no description
+    [pcapng_block(PcapReader.PCAPNG_INTERFACE_DESCRIPTION_BLOCK, struct.pack('<HHI', 1, 0, 0)),
+     pcapng_block(PcapReader.PCAPNG_ENHANCED_PACKET_BLOCK, struct.pack('<IIIII', 1, 0, 0, 4, 4) + b'abcd')],
+    # a simple packet without any interface
+    [pcapng_block(PcapReader.PCAPNG_SIMPLE_PACKET_BLOCK, struct.pack('<I', 4) + b'abcd')],
+])
+def test_reader_missing_interface(tmp_path, blocks):
+    path = tmp_path / 'capture.pcapng'
+    section_header = pcapng_block(PcapReader.PCAPNG_SECTION_HEADER_BLOCK,
+                                  struct.pack('<IHHq', PcapReader.PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1))
+    path.write_bytes(section_header + b''.join(blocks))
+    with PcapReader(str(path)) as reader:
+        with pytest.raises(PcapFormatException):
+            list(reader)
+
+
+def test_writer(tmp_path):
+    packets = build_packets()
+    path = str(tmp_path / 'capture.pcap')
+    # a small buffer, so some of the packets are written before the end
+    with PcapWriter(path, buffer_size=200) as writer:
+        for packet in packets:
+            writer.write(bytes(packet), int(packet.time * 1000000000))
+
+    written = rdpcap(path)
+    assert [bytes(packet) for packet in written] == [bytes(packet) for packet in packets]
+    assert [float(packet.time) for packet in written] == pytest.approx([float(packet.time) for packet in packets])
+
+
+@pytest.mark.asyncio
+async def test_replay(tmp_path):
+    input_path = str(tmp_path / 'input.pcap')
+    output_path = str(tmp_path / 'output.pcap')
+    wrpcap(input_path, build_packets())
+    stack.get_protocol(Ethernet).set_mac_resolver(RemoteMacResolver())
+
+    # the replay starts only when we wait for something, so the socket is bound before it
+    adapter = PcapReplayAdapter(input_path, LOCAL_MAC, IPAddress(LOCAL_IP), NETMASK, output_path=output_path,
+                                batch_size=3)
+    stack.add_adapter(adapter)
+    with UDPSocket() as s:
+        s.bind(LOCAL_IP, LOCAL_PORT)
+        try:
+            await asyncio.wait_for(adapter.done, 1)
+            packets = await s.recvmany(PACKET_COUNT)
+            assert [data for _, _, data in packets] == [bytes([i]) * (i + 1) for i in range(PACKET_COUNT)]
+            assert adapter.received_packets == PACKET_COUNT
+            assert adapter.received_bytes == sum(len(packet) for packet in build_packets())
+            assert adapter.packets_per_second > 0
+
+            await s.sendto(b'reply', REMOTE_IP, REMOTE_PORT)
+        finally:
+            stack.remove_adapter(adapter)
+            adapter.close()
+            stack.get_protocol(Ethernet).set_mac_resolver(stack.get_protocol(ARP))
+
+    written = rdpcap(output_path)
+    assert len(written) == 1
+    assert written[0].getlayer(Raw).load == b'reply'
+
+
+@pytest.mark.asyncio
+async def test_replay_cancelled(tmp_path):
+    input_path = str(tmp_path / 'input.pcap')
+    wrpcap(input_path, build_packets())
+    adapter = PcapReplayAdapter(input_path, LOCAL_MAC, IPAddress(LOCAL_IP), NETMASK, realtime=True)
+    stack.add_adapter(adapter)
+    try:
+        await asyncio.sleep(0)
+        adapter.close()
+        # whoever waits for the replay is told it was cancelled, instead of waiting forever
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(adapter.done, 1)
+    finally:
+        stack.remove_adapter(adapter)
@@ -0,0 +1,41 @@
+from unittest import mock
+
+from rate_limiter import TokenBucket, KeyedRateLimiter
+
+
+def test_burst():
+    bucket = TokenBucket(rate=0, burst=3)
+    assert bucket.allows(3)
+    assert all(bucket.consume() for _ in range(3))
+    assert not bucket.allows()
+    assert not bucket.consume()
+
+
+def test_refill():
+    with mock.patch('time.monotonic', return_value=100):
+        bucket = TokenBucket(rate=2, burst=2)
+        assert bucket.consume(2)
+        assert not bucket.consume()
+
+    with mock.patch('time.monotonic', return_value=100.5):
+        assert bucket.consume()
+        assert not bucket.consume()
+
+    with mock.patch('time.monotonic', return_value=200):
+        # never more than the burst
+        assert bucket.consume(2)
+        assert not bucket.consume()
+
+
+def test_keyed():
+    limiter = KeyedRateLimiter(rate=0, burst=1, max_keys=2)
+    assert limiter.allows('a') and limiter.allows('a')
+    assert limiter.consume('a')
+    assert not limiter.allows('a')
+    assert not limiter.consume('a')
+    assert limiter.consume('b')
+
+    # 'a' is the least recently used key, so it's forgotten and gets a new bucket
+    limiter.consume('b')
+    assert limiter.consume('c')
+    assert limiter.consume('a')
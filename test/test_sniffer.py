@@ -0,0 +1,75 @@
+from unittest import mock
+import pytest
+import asyncio
+import errno
+import socket
+
+from os_utils.sniffer import Sniffer
+
+
+class FailingSocket(socket.socket):
+    """
+    a unix socket instead of a packet socket, whose recv returns (or raises) the given results and then blocks
+    """
+    def __init__(self, fileno: int, results: list):
+        super().__init__(fileno=fileno)
+        self.results = results
+        self.bound = False
+
+    def bind(self, address):
+        self.bound = True
+
+    def recv(self, size: int, flags: int = 0):
+        if not self.results:
+            raise BlockingIOError()
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def create_sniffer(results: list, before_bind=None):
+    sock, peer = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    with mock.patch('socket.socket', lambda *args: FailingSocket(sock.detach(), results)):
+        return Sniffer('test', before_bind=before_bind), peer
+
+
+@pytest.mark.asyncio
+async def test_before_bind():
+    # a filter must be attached before the socket is bound and gets frames
+    bound = []
+    sniffer, peer = create_sniffer([], before_bind=lambda sock: bound.append(sock.bound))
+    with sniffer.sock, peer:
+        assert bound == [False]
+        assert sniffer.sock.bound
+
+
+@pytest.mark.asyncio
+async def test_read_batch_keeps_error():
+    sniffer, peer = create_sniffer([b'a', OSError(errno.ENETDOWN, 'down'), b'b'])
+    with sniffer.sock, peer:
+        assert sniffer.read_batch(100, 10) == [b'a']
+        with pytest.raises(OSError):
+            sniffer.read_batch(100, 10)
+        assert sniffer.read_batch(100, 10) == [b'b']
+
+
+@pytest.mark.asyncio
+async def test_reader_stops_on_error():
+    loop = asyncio.get_running_loop()
+    errors = []
+    loop.set_exception_handler(lambda _, context: errors.append(context['exception']))
+    sniffer, peer = create_sniffer([OSError(errno.ENETDOWN, 'down')])
+    try:
+        with sniffer.sock, peer:
+            batches = []
+            sniffer.start_reading(batches.append, 100)
+            # wake the reader up
+            peer.send(b'x')
+            await asyncio.sleep(0.01)
+            assert [error.errno for error in errors] == [errno.ENETDOWN]
+            assert sniffer.error is errors[0]
+            assert batches == []
+            assert not loop.remove_reader(sniffer.sock.fileno()), 'the reader should be removed'
+    finally:
+        loop.set_exception_handler(None)
@@ -0,0 +1,66 @@
+import struct
+
+from os_utils.socket_filter import SocketFilter
+from ethernet import Ethernet
+import consts
+
+
+OUR_MAC = '01:23:45:67:89:ab'
+OTHER_MAC = '01:23:45:67:89:ac'
+PACKET_HOST = 0
+ETHERTYPES = [0x0800, 0x0806]
+
+
+def run_filter(program: list, frame: bytes, pkttype: int = PACKET_HOST) -> int:
+    """
+    Run the classic BPF program on the frame, like the kernel does. Returns the number of bytes the filter accepts
+    """
+    loads = {SocketFilter.BPF_LD_W_ABS: 'I', SocketFilter.BPF_LD_H_ABS: 'H', SocketFilter.BPF_LD_B_ABS: 'B'}
+    accumulator = 0
+    position = 0
+    while True:
+        code, jump_true, jump_false, k = program[position]
+        assert jump_true >= 0 and jump_false >= 0, 'classic BPF jumps only forward'
+        if code in loads:
+            if k == SocketFilter.SKF_AD_PKTTYPE & 0xffffffff:
+                accumulator = pkttype
+            else:
+                accumulator, = struct.unpack_from('>' + loads[code], frame, k)
+        elif code == SocketFilter.BPF_JEQ_K:
+            position += jump_true if accumulator == k else jump_false
+        elif code == SocketFilter.BPF_RET_K:
+            return k
+        else:
+            raise AssertionError(f'unexpected instruction {code:#x}')
+        position += 1
+
+
+def build_frame(dst_mac: str, ethertype: int) -> bytes:
+    return Ethernet.build_mac(dst_mac) + Ethernet.build_mac(OTHER_MAC) + struct.pack('>H', ethertype) + bytes(46)
+
+
+def test_program():
+    program = SocketFilter.build(OUR_MAC, ETHERTYPES)
+    assert all(isinstance(field, int) for instruction in program for field in instruction), 'labels are resolved'
+    assert program[-2:] == [(SocketFilter.BPF_RET_K, 0, 0, 0), (SocketFilter.BPF_RET_K, 0, 0, SocketFilter.ACCEPT_SIZE)]
+
+    for ethertype in ETHERTYPES:
+        assert run_filter(program, build_frame(OUR_MAC, ethertype)) == SocketFilter.ACCEPT_SIZE
+        assert run_filter(program, build_frame(consts.BROADCAST_MAC, ethertype)) == SocketFilter.ACCEPT_SIZE
+    assert run_filter(program, build_frame(OTHER_MAC, 0x0800)) == 0, 'frames to other macs are dropped'
+    assert run_filter(program, build_frame(OUR_MAC, 0x86dd)) == 0, 'unknown ethertypes are dropped'
+    assert run_filter(program, build_frame(OUR_MAC, 0x0800), SocketFilter.PACKET_OUTGOING) == 0, \
+        'frames we sent are dropped'
+
+
+def test_labels():
+    program = SocketFilter._resolve_labels([
+        (SocketFilter.BPF_JEQ_K, 'second', 'first', 1),
+        'first',
+        (SocketFilter.BPF_RET_K, None, None, 1),
+        'second',
+        (SocketFilter.BPF_RET_K, None, None, 2),
+    ])
+    # jumps are relative to the next instruction
+    assert program == [(SocketFilter.BPF_JEQ_K, 1, 0, 1), (SocketFilter.BPF_RET_K, 0, 0, 1),
+                       (SocketFilter.BPF_RET_K, 0, 0, 2)]
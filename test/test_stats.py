@@ -0,0 +1,97 @@
+from scapy.all import Ether, IPv6
+import pytest
+import asyncio
+import os
+import tempfile
+
+from arp import ARP
+from udp import UDP
+from udp_socket import UDPSocket
+from prometheus import PrometheusExporter
+from conftest import TEST_SRC_IP, TEST_SRC_MAC, TEST_DST_PORT, build_udp_packet, new_stack
+
+
+@pytest.mark.asyncio
+async def test_receive_counters():
+    network_stack, adapter = new_stack()
+    with UDPSocket(recv_queue_length=1, stack=network_stack) as s:
+        s.bind(None, TEST_DST_PORT)
+        packets = [build_udp_packet(adapter, b'delivered'),
+                   build_udp_packet(adapter, b'queue full'),
+                   build_udp_packet(adapter, b'wrong mac', dst_mac='02:00:00:00:00:99'),
+                   build_udp_packet(adapter, b'bad checksum', ip_checksum=0x1234),
+                   build_udp_packet(adapter, b'closed port', dst_port=TEST_DST_PORT + 1),
+                   (Ether(src=TEST_SRC_MAC, dst=adapter.mac) / IPv6()).build()]
+        await network_stack.handle_packets(packets, adapter)
+
+    stats = network_stack.stats()
+    assert stats['adapters'][str(adapter.ip)]['rx_packets'] == len(packets)
+    assert stats['adapters'][str(adapter.ip)]['rx_bytes'] == sum(len(packet) for packet in packets)
+    assert stats['protocols']['Ethernet']['rx_packets'] == 6
+    assert stats['protocols']['Ethernet']['drops'] == {'wrong_mac': 1, 'unknown_protocol': 1}
+    assert stats['protocols']['IPv4']['rx_packets'] == 4
+    assert stats['protocols']['IPv4']['drops'] == {'bad_checksum': 1}
+    assert stats['protocols']['UDP']['rx_packets'] == 3
+    assert stats['protocols']['UDP']['drops'] == {'queue_full': 1, 'no_port': 1}
+
+
+@pytest.mark.asyncio
+async def test_send_counters():
+    network_stack, adapter = new_stack()
+    with UDPSocket(stack=network_stack) as s:
+        await s.sendto(b'data', str(TEST_SRC_IP), TEST_DST_PORT)
+        s.connect(str(TEST_SRC_IP), TEST_DST_PORT)
+        await s.send_segments(b'x' * 25, 10)
+
+    sent = [adapter.get_next_packet_nowait() for _ in range(4)]
+    stats = network_stack.stats()
+    assert stats['adapters'][str(adapter.ip)]['tx_packets'] == 4
+    assert stats['adapters'][str(adapter.ip)]['tx_bytes'] == sum(len(packet) for packet in sent)
+    assert stats['protocols']['UDP']['tx_packets'] == 4
+    assert stats['protocols']['UDP']['tx_bytes'] == 4 * UDP.PROTOCOL_STRUCT.size + 4 + 25
+    assert stats['protocols']['Ethernet']['tx_packets'] == 4
+    assert stats['protocols']['Ethernet']['tx_bytes'] == sum(len(packet) for packet in sent)
+    assert stats['protocols']['IPv4']['tx_packets'] == 4
+
+
+@pytest.mark.asyncio
+async def test_arp_timeout():
+    network_stack, adapter = new_stack()
+    network_stack.get_protocol(ARP).RESOLVE_TIMEOUT = 0.01
+    with UDPSocket(stack=network_stack) as s:
+        with pytest.raises(asyncio.TimeoutError):
+            await s.sendto(b'data', '1.1.1.2', TEST_DST_PORT)
+
+    assert network_stack.stats()['protocols']['ARP']['drops'] == {'arp_timeout': 1}
+    # the arp request was sent
+    assert network_stack.stats()['protocols']['ARP']['tx_packets'] == 1
+
+
+@pytest.mark.asyncio
+async def test_prometheus_exporter():
+    network_stack, adapter = new_stack()
+    await network_stack.handle_packets([build_udp_packet(adapter, b'wrong mac', dst_mac='02:00:00:00:00:99')],
+                                       adapter)
+    exporter = PrometheusExporter(network_stack)
+    text = exporter.format()
+    assert '# TYPE netstack_adapter_rx_packets_total counter' in text
+    assert 'netstack_adapter_rx_packets_total{adapter="1.2.3.4"} 1' in text
+    assert 'netstack_protocol_drops_total{protocol="Ethernet",reason="wrong_mac"} 1' in text
+    assert 'netstack_protocol_rx_packets_total{protocol="IPv4"} 0' in text
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'netstack.prom')
+        exporter.write(path)
+        with open(path) as f:
+            assert f.read() == text
+
+    server = await exporter.serve('127.0.0.1', 0)
+    try:
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+        writer.write(b'GET /metrics HTTP/1.0\r\n\r\n')
+        response = await asyncio.wait_for(reader.read(), 1)
+        writer.close()
+    finally:
+        exporter.close()
+    assert response.startswith(b'HTTP/1.0 200 OK\r\n')
+    assert response.endswith(text.encode())
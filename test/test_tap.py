@@ -0,0 +1,54 @@
+from scapy.all import Ether, IP
+from scapy.all import UDP as SCAPY_UDP
+from unittest import mock
+import pytest
+import asyncio
+import errno
+import os
+import struct
+
+from os_utils.tap import Tap, TapQueue
+from utils import calculate_checksum
+
+
+UDP_OFFSET = 14 + 20
+UDP_CHECKSUM_OFFSET = 6
+
+
+def test_strip_vnet_header():
+    frame = (Ether() / IP(src='1.1.1.1', dst='2.2.2.2') / SCAPY_UDP(sport=1, dport=2) / b'payload').build()
+
+    # like the kernel, leave the sum of the pseudo header (not inverted) in the checksum field
+    position = UDP_OFFSET + UDP_CHECKSUM_OFFSET
+    pseudo_header = struct.pack('>4s4sBBH', frame[26:30], frame[30:34], 0, 17, len(frame) - UDP_OFFSET)
+    partial = frame[:position] + struct.pack('>H', 0xffff - calculate_checksum(pseudo_header)) + frame[position + 2:]
+    header = Tap.VNET_HEADER_STRUCT.pack(Tap.VNET_HDR_F_NEEDS_CSUM, 0, 0, 0, UDP_OFFSET, UDP_CHECKSUM_OFFSET)
+
+    assert Tap.strip_vnet_header(header + partial, Tap.VNET_HEADER_STRUCT.size) == frame
+    # a frame the kernel already completed is only stripped
+    header = Tap.VNET_HEADER_STRUCT.pack(0, 0, 0, 0, 0, 0)
+    assert Tap.strip_vnet_header(header + frame, Tap.VNET_HEADER_STRUCT.size) == frame
+
+
+@pytest.mark.asyncio
+async def test_reader_stops_on_error():
+    loop = asyncio.get_running_loop()
+    errors = []
+    loop.set_exception_handler(lambda _, context: errors.append(context['exception']))
+    read_fd, write_fd = os.pipe()
+    queue = TapQueue(read_fd, 0)
+    try:
+        frames = []
+        queue.start_reading(frames.append, 100, 10)
+        with mock.patch('os.read', side_effect=OSError(errno.EIO, 'device removed')):
+            # wake the reader up
+            os.write(write_fd, b'x')
+            await asyncio.sleep(0.01)
+        assert [error.errno for error in errors] == [errno.EIO]
+        assert queue.error is errors[0]
+        assert frames == []
+        assert not loop.remove_reader(read_fd), 'the reader should be removed'
+    finally:
+        loop.set_exception_handler(None)
+        queue.close()
+        os.close(write_fd)
@@ -0,0 +1,74 @@
+import pytest
+
+from udp_socket import UDPSocket
+from tracing import LogLinearHistogram, Tracer
+from stats import DropReason
+from conftest import TEST_SRC_IP, TEST_SRC_PORT, TEST_DST_PORT, build_udp_packet, new_stack
+
+
+def test_histogram():
+    histogram = LogLinearHistogram()
+    for value in range(1, 10001):
+        histogram.record(value)
+
+    assert histogram.count == 10000
+    assert histogram.max == 10000
+    assert histogram.snapshot()['mean'] == 5000.5
+    # a value is kept with an error of 1/16 at most
+    for percentile in (1, 50, 90, 99):
+        assert 1 - 1 / 16 <= histogram.percentile(percentile) / (percentile * 100) <= 1
+    assert histogram.percentile(100) == 9728
+
+    histogram.record(1 << 50)
+    assert histogram.percentile(100) == 1 << 50
+
+    histogram.clear()
+    assert histogram.count == 0
+    assert histogram.percentile(50) == 0
+
+
+def test_small_values_are_exact():
+    histogram = LogLinearHistogram()
+    for value in range(32):
+        histogram.record(value)
+    assert [histogram.percentile(100 * (value + 1) / 32) for value in range(32)] == list(range(32))
+
+
+def test_sampling():
+    tracer = Tracer(sample_rate=4)
+    assert [tracer.sample() for _ in range(8)] == [False, False, False, True] * 2
+
+
+@pytest.mark.asyncio
+async def test_tracer_hooks():
+    network_stack, adapter = new_stack()
+    tracer = Tracer(sample_rate=1)
+    network_stack.set_tracer(tracer)
+
+    received, dropped, delivered, sent = [], [], [], []
+    tracer.register_to_received_callback(lambda packet, packet_adapter: received.append(bytes(packet.all_packet)))
+    tracer.register_to_dropped_callback(lambda protocol, packet, reason: dropped.append((type(protocol).__name__,
+                                                                                         reason)))
+    tracer.register_to_delivered_callback(lambda packet: delivered.append(bytes(packet.current_packet)))
+    tracer.register_to_sent_callback(lambda sent_adapter, frame: sent.append(frame))
+
+    with UDPSocket(stack=network_stack) as s:
+        s.bind(None, TEST_DST_PORT)
+        packets = [build_udp_packet(adapter, b'delivered'), build_udp_packet(adapter, b'closed', TEST_DST_PORT + 1)]
+        await network_stack.handle_packets(packets, adapter)
+        await s.sendto(b'sent', str(TEST_SRC_IP), TEST_SRC_PORT)
+
+    assert received == packets
+    assert dropped == [('UDP', DropReason.NO_PORT)]
+    assert len(delivered) == 1 and delivered[0].endswith(b'delivered')
+    assert sent == [adapter.get_next_packet_nowait()]
+
+    snapshot = tracer.snapshot()
+    assert {name: histogram['count'] for name, histogram in snapshot['handle'].items()} == \
+        {'Ethernet': 2, 'IPv4': 2, 'UDP': 2}
+    assert {name: histogram['count'] for name, histogram in snapshot['build'].items()} == \
+        {'Ethernet': 1, 'IPv4': 1, 'UDP': 1}
+
+    network_stack.set_tracer(None)
+    await network_stack.handle_packets(packets, adapter)
+    assert len(received) == 2
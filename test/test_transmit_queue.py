@@ -0,0 +1,128 @@
+import pytest
+import asyncio
+import socket
+
+from os_utils.transmit_queue import TransmitQueue
+
+
+PACKET_COUNT = 2000
+
+
+def create_socket_pair():
+    sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sender.setblocking(False)
+    receiver.setblocking(False)
+    return sender, receiver
+
+
+def receive_all(receiver: socket.socket):
+    packets = []
+    while True:
+        try:
+            packets.append(receiver.recv(100))
+        except BlockingIOError:
+            return packets
+
+
+@pytest.mark.asyncio
+async def test_send_right_away():
+    sender, receiver = create_socket_pair()
+    with sender, receiver:
+        queue = TransmitQueue(sender)
+        await queue.send(b'abc')
+        assert len(queue) == 0
+        assert queue.deferred_packets == 0
+        assert receiver.recv(100) == b'abc'
+
+
+@pytest.mark.asyncio
+async def test_deferred_packets_keep_order():
+    sender, receiver = create_socket_pair()
+    with sender, receiver:
+        queue = TransmitQueue(sender, max_packets=PACKET_COUNT)
+        payloads = [i.to_bytes(2, 'big') for i in range(PACKET_COUNT)]
+        await queue.send_many(payloads)
+        # more packets than the socket can hold were sent, so some of them wait in the queue
+        assert queue.deferred_packets > 0
+        assert len(queue) == queue.deferred_packets
+
+        received = []
+        while len(received) < PACKET_COUNT:
+            received += receive_all(receiver)
+            await asyncio.sleep(0.01)
+        assert received == payloads
+        assert len(queue) == 0
+        assert queue.dropped_packets == 0
+
+
+@pytest.mark.asyncio
+async def test_full_queue():
+    sender, receiver = create_socket_pair()
+    with sender, receiver:
+        queue = TransmitQueue(sender, max_packets=10)
+        send_task = asyncio.create_task(queue.send_many([i.to_bytes(2, 'big') for i in range(PACKET_COUNT)]))
+        await asyncio.sleep(0.01)
+        # the sender waits for room in the queue
+        assert not send_task.done()
+        assert len(queue) == 10
+
+        received = []
+        while len(received) < PACKET_COUNT:
+            received += receive_all(receiver)
+            await asyncio.sleep(0.001)
+        await asyncio.wait_for(send_task, 1)
+        assert received == [i.to_bytes(2, 'big') for i in range(PACKET_COUNT)]
+
+
+@pytest.mark.asyncio
+async def test_drop_when_full():
+    sender, receiver = create_socket_pair()
+    with sender, receiver:
+        queue = TransmitQueue(sender, max_packets=10, drop_when_full=True)
+        await asyncio.wait_for(queue.send_many([b'a'] * PACKET_COUNT), 1)
+        assert queue.dropped_packets > 0
+        assert len(queue) == 10
+        queue.close()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_passes_wakeup():
+    sender, receiver = create_socket_pair()
+    with sender, receiver:
+        # fill the socket, so the next frame waits in the queue, and the senders after it wait for room
+        with pytest.raises(BlockingIOError):
+            while True:
+                sender.send(b'fill')
+        queue = TransmitQueue(sender, max_packets=1)
+        await queue.send(b'queued')
+        first = asyncio.create_task(queue.send(b'first'))
+        second = asyncio.create_task(queue.send(b'second'))
+        await asyncio.sleep(0)
+
+        # room for a single frame wakes the first sender, which is cancelled before it runs
+        receive_all(receiver)
+        queue._write_batch()
+        first.cancel()
+        await asyncio.wait_for(second, 1)
+        assert first.cancelled()
+        await asyncio.sleep(0.01)
+        assert receive_all(receiver) == [b'queued', b'second']
+
+
+@pytest.mark.asyncio
+async def test_close_fails_waiting_senders():
+    sender, receiver = create_socket_pair()
+    with sender, receiver:
+        with pytest.raises(BlockingIOError):
+            while True:
+                sender.send(b'fill')
+        queue = TransmitQueue(sender, max_packets=1)
+        await queue.send(b'queued')
+        waiting = asyncio.create_task(queue.send(b'waiting'))
+        await asyncio.sleep(0)
+
+        queue.close()
+        with pytest.raises(OSError):
+            await asyncio.wait_for(waiting, 1)
+        assert not waiting.cancelled()
+        assert queue.dropped_packets == 1
@@ -1,9 +1,10 @@
 from scapy.all import Ether, IP, Raw,  ICMP, IPerror, UDPerror
 from scapy.all import UDP as SCAPY_UDP
 import pytest
+import asyncio
 
 from stack import stack
-from udp import UDP
+from udp import UDP, PacketQueue, EphemeralPortAllocator, NoFreePortException, Datagram, ReusePortGroup
 from network_adapter import MockNetworkAdapter
 from ip_utils import IPAddress
 from icmp import ICMPCodes
@@ -36,11 +37,11 @@ def assert_packet(packet: bytes, adapter: MockNetworkAdapter):
     assert udp.payload.load == TEST_PAYLOAD
 
 
-def build_udp_packet(adapter: MockNetworkAdapter):
+def build_udp_packet(adapter: MockNetworkAdapter, payload: bytes = TEST_PAYLOAD):
     ether = Ether(src=TEST_DST_MAC, dst=adapter.mac)
     ip = IP(src=TEST_DST_IP, dst=adapter.ip)
     udp = SCAPY_UDP(sport=TEST_SRC_PORT, dport=TEST_DST_PORT)
-    packet = ether / ip / udp / TEST_PAYLOAD
+    packet = ether / ip / udp / payload
     return packet.build()
 
 
@@ -78,3 +79,134 @@ async def test_send_to_closed_port(adapter: MockNetworkAdapter):
     udperror = packet.getlayer(UDPerror)
     assert udperror.sport == TEST_SRC_PORT
     assert udperror.dport == TEST_DST_PORT
+
+
+@pytest.mark.asyncio
+async def test_handle_keeps_order(adapter: MockNetworkAdapter):
+    stack.get_protocol(UDP).open_port(str(adapter.ip), TEST_DST_PORT)
+    payloads = [bytes([i]) * 10 for i in range(5)]
+    for payload in payloads:
+        stack.add_packet(build_udp_packet(adapter, payload), adapter)
+
+    for payload in payloads:
+        assert (await stack.get_protocol(UDP).get_packet(str(adapter.ip), TEST_DST_PORT))[2] == payload
+    stack.get_protocol(UDP).close_port(str(adapter.ip), TEST_DST_PORT)
+
+
+def test_queue_limits():
+    queue = PacketQueue(max_packets=2, max_bytes=100)
+    assert queue.append(Datagram(TEST_DST_IP, 1, b'a' * 10))
+    assert queue.append(Datagram(TEST_DST_IP, 1, b'b' * 10))
+    assert not queue.append(Datagram(TEST_DST_IP, 1, b'c' * 10)), 'queue is limited to 2 packets'
+    assert queue.pop().data == b'a' * 10
+    assert not queue.append(Datagram(TEST_DST_IP, 1, b'd' * 95)), 'queue is limited to 100 bytes'
+    assert queue.dropped_packets == 2
+    assert queue.dropped_bytes == 105
+    assert queue.queued_bytes == 10
+
+
+@pytest.mark.asyncio
+async def test_queue_many_waiters():
+    queue = PacketQueue()
+    waiters = [asyncio.create_task(queue.wait_for_packet()) for _ in range(3)]
+    await asyncio.sleep(0)
+
+    for i in range(3):
+        queue.append(Datagram(TEST_DST_IP, 1, bytes([i])))
+    results = await asyncio.gather(*waiters)
+    assert sorted(bytes(result.data) for result in results) == [b'\x00', b'\x01', b'\x02']
+
+    # the queue is empty now, so a new waiter must block
+    waiter = asyncio.create_task(queue.wait_for_packet())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+    queue.append(Datagram(TEST_DST_IP, 1, b'x'))
+    assert (await waiter).data == b'x'
+
+
+def test_reuse_port_group_affinity():
+    group = ReusePortGroup()
+    queues = [PacketQueue() for _ in range(4)]
+    for queue in queues[:3]:
+        group.add(queue)
+    flows = range(1000, 1300)
+    owners = {port: group.queue_for(int(TEST_DST_IP), port) for port in flows}
+    assert set(owners.values()) == set(queues[:3])
+
+    # a new queue only takes flows, it never moves flows between the old queues
+    group.add(queues[3])
+    moved = {port for port in flows if group.queue_for(int(TEST_DST_IP), port) is not owners[port]}
+    assert moved and all(group.queue_for(int(TEST_DST_IP), port) is queues[3] for port in moved)
+    assert len(moved) < len(flows) / 2
+
+    # only the flows of a removed queue move, and its waiting packets go to their new queues in order
+    for port in flows:
+        group.append(Datagram(TEST_DST_IP, port, b'first'))
+    removed = queues[3]
+    group.remove(removed)
+    for port in flows:
+        group.append(Datagram(TEST_DST_IP, port, b'second'))
+    assert len(removed) == 0
+    for port in flows:
+        assert group.queue_for(int(TEST_DST_IP), port) is owners[port]
+    for queue in queues[:3]:
+        packets = queue.pop_many(len(queue))
+        for port in {packet.src_port for packet in packets}:
+            assert [bytes(packet.data) for packet in packets if packet.src_port == port] == [b'first', b'second']
+
+
+@pytest.mark.asyncio
+async def test_specific_ip_before_wildcard(adapter: MockNetworkAdapter):
+    udp = stack.get_protocol(UDP)
+    specific_queue = udp.open_port(str(adapter.ip), TEST_DST_PORT)
+    wildcard_queue = udp.open_port('0.0.0.0', TEST_DST_PORT)
+    assert udp.get_queue(None, TEST_DST_PORT) is wildcard_queue, '0.0.0.0 is a wildcard binding'
+
+    stack.add_packet(build_udp_packet(adapter), adapter)
+    assert (await udp.get_packet(str(adapter.ip), TEST_DST_PORT))[2] == TEST_PAYLOAD
+    assert len(wildcard_queue) == 0
+
+    udp.close_port(str(adapter.ip), TEST_DST_PORT)
+    stack.add_packet(build_udp_packet(adapter), adapter)
+    assert (await udp.get_packet(None, TEST_DST_PORT))[2] == TEST_PAYLOAD
+    assert len(specific_queue) == 0
+
+    udp.close_port(None, TEST_DST_PORT)
+    assert not udp.is_port_open(TEST_DST_PORT)
+
+
+def test_ephemeral_port_allocator():
+    allocator = EphemeralPortAllocator(1000, 1009)
+    allocator.take(1005)
+    ports = {allocator.allocate() for _ in range(9)}
+    assert ports == set(range(1000, 1010)) - {1005}
+
+    with pytest.raises(NoFreePortException):
+        allocator.allocate()
+
+    allocator.release(1003)
+    allocator.release(1003)
+    assert allocator.allocate() == 1003
+    allocator.release(1)  # out of range ports are ignored
+    assert len(allocator) == 0
+
+
+@pytest.mark.asyncio
+async def test_open_ephemeral_port(adapter: MockNetworkAdapter):
+    udp = stack.get_protocol(UDP)
+    udp.set_ephemeral_port_range(TEST_DST_PORT, TEST_DST_PORT + 1)
+    try:
+        udp.open_port(None, TEST_DST_PORT)
+        port, queue = udp.open_ephemeral_port(None)
+        assert port == TEST_DST_PORT + 1
+        assert udp.get_queue(None, port) is queue
+
+        with pytest.raises(NoFreePortException):
+            udp.open_ephemeral_port(None)
+
+        udp.close_port(None, TEST_DST_PORT)
+        assert udp.open_ephemeral_port(None)[0] == TEST_DST_PORT
+        udp.close_port(None, TEST_DST_PORT)
+        udp.close_port(None, TEST_DST_PORT + 1)
+    finally:
+        udp.set_ephemeral_port_range(*EphemeralPortAllocator.DEFAULT_RANGE)
@@ -1,13 +1,17 @@
-from scapy.all import Ether, IP, Raw
+from scapy.all import Ether, IP, Raw, ICMP as SCAPY_ICMP, IPerror, UDPerror
 from scapy.all import UDP as SCAPY_UDP
 import pytest
+import asyncio
 
 from stack import stack, NetworkAdapterInterface
 from udp import UDP
+from icmp import ICMP
+from stats import DropReason
 from ethernet import Ethernet, MacResolverInterface
 from udp_socket import UDPSocket
 from network_adapter import MockNetworkAdapter
 from ip_utils import IPAddress
+from conftest import build_udp_packet
 
 
 TEST_DST_IP = IPAddress('1.1.1.1')
@@ -58,11 +62,7 @@ async def test_recv(adapter: MockNetworkAdapter):
     s = UDPSocket()
     s.bind(None, TEST_DST_PORT)
 
-    ether = Ether(src=TEST_DST_MAC, dst=adapter.mac)
-    ip = IP(src=TEST_DST_IP, dst=adapter.ip)
-    udp = SCAPY_UDP(sport=TEST_SRC_PORT, dport=TEST_DST_PORT)
-    packet = ether / ip / udp / TEST_PAYLOAD
-    stack.add_packet(packet.build(), adapter)
+    stack.add_packet(build_udp_packet(adapter, TEST_PAYLOAD, TEST_DST_PORT), adapter)
 
     assert await s.recv() == TEST_PAYLOAD
     s.close()
@@ -121,3 +121,210 @@ async def test_enter_and_exit(adapter: MockNetworkAdapter):
         await s.send(TEST_PAYLOAD)
         assert_packet(adapter.get_next_packet_nowait(), adapter)
     assert s.src_port is None, "socket should be unbound now"
+
+
+def assert_checksums(packet: Ether):
+    ip_checksum, udp_checksum = packet[IP].chksum, packet[SCAPY_UDP].chksum
+    del packet[IP].chksum
+    del packet[SCAPY_UDP].chksum
+    rebuilt = Ether(packet.build())
+    assert rebuilt[IP].chksum == ip_checksum
+    assert rebuilt[SCAPY_UDP].chksum == udp_checksum
+
+
+@pytest.mark.asyncio
+async def test_send_segments(adapter: MockNetworkAdapter):
+    stack.get_protocol(Ethernet).set_mac_resolver(MockMacResolver())
+    payload = bytes(range(256)) * 4 + b'tail'
+    segment_size = 100
+    with UDPSocket() as s:
+        s.bind(None, TEST_SRC_PORT)
+        s.connect(str(TEST_DST_IP), TEST_DST_PORT)
+        await s.send_segments(payload, segment_size)
+
+    received = b''
+    while not adapter.sent_packets.empty():
+        packet = Ether(adapter.get_next_packet_nowait())
+        assert packet[SCAPY_UDP].sport == TEST_SRC_PORT
+        assert packet[SCAPY_UDP].dport == TEST_DST_PORT
+        assert len(packet[Raw].load) <= segment_size
+        assert_checksums(packet)
+        received += packet[Raw].load
+    assert received == payload
+
+
+@pytest.mark.asyncio
+async def test_recvmany(adapter: MockNetworkAdapter):
+    with UDPSocket() as s:
+        s.bind(None, TEST_DST_PORT + 1)
+        assert await s.recvmany(10, timeout=0.01) == []
+
+        payloads = [bytes([i]) * 5 for i in range(5)]
+        for payload in payloads:
+            stack.add_packet(build_udp_packet(adapter, payload, TEST_DST_PORT + 1), adapter)
+        await asyncio.sleep(0.01)
+
+        packets = await s.recvmany(3)
+        assert [packet[2] for packet in packets] == payloads[:3]
+        packets = await s.recvmany(3)
+        assert [packet[2] for packet in packets] == payloads[3:]
+
+
+@pytest.mark.asyncio
+async def test_async_iteration(adapter: MockNetworkAdapter):
+    s = UDPSocket()
+    s.bind(None, TEST_DST_PORT + 1)
+    payloads = [bytes([i]) * 5 for i in range(5)]
+
+    async def consume():
+        return [packet[2] async for packet in s]
+
+    consumer = asyncio.create_task(consume())
+    for payload in payloads:
+        stack.add_packet(build_udp_packet(adapter, payload, TEST_DST_PORT + 1), adapter)
+    await asyncio.sleep(0.01)
+
+    s.close()
+    assert await consumer == payloads
+
+
+@pytest.mark.asyncio
+async def test_async_iteration_drains_queue(adapter: MockNetworkAdapter):
+    with UDPSocket(recv_queue_length=3) as s:
+        s.bind(None, TEST_DST_PORT + 1)
+        payloads = [bytes([i]) * 5 for i in range(6)]
+        for payload in payloads[:3]:
+            stack.add_packet(build_udp_packet(adapter, payload, TEST_DST_PORT + 1), adapter)
+        await asyncio.sleep(0.01)
+
+        packets = aiter(s)
+        assert (await anext(packets))[2] == payloads[0]
+        # the first packet took all the queued packets, so the receive queue has room for 3 more
+        for payload in payloads[3:]:
+            stack.add_packet(build_udp_packet(adapter, payload, TEST_DST_PORT + 1), adapter)
+        await asyncio.sleep(0.01)
+        assert s.dropped_packets == 0
+        assert [(await anext(packets))[2] for _ in range(5)] == payloads[1:]
+
+
+@pytest.mark.asyncio
+async def test_recv_into(adapter: MockNetworkAdapter):
+    with UDPSocket() as s:
+        s.bind(None, TEST_DST_PORT + 1)
+        stack.add_packet(build_udp_packet(adapter, TEST_PAYLOAD, TEST_DST_PORT + 1), adapter)
+        stack.add_packet(build_udp_packet(adapter, TEST_PAYLOAD, TEST_DST_PORT + 1), adapter)
+
+        buffer = bytearray(100)
+        assert await s.recv_into(buffer) == len(TEST_PAYLOAD)
+        assert buffer[:len(TEST_PAYLOAD)] == TEST_PAYLOAD
+
+        src_ip, src_port, size = await s.recvfrom_into(buffer, 2)
+        assert (src_ip, src_port) == (TEST_DST_IP, TEST_SRC_PORT)
+        assert size == 2
+        assert buffer[:2] == TEST_PAYLOAD[:2]
+
+
+@pytest.mark.asyncio
+async def test_zero_copy_recv(adapter: MockNetworkAdapter):
+    with UDPSocket(zero_copy=True) as s:
+        s.bind(None, TEST_DST_PORT + 1)
+        stack.add_packet(build_udp_packet(adapter, TEST_PAYLOAD, TEST_DST_PORT + 1), adapter)
+
+        datagram = await s.recvfrom()
+        assert isinstance(datagram.data, memoryview)
+        assert datagram.data == TEST_PAYLOAD
+        assert datagram.src_ip == TEST_DST_IP
+        assert datagram.src_port == TEST_SRC_PORT
+
+
+@pytest.mark.asyncio
+async def test_reuse_port(adapter: MockNetworkAdapter):
+    port = TEST_DST_PORT + 2
+    sockets = [UDPSocket(reuse_port=True) for _ in range(3)]
+    for s in sockets:
+        s.bind(None, port)
+
+    with pytest.raises(Exception):
+        UDPSocket().bind(None, port)
+
+    flows = range(2000, 2030)
+    for src_port in flows:
+        stack.add_packet(build_udp_packet(adapter, TEST_PAYLOAD, port, src_port=src_port), adapter)
+    await asyncio.sleep(0.01)
+
+    received = {s: {packet[1] for packet in await s.recvmany(100, timeout=0)} for s in sockets}
+    assert set().union(*received.values()) == set(flows)
+    assert all(received.values()), 'packets should be spread between the sockets'
+
+    # packets of the same flow get to the same socket
+    stack.add_packet(build_udp_packet(adapter, TEST_PAYLOAD, port, src_port=flows[0]), adapter)
+    await asyncio.sleep(0.01)
+    owner = next(s for s in sockets if flows[0] in received[s])
+    assert (await owner.recvfrom())[1] == flows[0]
+
+    # packets that wait in a closed socket move to the other sockets
+    stack.add_packet(build_udp_packet(adapter, TEST_PAYLOAD, port, src_port=flows[0]), adapter)
+    await asyncio.sleep(0.01)
+    owner.close()
+    sockets.remove(owner)
+    moved = [packet for s in sockets for packet in await s.recvmany(100, timeout=0)]
+    assert [packet[1] for packet in moved] == [flows[0]]
+
+    for s in sockets:
+        s.close()
+    assert not stack.get_protocol(UDP).is_port_open(port)
+
+
+def add_port_unreachable(adapter: MockNetworkAdapter, src_port: int, checksum: int = None):
+    ether = Ether(src=TEST_DST_MAC, dst=adapter.mac)
+    ip = IP(src=TEST_DST_IP, dst=adapter.ip)
+    error = IPerror(src=adapter.ip, dst=TEST_DST_IP) / UDPerror(sport=src_port, dport=TEST_DST_PORT)
+    icmp = SCAPY_ICMP(type='dest-unreach', code='port-unreachable', chksum=checksum)
+    stack.add_packet((ether / ip / icmp / error).build(), adapter)
+
+
+@pytest.mark.asyncio
+async def test_port_unreachable(adapter: MockNetworkAdapter):
+    stack.get_protocol(Ethernet).set_mac_resolver(MockMacResolver())
+    with UDPSocket() as s:
+        s.connect(str(TEST_DST_IP), TEST_DST_PORT)
+        await s.send(TEST_PAYLOAD)
+
+        add_port_unreachable(adapter, s.src_port)
+        await asyncio.sleep(0.01)
+        with pytest.raises(ConnectionRefusedError):
+            await s.send(TEST_PAYLOAD)
+        # the error is raised only once
+        await s.send(TEST_PAYLOAD)
+
+        receiver = asyncio.create_task(s.recv())
+        await asyncio.sleep(0)
+        add_port_unreachable(adapter, s.src_port)
+        with pytest.raises(ConnectionRefusedError):
+            await receiver
+
+
+@pytest.mark.asyncio
+async def test_port_unreachable_of_another_peer(adapter: MockNetworkAdapter):
+    stack.get_protocol(Ethernet).set_mac_resolver(MockMacResolver())
+    with UDPSocket() as s:
+        s.connect(str(TEST_DST_IP), TEST_DST_PORT + 1)
+        await s.send(TEST_PAYLOAD)
+
+        add_port_unreachable(adapter, s.src_port)
+        await asyncio.sleep(0.01)
+        await s.send(TEST_PAYLOAD)
+
+
+@pytest.mark.asyncio
+async def test_corrupted_port_unreachable(adapter: MockNetworkAdapter):
+    stack.get_protocol(Ethernet).set_mac_resolver(MockMacResolver())
+    drops = stack.get_protocol(ICMP).counters.drops.get(DropReason.BAD_CHECKSUM, 0)
+    with UDPSocket() as s:
+        s.connect(str(TEST_DST_IP), TEST_DST_PORT)
+        await s.send(TEST_PAYLOAD)
+
+        add_port_unreachable(adapter, s.src_port, checksum=0x1234)
+        await asyncio.sleep(0.01)
+        await s.send(TEST_PAYLOAD)
+    assert stack.get_protocol(ICMP).counters.drops[DropReason.BAD_CHECKSUM] == drops + 1
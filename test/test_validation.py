@@ -0,0 +1,97 @@
+from scapy.all import Ether, ARP as SCAPY_ARP
+from unittest import mock
+import pytest
+import asyncio
+import os
+
+from stack import stack
+from udp_socket import UDPSocket
+from validation import ValidationStage
+from packet import Packet
+from ipv4 import IPv4
+from udp import UDP
+from network_adapter import MockNetworkAdapter
+from conftest import TEST_SRC_IP, TEST_SRC_PORT, TEST_DST_PORT, build_udp_packet, new_stack
+
+
+def test_validate_frame(adapter: MockNetworkAdapter):
+    assert ValidationStage.validate_frame(build_udp_packet(adapter, b'valid'))
+    assert ValidationStage.validate_frame(memoryview(build_udp_packet(adapter, b'odd')))
+    assert ValidationStage.validate_frame(build_udp_packet(adapter, b'no checksum', udp_checksum=0))
+    assert not ValidationStage.validate_frame(build_udp_packet(adapter, b'bad ip', ip_checksum=0x1234))
+    assert not ValidationStage.validate_frame(build_udp_packet(adapter, b'bad udp', udp_checksum=0x1234))
+    # only ipv4 is checked
+    assert ValidationStage.validate_frame((Ether() / SCAPY_ARP()).build())
+
+
+@pytest.mark.asyncio
+async def test_stage_drops_invalid_packets(adapter: MockNetworkAdapter):
+    validation_stage = ValidationStage(workers=2, enabled=True, min_chunk_size=1)
+    stack.set_validation_stage(validation_stage)
+    try:
+        with UDPSocket() as s:
+            s.bind(None, TEST_DST_PORT)
+            packets = [build_udp_packet(adapter, b'first'),
+                       build_udp_packet(adapter, b'bad', udp_checksum=0x1234),
+                       build_udp_packet(adapter, b'second'),
+                       build_udp_packet(adapter, b'third')]
+            await stack.handle_packets(packets, adapter)
+
+            for payload in (b'first', b'second', b'third'):
+                assert await asyncio.wait_for(s.recvfrom(), 1) == (str(TEST_SRC_IP), TEST_SRC_PORT, payload)
+            assert validation_stage.invalid_packets == 1
+    finally:
+        stack.set_validation_stage(None)
+        validation_stage.close()
+
+
+@pytest.mark.asyncio
+async def test_stats_with_and_without_stage():
+    async def handle_batch(validation_stage) -> dict:
+        network_stack, adapter = new_stack()
+        network_stack.set_validation_stage(validation_stage)
+        with UDPSocket(stack=network_stack) as s:
+            s.bind(None, TEST_DST_PORT)
+            packets = [build_udp_packet(adapter, b'first'),
+                       build_udp_packet(adapter, b'bad ip', ip_checksum=0x1234),
+                       build_udp_packet(adapter, b'bad udp', udp_checksum=0x1234),
+                       build_udp_packet(adapter, b'second')]
+            await network_stack.handle_packets(packets, adapter)
+        return network_stack.stats()
+
+    validation_stage = ValidationStage(workers=2, enabled=True, min_chunk_size=1)
+    try:
+        stats = await handle_batch(validation_stage)
+    finally:
+        validation_stage.close()
+    assert validation_stage.invalid_packets == 2
+    assert stats == await handle_batch(None)
+    assert stats['protocols']['IPv4']['drops'] == {'bad_checksum': 1}
+    assert stats['protocols']['UDP']['drops'] == {'bad_checksum': 1}
+
+
+@pytest.mark.asyncio
+async def test_stage_disabled_with_gil():
+    with mock.patch('validation.gil_enabled', return_value=True):
+        validation_stage = ValidationStage()
+    assert not validation_stage.enabled
+    validation_stage.close()
+
+    with mock.patch('validation.gil_enabled', return_value=False):
+        validation_stage = ValidationStage()
+    assert validation_stage.enabled
+    # the work is all cpu, so a thread per cpu
+    assert validation_stage.workers == os.cpu_count()
+    validation_stage.close()
+
+
+@pytest.mark.asyncio
+async def test_verified_packet_skips_checksum(adapter: MockNetworkAdapter):
+    frame = build_udp_packet(adapter, b'bad ip', ip_checksum=0x1234)
+    ip_packet = Packet(frame)
+    ip_packet.add_layer('ethernet', {}, 14)
+    assert await stack.get_protocol(IPv4).handle(ip_packet, adapter) is None
+
+    verified_packet = Packet(frame, checksum_verified=True)
+    verified_packet.add_layer('ethernet', {}, 14)
+    assert await stack.get_protocol(IPv4).handle(verified_packet, adapter) == UDP.PROTOCOL_ID
@@ -0,0 +1,166 @@
+from scapy.all import Ether, IP, UDP as SCAPY_UDP, Raw, ARP as SCAPY_ARP
+import pytest
+import asyncio
+import contextlib
+
+from stack import stack, NetworkStack, NetworkAdapterInterface
+from ethernet import Ethernet, MacResolverInterface
+from arp import ARP
+from udp_socket import UDPSocket
+from wire_adapter import WireNetworkAdapter
+from ip_utils import IPAddress
+from stats import DropReason
+
+
+LOCAL_IP = '10.0.0.1'
+LOCAL_MAC = '02:00:00:00:00:01'
+REMOTE_IP = '10.0.0.2'
+REMOTE_MAC = '02:00:00:00:00:02'
+NETMASK = IPAddress('255.255.255.0')
+LOCAL_PORT = 5555
+REMOTE_PORT = 6666
+
+
+class RemoteMacResolver(MacResolverInterface):
+    async def get_mac(self, adapter: NetworkAdapterInterface, dst_ip: IPAddress) -> str:
+        assert dst_ip == REMOTE_IP
+        return REMOTE_MAC
+
+
+class RecordingStack:
+    """
+    stands for the stack on the other side of the wire, and keeps the batches it gets
+    """
+    def __init__(self):
+        self.batches = []
+        self.received = asyncio.Event()
+
+    async def handle_packets(self, packets, adapter):
+        self.batches.append(packets)
+        self.received.set()
+
+
+@contextlib.contextmanager
+def wire(**options):
+    """
+    must be used inside a running loop, since the adapters start their tasks
+    """
+    stack.get_protocol(Ethernet).set_mac_resolver(RemoteMacResolver())
+    remote_stack = RecordingStack()
+    local, remote = WireNetworkAdapter.pair(dict(mac=LOCAL_MAC, ip=IPAddress(LOCAL_IP), netmask=NETMASK),
+                                            dict(mac=REMOTE_MAC, ip=IPAddress(REMOTE_IP), netmask=NETMASK,
+                                                 stack=remote_stack),
+                                            **options)
+    stack.add_adapter(local)
+    try:
+        yield remote, remote_stack
+    finally:
+        stack.remove_adapter(local)
+        local.close()
+        remote.close()
+        stack.get_protocol(Ethernet).set_mac_resolver(stack.get_protocol(ARP))
+
+
+def build_frame(payload: bytes) -> bytes:
+    return bytes(Ether(src=REMOTE_MAC, dst=LOCAL_MAC) / IP(src=REMOTE_IP, dst=LOCAL_IP) /
+                 SCAPY_UDP(sport=REMOTE_PORT, dport=LOCAL_PORT) / Raw(payload))
+
+
+@pytest.mark.asyncio
+async def test_round_trip():
+    with wire() as (remote, remote_stack), UDPSocket() as s:
+        s.bind(LOCAL_IP, LOCAL_PORT)
+        await remote.send(build_frame(b'ping'))
+        src_ip, src_port, data = await asyncio.wait_for(s.recvfrom(), 1)
+        assert (src_ip, src_port, data) == (REMOTE_IP, REMOTE_PORT, b'ping')
+
+        await s.sendto(b'pong', src_ip, src_port)
+        await asyncio.wait_for(remote_stack.received.wait(), 1)
+        packet = Ether(remote_stack.batches[0][0])
+        assert packet.getlayer(IP).src == LOCAL_IP
+        assert packet.getlayer(SCAPY_UDP).dport == REMOTE_PORT
+        assert packet.getlayer(Raw).load == b'pong'
+
+
+@pytest.mark.asyncio
+async def test_batches_and_full_queue():
+    """
+    more packets than fit in the queue of the peer are sent, so the sender waits for the peer instead of dropping,
+    and the peer gets them in batches of up to batch_size
+    """
+    with wire(batch_size=4, max_packets=8) as (remote, remote_stack), UDPSocket() as s:
+        s.bind(LOCAL_IP, LOCAL_PORT)
+        s.connect(REMOTE_IP, REMOTE_PORT)
+        await asyncio.wait_for(s.send_segments(bytes(range(100)), 1), 1)
+        while sum(len(batch) for batch in remote_stack.batches) < 100:
+            remote_stack.received.clear()
+            await asyncio.wait_for(remote_stack.received.wait(), 1)
+
+        assert max(len(batch) for batch in remote_stack.batches) == 4
+        payloads = [Ether(frame).getlayer(Raw).load for batch in remote_stack.batches for frame in batch]
+        assert payloads == [bytes([i]) for i in range(100)]
+
+
+@pytest.mark.asyncio
+async def test_two_stacks():
+    """
+    two independent stacks, each with its own arp, talk through the wire
+    """
+    local_stack = NetworkStack()
+    remote_stack = NetworkStack()
+    local, remote = WireNetworkAdapter.pair(dict(mac=LOCAL_MAC, ip=IPAddress(LOCAL_IP), netmask=NETMASK,
+                                                 stack=local_stack),
+                                            dict(mac=REMOTE_MAC, ip=IPAddress(REMOTE_IP), netmask=NETMASK,
+                                                 stack=remote_stack))
+    local_stack.add_adapter(local)
+    remote_stack.add_adapter(remote)
+    try:
+        # both stacks can use the same port, since every stack has its own ports
+        with UDPSocket(stack=local_stack) as client, UDPSocket(stack=remote_stack) as server:
+            client.bind(LOCAL_IP, LOCAL_PORT)
+            server.bind(REMOTE_IP, LOCAL_PORT)
+            await asyncio.wait_for(client.sendto(b'ping', REMOTE_IP, LOCAL_PORT), 1)
+            assert await asyncio.wait_for(server.recvfrom(), 1) == (LOCAL_IP, LOCAL_PORT, b'ping')
+
+            await asyncio.wait_for(server.sendto(b'pong', LOCAL_IP, LOCAL_PORT), 1)
+            assert await asyncio.wait_for(client.recv(), 1) == b'pong'
+    finally:
+        local.close()
+        remote.close()
+
+
+@pytest.mark.asyncio
+async def test_replies_dont_block_receive():
+    """
+    both sides get more arp requests than fit in the queues, and reply to them while handling them. the replies of a
+    side can't wait for the queue of the other side, or both receive tasks would wait for each other forever
+    """
+    local_stack = NetworkStack()
+    remote_stack = NetworkStack()
+    local, remote = WireNetworkAdapter.pair(dict(mac=LOCAL_MAC, ip=IPAddress(LOCAL_IP), netmask=NETMASK,
+                                                 stack=local_stack),
+                                            dict(mac=REMOTE_MAC, ip=IPAddress(REMOTE_IP), netmask=NETMASK,
+                                                 stack=remote_stack),
+                                            batch_size=4, max_packets=4)
+    local_stack.add_adapter(local)
+    remote_stack.add_adapter(remote)
+    try:
+        def requests(src_mac: str, src_ip: str, dst_ip: str) -> list:
+            return [bytes(Ether(src=src_mac, dst='ff:ff:ff:ff:ff:ff') /
+                          SCAPY_ARP(op=1, hwsrc=src_mac, psrc=src_ip, pdst=dst_ip))] * 50
+
+        await asyncio.wait_for(asyncio.gather(local.send_many(requests(LOCAL_MAC, LOCAL_IP, REMOTE_IP)),
+                                              remote.send_many(requests(REMOTE_MAC, REMOTE_IP, LOCAL_IP))), 1)
+        await asyncio.sleep(0.01)
+        assert local.dropped_packets + remote.dropped_packets > 0
+        assert local_stack.adapter_counters(local).drops.get(DropReason.QUEUE_FULL, 0) == local.dropped_packets
+
+        # the wire still works
+        with UDPSocket(stack=local_stack) as client, UDPSocket(stack=remote_stack) as server:
+            client.bind(LOCAL_IP, LOCAL_PORT)
+            server.bind(REMOTE_IP, LOCAL_PORT)
+            await asyncio.wait_for(client.sendto(b'ping', REMOTE_IP, LOCAL_PORT), 1)
+            assert await asyncio.wait_for(server.recvfrom(), 1) == (LOCAL_IP, LOCAL_PORT, b'ping')
+    finally:
+        local.close()
+        remote.close()
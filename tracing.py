@@ -0,0 +1,191 @@
+from typing import Dict, List, Callable, Optional
+
+from adapter_interface import NetworkAdapterInterface
+from packet import Packet
+from stats import DropReason
+
+
+class LogLinearHistogram:
+    """
+    A histogram of non negative integers (like latencies in nanoseconds) in a fixed amount of memory.
+    Every power of two range is split to 2 ** sub_bucket_bits linear buckets, so a value is kept with a relative error
+    of at most 2 ** -sub_bucket_bits, whatever its size (like HdrHistogram). Values above 2 ** max_bits are counted in
+    the last bucket.
+    """
+    DEFAULT_SUB_BUCKET_BITS = 4
+    DEFAULT_MAX_BITS = 40  # about 18 minutes in nanoseconds
+
+    def __init__(self, sub_bucket_bits: int = DEFAULT_SUB_BUCKET_BITS, max_bits: int = DEFAULT_MAX_BITS):
+        self.sub_bucket_bits = sub_bucket_bits
+        self._buckets = [0] * (self._index(1 << max_bits) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def _index(self, value: int) -> int:
+        shift = value.bit_length() - self.sub_bucket_bits - 1
+        if shift <= 0:
+            return value
+        return (shift << self.sub_bucket_bits) + (value >> shift)
+
+    def _bucket_value(self, index: int) -> int:
+        """
+        The smallest value that is counted in the bucket
+        """
+        shift = (index >> self.sub_bucket_bits) - 1
+        if shift <= 0:
+            return index
+        return (index - (shift << self.sub_bucket_bits)) << shift
+
+    def record(self, value: int):
+        index = self._index(value)
+        self._buckets[min(index, len(self._buckets) - 1)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percentile: float) -> int:
+        """
+        The value below which the given percent of the recorded values are (rounded down to its bucket)
+        """
+        if self.count == 0:
+            return 0
+        rank = max(1, round(self.count * percentile / 100))
+        seen = 0
+        for index, bucket_count in enumerate(self._buckets):
+            seen += bucket_count
+            if seen >= rank:
+                # values above the range are all in the last bucket
+                return self.max if index == len(self._buckets) - 1 else min(self._bucket_value(index), self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+    def clear(self):
+        self._buckets = [0] * len(self._buckets)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+
+class Tracer:
+    """
+    Opt-in instrumentation of a stack (see `NetworkStack.set_tracer`).
+    Records how long every protocol takes to handle and to build packets into a histogram per protocol, for one of
+    every sample_rate packets, and calls the registered callbacks for every packet that is received, dropped, delivered
+    to a socket or sent.
+    While no tracer is set, the stack only checks that it has none.
+    """
+    DEFAULT_SAMPLE_RATE = 64
+
+    def __init__(self, sample_rate: int = DEFAULT_SAMPLE_RATE):
+        """
+        @param sample_rate - the time of one of every sample_rate packets is recorded. 1 records every packet
+        """
+        self.sample_rate = sample_rate
+        self._countdown = sample_rate
+        self.handle_histograms = {}  # type: Dict[str, LogLinearHistogram]
+        self.build_histograms = {}  # type: Dict[str, LogLinearHistogram]
+        self._received_callbacks = []  # type: List[Callable[[Packet, NetworkAdapterInterface], None]]
+        self._dropped_callbacks = []  # type: List[Callable[[object, Optional[Packet], DropReason], None]]
+        self._delivered_callbacks = []  # type: List[Callable[[Packet], None]]
+        self._sent_callbacks = []  # type: List[Callable[[NetworkAdapterInterface, bytes], None]]
+
+    def sample(self) -> bool:
+        """
+        Whether the time of the current packet should be recorded
+        """
+        self._countdown -= 1
+        if self._countdown > 0:
+            return False
+        self._countdown = self.sample_rate
+        return True
+
+    def record_handle(self, protocol, elapsed: int):
+        self._histogram(self.handle_histograms, type(protocol).__name__).record(elapsed)
+
+    def record_build(self, protocol, elapsed: int):
+        self._histogram(self.build_histograms, type(protocol).__name__).record(elapsed)
+
+    @staticmethod
+    def _histogram(histograms: Dict[str, LogLinearHistogram], name: str) -> LogLinearHistogram:
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = LogLinearHistogram()
+        return histogram
+
+    def snapshot(self) -> dict:
+        """
+        The latency percentiles (in nanoseconds) of handling and building packets, by protocol
+        """
+        return {
+            'handle': {name: histogram.snapshot() for name, histogram in self.handle_histograms.items()},
+            'build': {name: histogram.snapshot() for name, histogram in self.build_histograms.items()},
+        }
+
+    def register_to_received_callback(self, callback: Callable[[Packet, NetworkAdapterInterface], None]):
+        """
+        callback(packet, adapter) is called for every packet the stack gets, before it is handled
+        """
+        self._received_callbacks.append(callback)
+
+    def register_to_dropped_callback(self, callback: Callable[[object, Optional[Packet], DropReason], None]):
+        """
+        callback(protocol, packet, reason) is called for every packet a protocol drops. packet is None if the dropped
+        packet wasn't a received one
+        """
+        self._dropped_callbacks.append(callback)
+
+    def register_to_delivered_callback(self, callback: Callable[[Packet], None]):
+        """
+        callback(packet) is called for every packet delivered to a socket
+        """
+        self._delivered_callbacks.append(callback)
+
+    def register_to_sent_callback(self, callback: Callable[[NetworkAdapterInterface, bytes], None]):
+        """
+        callback(adapter, frame) is called for every frame given to an adapter
+        """
+        self._sent_callbacks.append(callback)
+
+    def unregister_from_received_callback(self, callback: Callable[[Packet, NetworkAdapterInterface], None]):
+        self._received_callbacks.remove(callback)
+
+    def unregister_from_dropped_callback(self, callback: Callable[[object, Optional[Packet], DropReason], None]):
+        self._dropped_callbacks.remove(callback)
+
+    def unregister_from_delivered_callback(self, callback: Callable[[Packet], None]):
+        self._delivered_callbacks.remove(callback)
+
+    def unregister_from_sent_callback(self, callback: Callable[[NetworkAdapterInterface, bytes], None]):
+        self._sent_callbacks.remove(callback)
+
+    @property
+    def has_callbacks(self) -> bool:
+        return bool(self._received_callbacks or self._dropped_callbacks or self._delivered_callbacks or
+                    self._sent_callbacks)
+
+    def received(self, packet: Packet, adapter: NetworkAdapterInterface):
+        for callback in self._received_callbacks:
+            callback(packet, adapter)
+
+    def dropped(self, protocol, packet: Optional[Packet], reason: DropReason):
+        for callback in self._dropped_callbacks:
+            callback(protocol, packet, reason)
+
+    def delivered(self, packet: Packet):
+        for callback in self._delivered_callbacks:
+            callback(packet)
+
+    def sent(self, adapter: NetworkAdapterInterface, frame: bytes):
+        for callback in self._sent_callbacks:
+            callback(adapter, frame)
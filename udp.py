@@ -1,112 +1,615 @@
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Deque, Dict, List, Iterable, NamedTuple, Union, Callable
+import abc
 import struct
-from io import BytesIO
-from asyncio import Event
+import random
+from collections import deque
+from asyncio import Future, CancelledError, get_running_loop
 
 from ip_utils import IPAddress
-from stack import NetworkAdapterInterface, stack
+from stack import NetworkAdapterInterface, NetworkStack
 from protocol import Protocol
 from ipv4 import IPv4
 from utils import calculate_checksum
 from packet import Packet
-from icmp import ICMP, ICMPCodes
+from stats import DropReason
+from icmp import ICMP, ICMPCodes, DestinationUnreachableHandler
 
 
 class PortAlreadyOpenedException(Exception):
     pass
 
 
+class NoFreePortException(Exception):
+    pass
+
+
+class PortClosedException(Exception):
+    pass
+
+
+class DatagramHandler:
+    @abc.abstractmethod
+    def handle_datagram(self, src_ip: int, src_port: int, dst_ip: int, dst_port: int, size: int):
+        """
+        this function will be called for every datagram delivered to a socket, and for every datagram built to be sent.
+        size is the size of the datagram, with its udp header
+        """
+        pass
+
+
+class Datagram(NamedTuple):
+    """
+    A datagram waiting in a receive queue.
+    data is a memoryview over the frame the datagram arrived in, and src_ip is formatted as a string only if asked to.
+    """
+    src_ip: IPAddress
+    src_port: int
+    data: memoryview
+
+
 class PacketQueue:
-    def __init__(self):
-        self._queue = []
-        self._event = Event()
+    """
+    Receive queue of a single open port.
+    Packets are kept in arrival order, and the queue is bounded both in packets and in bytes (like SO_RCVBUF).
+    Packets that arrive when the queue is full are dropped and counted.
+    """
+    DEFAULT_MAX_PACKETS = 1024
+    DEFAULT_MAX_BYTES = 212992  # linux default for net.core.rmem_default
+
+    def __init__(self, max_packets: int = DEFAULT_MAX_PACKETS, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_packets = max_packets
+        self.max_bytes = max_bytes
+        self._queue = deque()
+        self._bytes = 0
+        self._waiters = deque()  # type: Deque[Future]
+        self.dropped_packets = 0
+        self.dropped_bytes = 0
+        self.closed = False
+        # (ip as int, port) of the peer of a connected socket, used to match icmp errors to the socket
+        self.peer = None  # type: Optional[Tuple[int, int]]
+        self.error = None  # type: Optional[Exception]
+        # if set, packets are passed to the callback when they arrive instead of being queued
+        self.callback = None  # type: Optional[Callable[[Datagram], None]]
+
+    def __len__(self):
+        return len(self._queue)
+
+    @property
+    def queued_bytes(self) -> int:
+        return self._bytes
 
     def pop(self):
-        if len(self._queue) == 0:
+        """
+        Get the oldest packet in the queue, or None if the queue is empty
+        """
+        if not self._queue:
             return None
-        return self._queue.pop()
+        packet = self._queue.popleft()
+        self._bytes -= len(packet.data)
+        return packet
+
+    def pop_many(self, max_count: int) -> list:
+        """
+        Get up to max_count of the oldest packets in the queue. Returns an empty list if the queue is empty
+        """
+        count = min(max_count, len(self._queue))
+        packets = [self._queue.popleft() for _ in range(count)]
+        for packet in packets:
+            self._bytes -= len(packet.data)
+        return packets
+
+    async def wait(self):
+        """
+        Wait until there is a packet in the queue.
+        Raises PortClosedException if the queue is closed while waiting
+        """
+        while not self._queue:
+            if self.closed:
+                raise PortClosedException("port was closed")
+            self.raise_error()
+
+            waiter = get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # we were woken up for a packet we won't consume, pass the wakeup on
+                    self._wake_waiter()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
 
     async def wait_for_packet(self):
-        await self._event.wait()
+        """
+        Wait until a packet is available and return it. Never returns None.
+        """
+        await self.wait()
         return self.pop()
 
-    def append(self, data: bytes):
-        self._queue.append(data)
-        self._event.set()
+    def set_error(self, error: Exception):
+        """
+        Keep an error that should be raised to the next user of the queue, and wake up everyone waiting for packets
+        """
+        self.error = error
+        self._wake_all_waiters()
+
+    def raise_error(self):
+        """
+        Raise the pending error, if there is one. The error is raised only once
+        """
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def close(self):
+        """
+        Wake up everyone waiting for packets. From now on, waiting on an empty queue raises PortClosedException
+        """
+        self.closed = True
+        self._wake_all_waiters()
+
+    def _wake_all_waiters(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def append(self, packet: Datagram) -> bool:
+        """
+        Add a packet to the queue (or pass it to the callback, if there is one).
+        Returns False if the packet was dropped since the queue is full
+        """
+        if self.callback is not None:
+            self.callback(packet)
+            return True
+
+        size = len(packet.data)
+        if len(self._queue) >= self.max_packets or self._bytes + size > self.max_bytes:
+            self.dropped_packets += 1
+            self.dropped_bytes += size
+            return False
+
+        self._queue.append(packet)
+        self._bytes += size
+        self._wake_waiter()
+        return True
+
+    def _wake_waiter(self):
+        """
+        Wake the oldest waiter that is still waiting, if there is one
+        """
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+
+class ReusePortGroup:
+    """
+    The receive queues of sockets that share the same (ip, port), like SO_REUSEPORT.
+    Every packet goes to one of the queues, chosen by rendezvous hashing of its source: every queue scores the flow,
+    and the queue with the highest score gets it. So the packets of a flow always get to the same queue, and when a
+    queue joins or leaves the group, only the flows it takes or gives up move.
+    """
+    HASH_MASK = (1 << 64) - 1
+
+    def __init__(self):
+        self._queues = []  # type: List[PacketQueue]
+        # a seed per queue, that stays the same as long as the queue is in the group
+        self._seeds = []  # type: List[int]
+        self._next_seed = 0
+
+    def __len__(self):
+        return len(self._queues)
+
+    def __contains__(self, queue: PacketQueue):
+        return queue in self._queues
+
+    def __iter__(self):
+        return iter(self._queues)
+
+    def add(self, queue: PacketQueue):
+        self._queues.append(queue)
+        self._seeds.append(self._next_seed)
+        self._next_seed += 1
+
+    def remove(self, queue: PacketQueue):
+        """
+        Remove the queue from the group.
+        Only the flows of the removed queue move to other queues. The packets still waiting in it are moved, in order,
+        to the queues their flows now go to, before any newer packet of these flows, so the order of every flow is
+        kept. Packets that don't fit in their new queue are dropped and counted by it, like any other packet.
+        """
+        index = self._queues.index(queue)
+        del self._queues[index]
+        del self._seeds[index]
+        if self._queues:
+            for packet in queue.pop_many(len(queue)):
+                self.append(packet)
+
+    @classmethod
+    def _score(cls, flow_hash: int, seed: int) -> int:
+        # the splitmix64 finalizer, so the scores of different queues for the same flow are independent
+        value = (flow_hash ^ (seed * 0x9E3779B97F4A7C15)) & cls.HASH_MASK
+        value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & cls.HASH_MASK
+        value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & cls.HASH_MASK
+        return value ^ (value >> 31)
+
+    def queue_for(self, src_ip: int, src_port: int) -> PacketQueue:
+        """
+        The queue that gets the packets of the flow from (src_ip, src_port)
+        """
+        flow_hash = hash((src_ip, src_port)) & self.HASH_MASK
+        index = max(range(len(self._queues)), key=lambda i: self._score(flow_hash, self._seeds[i]))
+        return self._queues[index]
+
+    def append(self, packet: Datagram) -> bool:
+        return self.queue_for(int(packet.src_ip), packet.src_port).append(packet)
+
+
+class PortBindings:
+    """
+    All the queues bound to a single port, by the local ip (as int) they are bound to.
+    A queue bound with ip=None gets the packets of every ip that has no queue of its own.
+    Every ip is bound either to a single queue or to a ReusePortGroup of queues.
+    """
+    def __init__(self):
+        self._queues = {}  # type: Dict[Optional[int], Union[PacketQueue, ReusePortGroup]]
+        self._wildcard = None  # type: Optional[Union[PacketQueue, ReusePortGroup]]
+
+    def __len__(self):
+        return len(self._queues)
+
+    def __contains__(self, ip: Optional[int]):
+        return ip in self._queues
+
+    def lookup(self, ip: int) -> Optional[Union[PacketQueue, ReusePortGroup]]:
+        """
+        Find the queue that should get packets sent to the given ip.
+        The wildcard fallback is already resolved, so this is a single lookup
+        """
+        return self._queues.get(ip, self._wildcard)
+
+    def get(self, ip: Optional[int]) -> Optional[Union[PacketQueue, ReusePortGroup]]:
+        """
+        Get the queue bound exactly to the given ip (None for the wildcard queue)
+        """
+        return self._queues.get(ip)
+
+    def add(self, ip: Optional[int], queue: Union[PacketQueue, ReusePortGroup]):
+        self._queues[ip] = queue
+        if ip is None:
+            self._wildcard = queue
+
+    def remove(self, ip: Optional[int]):
+        self._queues.pop(ip, None)
+        if ip is None:
+            self._wildcard = None
+
+
+class EphemeralPortAllocator:
+    """
+    Allocates free ports from the ephemeral port range.
+    The free ports are kept in a list, and every port in the range remembers its index in that list (or -1 when it is
+    used), so allocating a random free port and freeing a port are both O(1).
+    """
+    DEFAULT_RANGE = (32768, 60999)  # linux default for net.ipv4.ip_local_port_range
+
+    def __init__(self, low: int = DEFAULT_RANGE[0], high: int = DEFAULT_RANGE[1]):
+        self.low = None
+        self.high = None
+        self._free = []  # type: List[int]
+        self._positions = []  # type: List[int]
+        self.set_range(low, high)
+
+    def set_range(self, low: int, high: int, used_ports: Iterable[int] = ()):
+        """
+        Set the range of the ephemeral ports (including both ends).
+        used_ports are the ports that are already open, and should not be allocated
+        """
+        if low < 1 or high > 65535 or low > high:
+            raise ValueError(f"invalid ephemeral port range {low}-{high}")
+
+        self.low = low
+        self.high = high
+        self._free = list(range(low, high + 1))
+        self._positions = list(range(len(self._free)))
+        for port in used_ports:
+            self.take(port)
+
+    def __len__(self):
+        """
+        The number of free ports
+        """
+        return len(self._free)
+
+    def __contains__(self, port: int):
+        return self.low <= port <= self.high
+
+    def allocate(self) -> int:
+        """
+        Allocate a random free port
+        """
+        if not self._free:
+            raise NoFreePortException(f"all the ephemeral ports in {self.low}-{self.high} are in use")
+        port = self._free[random.randrange(len(self._free))]
+        self.take(port)
+        return port
+
+    def take(self, port: int):
+        """
+        Mark the given port as used, if it's in the ephemeral range
+        """
+        if port not in self or self._positions[port - self.low] == -1:
+            return
+
+        # move the last free port to the place of the taken port
+        position = self._positions[port - self.low]
+        last_port = self._free.pop()
+        if last_port != port:
+            self._free[position] = last_port
+            self._positions[last_port - self.low] = position
+        self._positions[port - self.low] = -1
+
+    def release(self, port: int):
+        """
+        Mark the given port as free, if it's in the ephemeral range
+        """
+        if port not in self or self._positions[port - self.low] != -1:
+            return
 
+        self._positions[port - self.low] = len(self._free)
+        self._free.append(port)
 
-class UDP(Protocol):
+
+class UDP(Protocol, DestinationUnreachableHandler):
     NEXT_PROTOCOL = IPv4
     PROTOCOL_ID = 0x11
     PROTOCOL_STRUCT = struct.Struct('>HHHH')
     PSEUDO_HEADER_STRUCT = struct.Struct('>IIBBHHHHH')
     PORT_UNREACHABLE = 3
 
-    def __init__(self):
-        self.queues = {}
+    def __init__(self, stack: Optional[NetworkStack] = None):
+        super().__init__(stack)
+        self._ports = {}  # type: Dict[int, PortBindings]
+        self._ephemeral_ports = EphemeralPortAllocator()
+        self._datagram_handlers = []  # type: List[DatagramHandler]
+        self.stack.get_protocol(ICMP).register_to_destination_unreachable_callback(self)
 
-    async def build(self, adapter: NetworkAdapterInterface, packet: bytes, options) -> bytes:
-        # pseudo header for checksum
-        pseudo_header = self.PSEUDO_HEADER_STRUCT.pack(
-            int(adapter.ip), int(IPAddress(options['dst_ip'])), 0, self.PROTOCOL_ID,
-            self.PROTOCOL_STRUCT.size + len(options['data']), options['src_port'], options['dst_port'],
-            self.PROTOCOL_STRUCT.size + len(options['data']), 0)
-        udp_header = self.PROTOCOL_STRUCT.pack(
-            options['src_port'], options['dst_port'], self.PROTOCOL_STRUCT.size + len(options['data']), 
-            calculate_checksum(pseudo_header + options['data']))
-        return udp_header + options['data']
+    def register_to_datagram_callback(self, handler: DatagramHandler):
+        self._datagram_handlers.append(handler)
 
-    async def handle(self, packet: Packet, adapter: NetworkAdapterInterface) -> Optional[int]:
-        packet_io = BytesIO(packet.current_packet)
+    def unregister_from_datagram_callback(self, handler: DatagramHandler):
+        self._datagram_handlers.remove(handler)
+
+    def _datagram(self, src_ip: int, src_port: int, dst_ip: int, dst_port: int, size: int):
+        for handler in self._datagram_handlers:
+            handler.handle_datagram(src_ip, src_port, dst_ip, dst_port, size)
 
-        src_port, dst_port, length, checksum = self.PROTOCOL_STRUCT.unpack(packet_io.read(self.PROTOCOL_STRUCT.size))
-        data = packet_io.read(length)
+    MAX_PAYLOAD_SIZE = 65507  # max ip packet size minus ip and udp headers
 
+    def _build_header(self, src_ip: int, dst_ip: int, src_port: int, dst_port: int, data: bytes) -> bytes:
+        length = self.PROTOCOL_STRUCT.size + len(data)
         # pseudo header for checksum
-        ip_layer = packet.get_layer('ip')
         pseudo_header = self.PSEUDO_HEADER_STRUCT.pack(
-            int(ip_layer.attributes['src']), int(ip_layer.attributes['dst']),
-            0, self.PROTOCOL_ID, length, src_port, dst_port, length, 0)
+            src_ip, dst_ip, 0, self.PROTOCOL_ID, length, src_port, dst_port, length, 0)
+        return self.PROTOCOL_STRUCT.pack(src_port, dst_port, length, calculate_checksum(pseudo_header + data))
 
-        if checksum != 0 and checksum != calculate_checksum(pseudo_header + data):
-            return None
+    async def build(self, adapter: NetworkAdapterInterface, packet: bytes, options) -> bytes:
+        src_ip, dst_ip, data = int(adapter.ip), int(IPAddress(options['dst_ip'])), options['data']
+        udp_header = self._build_header(src_ip, dst_ip, options['src_port'], options['dst_port'], data)
+        if self._datagram_handlers:
+            self._datagram(src_ip, options['src_port'], dst_ip, options['dst_port'], len(udp_header) + len(data))
+        return udp_header + data
+
+    async def send_segments(self, src_port: int, dst_ip: IPAddress, dst_port: int, data: bytes, segment_size: int,
+                            expected_adapter: NetworkAdapterInterface = None):
+        """
+        Split the data to datagrams of segment_size bytes (the last one may be shorter) and send them all.
+        Only the first datagram goes through the whole stack. The headers below UDP are the same for every datagram of
+        the same size, so the other full size datagrams reuse them, and all the datagrams are given to the adapter as
+        one batch.
+        """
+        if segment_size <= 0 or segment_size > self.MAX_PAYLOAD_SIZE:
+            raise ValueError(f"invalid segment size {segment_size}")
 
-        if (str(ip_layer.attributes['dst']), dst_port) in self.queues.keys():
-            self.queues[(str(ip_layer.attributes['dst']), dst_port)].append((str(ip_layer.attributes['src']), src_port, data))
-        elif (None, dst_port) in self.queues.keys():
-            self.queues[(None, dst_port)].append((str(ip_layer.attributes['src']), src_port, data))
+        view = memoryview(data)
+        segments = [view[offset:offset + segment_size] for offset in range(0, len(view), segment_size)]
+        if not segments:
+            return
+
+        # the full size datagrams after the first one are counted in the tx counters of every protocol when the first
+        # one is built, since they are sent with its headers
+        full_size_segments = sum(1 for segment in segments if len(segment) == len(segments[0]))
+        adapter, first_packet = await self.stack.build(UDP, dst_ip, expected_adapter, copies=full_size_segments,
+                                                       src_port=src_port, dst_port=dst_port, data=segments[0])
+        packets = [first_packet]
+        lower_headers = first_packet[:len(first_packet) - self.PROTOCOL_STRUCT.size - len(segments[0])]
+        src_ip, dst_ip_int = int(adapter.ip), int(IPAddress(dst_ip))
+        for segment in segments[1:]:
+            if len(segment) == len(segments[0]):
+                packets.append(lower_headers + self._build_header(src_ip, dst_ip_int, src_port, dst_port, segment)
+                               + segment)
+                if self._datagram_handlers:
+                    self._datagram(src_ip, src_port, dst_ip_int, dst_port, self.PROTOCOL_STRUCT.size + len(segment))
+            else:
+                # the shorter last segment has different lower headers
+                packets.append((await self.stack.build(UDP, dst_ip, adapter, src_port=src_port, dst_port=dst_port,
+                                                       data=segment))[1])
+
+        self.stack.count_sent(adapter, packets)
+        await adapter.send_many(packets)
+
+    async def handle(self, packet: Packet, adapter: NetworkAdapterInterface) -> Optional[int]:
+        udp_packet = packet.current_packet
+        src_port, dst_port, length, checksum = self.PROTOCOL_STRUCT.unpack_from(udp_packet)
+        data = udp_packet[self.PROTOCOL_STRUCT.size:length]
+
+        ip_layer = packet.get_layer('ip')
+        if not packet.checksum_verified and checksum != 0:
+            # pseudo header for checksum
+            pseudo_header = self.PSEUDO_HEADER_STRUCT.pack(
+                int(ip_layer.attributes['src']), int(ip_layer.attributes['dst']),
+                0, self.PROTOCOL_ID, length, src_port, dst_port, length, 0)
+            if checksum != calculate_checksum(pseudo_header + data):
+                return self.drop(packet, DropReason.BAD_CHECKSUM)
+
+        bindings = self._ports.get(dst_port)
+        queue = bindings.lookup(int(ip_layer.attributes['dst'])) if bindings is not None else None
+        if queue is not None:
+            if not isinstance(data.obj, bytes):
+                # the frame is in a buffer the adapter may reuse, so the queued data can't point to it
+                data = memoryview(bytes(data))
+            if not queue.append(Datagram(ip_layer.attributes['src'], src_port, data)):
+                return self.drop(packet, DropReason.QUEUE_FULL)
+            if self._datagram_handlers:
+                self._datagram(int(ip_layer.attributes['src']), src_port, int(ip_layer.attributes['dst']), dst_port,
+                               length)
+            if self.stack.tracer is not None:
+                self.stack.tracer.delivered(packet)
         else:
-            await stack.send(ICMP, dst_ip=ip_layer.attributes['src'], icmp_type=ICMPCodes.DESTINATION_UNREACHABLE,
-                             unreachable_code=self.PORT_UNREACHABLE, error_packet=ip_layer.data + packet.current_packet)
+            self.stack.get_protocol(ICMP).send_packet_error(packet, ICMPCodes.DESTINATION_UNREACHABLE,
+                                                            unreachable_code=self.PORT_UNREACHABLE)
+            return self.drop(packet, DropReason.NO_PORT)
 
         return None
 
-    def open_port(self, ip: str, port: int):
+    def handle_destination_unreachable(self, code: int, src_ip: IPAddress, dst_ip: IPAddress, protocol: int,
+                                       data: memoryview):
+        """
+        Report port unreachable errors to the connected sockets that sent the packets which caused them
+        """
+        if protocol != self.PROTOCOL_ID or code != self.PORT_UNREACHABLE or len(data) < self.PROTOCOL_STRUCT.size:
+            return
+
+        src_port, dst_port, _, _ = self.PROTOCOL_STRUCT.unpack_from(data)
+        bindings = self._ports.get(src_port)
+        queue = bindings.lookup(int(src_ip)) if bindings is not None else None
+        if queue is None:
+            return
+
+        peer = (int(dst_ip), dst_port)
+        for connected_queue in (queue if isinstance(queue, ReusePortGroup) else (queue,)):
+            if connected_queue.peer == peer:
+                connected_queue.set_error(ConnectionRefusedError(f"{dst_ip}:{dst_port} is unreachable"))
+
+    @staticmethod
+    def _local_ip(ip: Optional[str]) -> Optional[int]:
+        """
+        Normalize the local ip of a binding. None means binding on all the adapters.
+        """
+        if ip is None:
+            return None
+        ip = int(IPAddress(ip))
+        return ip if ip != 0 else None
+
+    def open_port(self, ip: Optional[str], port: int, max_packets: int = PacketQueue.DEFAULT_MAX_PACKETS,
+                  max_bytes: int = PacketQueue.DEFAULT_MAX_BYTES, reuse_port: bool = False) -> PacketQueue:
         """
         Mark the (ip, port) as open and expects packets
+        max_packets and max_bytes limit the receive queue of the port. Packets above the limit are dropped.
+        If reuse_port is set, other queues opened on the same (ip, port) with reuse_port will share its packets.
+        Returns the receive queue of the port
         """
-        if (None, port) in self.queues.keys() or (ip, port) in self.queues.keys():
-            raise PortAlreadyOpenedException(f"port {port} is already open")
+        ip = self._local_ip(ip)
+        queue = PacketQueue(max_packets, max_bytes)
+        bindings = self._ports.get(port)
+        if bindings is not None:
+            current = bindings.get(ip)
+            if reuse_port and isinstance(current, ReusePortGroup):
+                current.add(queue)
+                return queue
 
-        self.queues[(ip, port)] = PacketQueue()
+            if None in bindings or current is not None:
+                raise PortAlreadyOpenedException(f"port {port} is already open")
 
-    def close_port(self, ip: str, port: int):
+        if bindings is None:
+            bindings = self._ports[port] = PortBindings()
+            self._ephemeral_ports.take(port)
+
+        if reuse_port:
+            group = ReusePortGroup()
+            group.add(queue)
+            bindings.add(ip, group)
+        else:
+            bindings.add(ip, queue)
+        return queue
+
+    def close_port(self, ip: Optional[str], port: int, queue: Optional[PacketQueue] = None):
         """
         Mark the (ip, port) as closed. We will not expect packets in this port anymore
+        If the port was opened with reuse_port, only the given queue is removed. The packets waiting in it are moved to
+        the other queues of the port.
         """
-        self.queues.pop((ip, port), None)
+        bindings = self._ports.get(port)
+        if bindings is None:
+            return
+
+        ip = self._local_ip(ip)
+        current = bindings.get(ip)
+        if isinstance(current, ReusePortGroup):
+            if queue is None or queue not in current:
+                return
+            current.remove(queue)
+            queue.close()
+            if len(current) != 0:
+                return
+        elif current is not None:
+            current.close()
+
+        bindings.remove(ip)
+        if len(bindings) == 0:
+            del self._ports[port]
+            self._ephemeral_ports.release(port)
 
-    async def get_packet(self, ip: str, port: int):
+    def open_ephemeral_port(self, ip: Optional[str], max_packets: int = PacketQueue.DEFAULT_MAX_PACKETS,
+                            max_bytes: int = PacketQueue.DEFAULT_MAX_BYTES,
+                            reuse_port: bool = False) -> Tuple[int, PacketQueue]:
         """
-        Get a packet that was sent to the given (ip, port)
+        Open a random free port from the ephemeral port range. See `open_port`.
+        Raises NoFreePortException if all the ephemeral ports are in use.
+        Returns the chosen port and its receive queue
+        """
+        port = self._ephemeral_ports.allocate()
+        return port, self.open_port(ip, port, max_packets, max_bytes, reuse_port)
+
+    def set_ephemeral_port_range(self, low: int, high: int):
+        """
+        Set the range from which `open_ephemeral_port` chooses ports (including both ends)
+        """
+        self._ephemeral_ports.set_range(low, high, self._ports.keys())
+
+    def is_port_open(self, port: int) -> bool:
         """
-        if (ip, port) not in self.queues.keys():
+        Returns true if the port is bound on any ip
+        """
+        return port in self._ports
+
+    def get_queue(self, ip: Optional[str], port: int) -> PacketQueue:
+        """
+        Get the receive queue of the given (ip, port)
+        """
+        bindings = self._ports.get(port)
+        queue = bindings.get(self._local_ip(ip)) if bindings is not None else None
+        if queue is None:
             raise Exception(f"port {port} is not open")
+        if isinstance(queue, ReusePortGroup):
+            raise Exception(f"port {port} is shared by several queues, use the queue returned from open_port")
+        return queue
+
+    async def get_packet(self, ip: Optional[str], port: int):
+        """
+        Get a packet that was sent to the given (ip, port)
+        """
+        queue = self.get_queue(ip, port)
 
         # check if there is available packet to consume
-        data = self.queues[(ip, port)].pop()
+        data = queue.pop()
         if data is not None:
             return data
 
         # if no available packet, then wait for packet to arrive
-        return await self.queues[(ip, port)].wait_for_packet()
+        return await queue.wait_for_packet()
@@ -1,21 +1,63 @@
-import random
-from typing import Optional
+from typing import Optional, List, Tuple, Callable, Deque
+from collections import deque
+import asyncio
 
-from stack import stack
-from udp import UDP, PortAlreadyOpenedException
+from stack import NetworkStack, stack as default_stack
+from udp import UDP, PacketQueue, PortClosedException, Datagram
 from ip_utils import IPAddress
 
 
 class UDPSocket:
-    BIND_TRIES = 1000
-
-    def __init__(self):
+    def __init__(self, recv_buffer_size: int = PacketQueue.DEFAULT_MAX_BYTES,
+                 recv_queue_length: int = PacketQueue.DEFAULT_MAX_PACKETS, zero_copy: bool = False,
+                 reuse_port: bool = False, stack: Optional[NetworkStack] = None):
+        """
+        recv_buffer_size and recv_queue_length limit how many bytes and packets can wait in the receive queue of the
+        socket (like SO_RCVBUF). Packets above the limit are dropped.
+        If zero_copy is set, received packets are returned as `Datagram`s, whose data is a memoryview over the received
+        frame and whose source ip is an IPAddress, instead of a (str, int, bytes) tuple.
+        If reuse_port is set, other sockets created with reuse_port can bind to the same ip and port, and the packets
+        are spread between them by their source (like SO_REUSEPORT).
+        stack is the stack the socket belongs to, the global stack if not given.
+        """
+        self.stack = stack if stack is not None else default_stack
         self.src_ip = None
         self.src_adapter = None
         self.src_port = None
         self.dst_ip = None
         self.dst_port = None
         self.closed = False
+        self.recv_buffer_size = recv_buffer_size
+        self.recv_queue_length = recv_queue_length
+        self._queue = None  # type: Optional[PacketQueue]
+        # packets taken from the receive queue at once by the iteration, and not returned yet
+        self._drained = deque()  # type: Deque[Datagram]
+        self.zero_copy = zero_copy
+        self.reuse_port = reuse_port
+
+    def _convert(self, packet: Datagram):
+        if self.zero_copy:
+            return packet
+        return str(packet.src_ip), packet.src_port, bytes(packet.data)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Tuple[str, int, bytes]:
+        """
+        Iterate over the packets sent to this socket, until the socket is closed.
+        All the queued packets are taken from the receive queue at once, and returned one by one without waiting.
+        """
+        if self.closed or self._queue is None:
+            raise StopAsyncIteration
+
+        if not self._drained:
+            try:
+                await self._queue.wait()
+            except PortClosedException:
+                raise StopAsyncIteration
+            self._drained.extend(self._queue.pop_many(len(self._queue)))
+        return self._convert(self._drained.popleft())
 
     def __enter__(self):
         return self
@@ -37,23 +79,54 @@ class UDPSocket:
             raise Exception("trying to bind to invalid port number")
 
         if src_ip and src_ip != '0.0.0.0':
-            self.src_adapter = stack.get_adapter(src_ip)
+            self.src_adapter = self.stack.get_adapter(src_ip)
             self.src_ip = src_ip
 
         if src_port == 0:
-            src_port = random.randint(1, 65535)
-            for _ in range(self.BIND_TRIES):
-                try:
-                    stack.get_protocol(UDP).open_port(src_ip, src_port)
-                    break
-                except PortAlreadyOpenedException:
-                    src_port = random.randint(1, 65535)
-                
+            src_port, self._queue = self.stack.get_protocol(UDP).open_ephemeral_port(
+                src_ip, self.recv_queue_length, self.recv_buffer_size, self.reuse_port)
         else:
-            stack.get_protocol(UDP).open_port(src_ip, src_port)
+            self._queue = self._open_port(src_ip, src_port)
             self.src_ip = src_ip
                 
         self.src_port = src_port
+        self._update_peer()
+
+    def _open_port(self, src_ip: Optional[str], src_port: int) -> PacketQueue:
+        return self.stack.get_protocol(UDP).open_port(src_ip, src_port, self.recv_queue_length,
+                                                      self.recv_buffer_size, self.reuse_port)
+
+    def set_recv_buffer_size(self, recv_buffer_size: int, recv_queue_length: Optional[int] = None):
+        """
+        Change the limits of the receive queue. Packets that are already queued are kept.
+        """
+        self.recv_buffer_size = recv_buffer_size
+        if recv_queue_length is not None:
+            self.recv_queue_length = recv_queue_length
+
+        if self._queue is not None:
+            self._queue.max_bytes = self.recv_buffer_size
+            self._queue.max_packets = self.recv_queue_length
+
+    def set_recv_callback(self, callback: Optional[Callable]):
+        """
+        Call callback with every packet sent to this socket as soon as the stack handles it, instead of queueing the
+        packet for `recv`. See `recvfrom` for the format of the packet.
+        The callback is called from the stack, so it should be quick and shouldn't block.
+        Packets that are already queued are still returned by `recv`. Call with None to queue packets again.
+        """
+        self._check_can_receive()
+        if callback is None:
+            self._queue.callback = None
+        else:
+            self._queue.callback = lambda packet: callback(self._convert(packet))
+
+    @property
+    def dropped_packets(self) -> int:
+        """
+        The number of packets dropped since the receive queue was full
+        """
+        return self._queue.dropped_packets if self._queue is not None else 0
 
     def connect(self, dst_ip: str, dst_port: int):
         """
@@ -65,10 +138,45 @@ class UDPSocket:
 
         self.dst_ip = IPAddress(dst_ip)
         self.dst_port = dst_port
+        self._update_peer()
+
+    def _update_peer(self):
+        """
+        Let the receive queue know the destination we're connected to, so it will get the icmp errors about it
+        """
+        if self._queue is not None and self.dst_ip is not None:
+            self._queue.peer = (int(self.dst_ip), self.dst_port)
+
+    def _raise_pending_error(self):
+        """
+        Raise an error we got about the destination (for example, ConnectionRefusedError after icmp port unreachable)
+        The error is raised only once
+        """
+        if self._queue is not None:
+            self._queue.raise_error()
 
     async def send(self, data):
         """
         Send the data to the destination. `connect` should be used before this function to mark the destination.
+        Raises ConnectionRefusedError if the destination reported that the port is unreachable since the last call.
+        """
+        if self.closed:
+            raise Exception("socket is closed")
+
+        if self.dst_port is None or self.dst_ip is None:
+            raise Exception("cannot send on an unconnected socket")
+
+        if self.src_port is None:
+            self.bind(None, 0)
+        self._raise_pending_error()
+
+        await self.stack.send(UDP, src_port=self.src_port, dst_port=self.dst_port, dst_ip=self.dst_ip,
+                              data=data, expected_adapter=self.src_adapter)
+
+    async def send_segments(self, data, segment_size: int):
+        """
+        Send a large buffer to the destination as many datagrams of segment_size bytes (the last one may be shorter).
+        This is much cheaper than calling `send` for every datagram. `connect` should be used before this function.
         """
         if self.closed:
             raise Exception("socket is closed")
@@ -78,9 +186,10 @@ class UDPSocket:
 
         if self.src_port is None:
             self.bind(None, 0)
+        self._raise_pending_error()
 
-        await stack.send(UDP, src_port=self.src_port, dst_port=self.dst_port, dst_ip=self.dst_ip,
-                         data=data, expected_adapter=self.src_adapter)
+        await self.stack.get_protocol(UDP).send_segments(self.src_port, self.dst_ip, self.dst_port, data,
+                                                         segment_size, expected_adapter=self.src_adapter)
 
     async def sendto(self, data, dst_ip: str, dst_port: int):
         """
@@ -92,7 +201,8 @@ class UDPSocket:
         if self.src_port is None:
             self.bind(None, 0)
 
-        return stack.send(UDP, src_port=self.src_port, dst_port=dst_port, dst_ip=dst_ip, data=data)
+        await self.stack.send(UDP, src_port=self.src_port, dst_port=dst_port, dst_ip=IPAddress(dst_ip),
+                              data=data)
     
     async def recv(self):
         """
@@ -107,16 +217,67 @@ class UDPSocket:
         See `recv` documentation. This function also returns the information of the sender.
         Returns a tuple of (source ip, source port, packet data)
         """
+        return self._convert(await self._recv_datagram())
+
+    async def recv_into(self, buffer, nbytes: int = 0) -> int:
+        """
+        Receive the next packet straight into the given writable buffer, without creating a bytes object.
+        Up to nbytes bytes are written (or the size of the buffer if nbytes is 0). The rest of the packet is discarded.
+        Returns the number of bytes written
+        """
+        return (await self.recvfrom_into(buffer, nbytes))[2]
+
+    async def recvfrom_into(self, buffer, nbytes: int = 0) -> Tuple[IPAddress, int, int]:
+        """
+        See `recv_into` documentation. This function also returns the information of the sender.
+        Returns a tuple of (source ip, source port, number of bytes written)
+        """
+        datagram = await self._recv_datagram()
+        buffer = memoryview(buffer).cast('B')
+        size = min(len(datagram.data), nbytes or len(buffer))
+        buffer[:size] = datagram.data[:size]
+        return datagram.src_ip, datagram.src_port, size
+
+    async def _recv_datagram(self) -> Datagram:
+        self._check_can_receive()
+        if self._drained:
+            return self._drained.popleft()
+        self._raise_pending_error()
+        packet = self._queue.pop()
+        if packet is None:
+            packet = await self._queue.wait_for_packet()
+        return packet
+
+    async def recvmany(self, max_count: int, timeout: Optional[float] = None) -> List[Tuple[str, int, bytes]]:
+        """
+        Receive all the queued packets, up to max_count, at once. See `recvfrom` for the format of every packet.
+        If no packet is queued, waits up to timeout seconds (or forever if timeout is None) for packets to arrive.
+        Returns an empty list if the timeout expired.
+        """
+        self._check_can_receive()
+        # packets the iteration took from the receive queue come before the packets still in it
+        packets = [self._drained.popleft() for _ in range(min(max_count, len(self._drained)))]
+        if not packets:
+            self._raise_pending_error()
+        packets += self._queue.pop_many(max_count - len(packets))
+        if not packets:
+            try:
+                await asyncio.wait_for(self._queue.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+            packets = self._queue.pop_many(max_count)
+
+        if self.zero_copy:
+            return packets
+        return [self._convert(packet) for packet in packets]
+
+    def _check_can_receive(self):
         if self.closed:
             raise Exception("socket is closed")
 
         if self.src_port is None:
             raise Exception("cannot receive on an unbound socket")
 
-        packet = await stack.get_protocol(UDP).get_packet(self.src_ip, self.src_port)
-        packet = (packet[0], packet[1], packet[2])
-        return packet
-
     def close(self):
         """
         Close the socket and stop listening on the port we listened on.
@@ -125,7 +286,9 @@ class UDPSocket:
             return
 
         self.closed = True
+        self._drained.clear()
 
         if self.src_port:
-            stack.get_protocol(UDP).close_port(self.src_ip, self.src_port)
+            self.stack.get_protocol(UDP).close_port(self.src_ip, self.src_port, self._queue)
             self.src_port = None
+            self._queue = None
@@ -7,3 +7,15 @@ def calculate_checksum(data: bytes) -> int:
         c = s + w
         s = (c & 0xffff) + (c >> 16)
     return ~s & 0xffff
+
+
+def update_checksum(checksum: int, old_word: int, new_word: int) -> int:
+    """
+    Update an internet checksum after one 16 bit word of the data changed, without summing all the data again
+    (RFC 1624)
+    """
+    s = (~checksum & 0xffff) + (~old_word & 0xffff) + new_word
+    s = (s & 0xffff) + (s >> 16)
+    s = (s & 0xffff) + (s >> 16)
+    return ~s & 0xffff
+
@@ -0,0 +1,106 @@
+import asyncio
+import os
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from utils import calculate_checksum
+from consts import IPV4_PROTOCOL_ID
+
+
+def gil_enabled() -> bool:
+    """
+    Whether this python build runs threads under the GIL (always true before python 3.13)
+    """
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return True if is_gil_enabled is None else is_gil_enabled()
+
+
+class ValidationStage:
+    """
+    An optional stage that verifies the checksums of received frames on a thread pool, before the stack handles them.
+    The stack hands it every batch of frames (see `NetworkStack.set_validation_stage`), it splits the batch between its
+    workers, and returns which of them are valid. The stack then handles the valid frames without verifying the
+    checksums again, and the rejected frames as usual, so the protocols count them and drop them like they do without
+    the stage.
+    The checksums are computed in python, so the workers only run in parallel on a free threaded build. On a build with
+    the GIL the stage is disabled by default, and the stack verifies the checksums in the protocols as usual.
+    Only batches go through the stage. Single packets (`NetworkStack.add_packet`, and `handle_packet_now` of busy
+    polling) are not worth a trip to a thread, so their checksums are verified in the protocols.
+    """
+    ETHERNET_HEADER_SIZE = 14
+    ETHERTYPE_OFFSET = 12
+    IPV4_HEADER_SIZE = 20
+    IPV4_BASIC_HEADER = 0x45
+    UDP_PROTOCOL_ID = 17
+    IPV4_HEADER_STRUCT = struct.Struct('>BBHHHBBHII')
+    UDP_HEADER_STRUCT = struct.Struct('>HHHH')
+    UDP_PSEUDO_HEADER_STRUCT = struct.Struct('>IIBBHHHHH')
+    DEFAULT_MIN_CHUNK_SIZE = 16
+
+    def __init__(self, workers: Optional[int] = None, enabled: Optional[bool] = None,
+                 min_chunk_size: int = DEFAULT_MIN_CHUNK_SIZE):
+        """
+        @param workers - the number of threads. the number of cpus if not given, since the work is all cpu
+        @param enabled - whether the stack should use this stage. only on free threaded builds if not given
+        @param min_chunk_size - the min number of frames given to a worker at once, so small batches are not spread
+                                over threads for nothing
+        """
+        self.enabled = not gil_enabled() if enabled is None else enabled
+        self.min_chunk_size = min_chunk_size
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='validation')
+        self.invalid_packets = 0
+
+    async def validate(self, packets: List[bytes]) -> List[bool]:
+        """
+        Verify the checksums of the given frames in the thread pool.
+        Returns whether every frame is valid, in order
+        """
+        chunk_size = max(self.min_chunk_size, -(-len(packets) // self.workers))
+        loop = asyncio.get_event_loop()
+        chunks = [packets[i:i + chunk_size] for i in range(0, len(packets), chunk_size)]
+        results = await asyncio.gather(*(loop.run_in_executor(self._executor, self._validate_chunk, chunk)
+                                         for chunk in chunks))
+
+        valid = [is_valid for chunk_valid in results for is_valid in chunk_valid]
+        self.invalid_packets += valid.count(False)
+        return valid
+
+    @classmethod
+    def _validate_chunk(cls, packets: List[bytes]) -> List[bool]:
+        return [cls.validate_frame(packet) for packet in packets]
+
+    @classmethod
+    def validate_frame(cls, frame: bytes) -> bool:
+        """
+        Verify the checksums of an ethernet frame, like IPv4 and UDP do when they handle it.
+        Only basic IPv4 headers are checked here. Other frames are valid, and the protocols judge them as usual
+        """
+        ip_offset = cls.ETHERNET_HEADER_SIZE
+        if len(frame) < ip_offset + cls.IPV4_HEADER_SIZE \
+                or struct.unpack_from('>H', frame, cls.ETHERTYPE_OFFSET)[0] != IPV4_PROTOCOL_ID \
+                or frame[ip_offset] != cls.IPV4_BASIC_HEADER:
+            return True
+
+        header_data = bytes(frame[ip_offset:ip_offset + cls.IPV4_HEADER_SIZE])
+        _, _, total_length, _, _, _, protocol, header_checksum, src_ip, dst_ip = \
+            cls.IPV4_HEADER_STRUCT.unpack(header_data)
+        if header_checksum != calculate_checksum(header_data[:10] + b'\x00' * 2 + header_data[12:]):
+            return False
+
+        udp_offset = ip_offset + cls.IPV4_HEADER_SIZE
+        if protocol != cls.UDP_PROTOCOL_ID or len(frame) < udp_offset + cls.UDP_HEADER_STRUCT.size:
+            return True
+
+        src_port, dst_port, length, checksum = cls.UDP_HEADER_STRUCT.unpack_from(frame, udp_offset)
+        if checksum == 0:
+            return True
+        pseudo_header = cls.UDP_PSEUDO_HEADER_STRUCT.pack(
+            src_ip, dst_ip, 0, cls.UDP_PROTOCOL_ID, length, src_port, dst_port, length, 0)
+        data = bytes(frame[udp_offset + cls.UDP_HEADER_STRUCT.size:udp_offset + length])
+        return checksum == calculate_checksum(pseudo_header + data)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
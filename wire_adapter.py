@@ -0,0 +1,139 @@
+from __future__ import annotations
+import asyncio
+from collections import deque
+from typing import Optional, List, Deque, Tuple
+
+from adapter_interface import NetworkAdapterInterface
+from task_creator import TaskCreator
+from stack import NetworkStack, stack as default_stack
+from ip_utils import IPAddress
+from stats import DropReason
+
+
+class WireNetworkAdapter(NetworkAdapterInterface, TaskCreator):
+    """
+    An in-memory adapter, connected by a "wire" to another WireNetworkAdapter.
+    Frames sent by one adapter are passed as is (without copying) to the other one, through a bounded queue.
+    A sender waits while the queue of its peer is full, so no frame is lost, and the peer passes the queued frames to
+    its stack in batches of up to batch_size frames.
+    Frames sent while the adapter handles received frames (like ARP replies and ICMP echo replies) never wait, since
+    the receive tasks of both sides could then wait for each other forever. If the queue of the peer is full, they are
+    dropped and counted as QUEUE_FULL drops of the adapter.
+    This lets two stacks talk to each other without root, a kernel or scapy, e.g. for benchmarks.
+    """
+    DEFAULT_BATCH_SIZE = 64
+    DEFAULT_MAX_PACKETS = 1024
+
+    def __init__(self, mac: str, ip: IPAddress, netmask: IPAddress, gateway: Optional[IPAddress] = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE, max_packets: int = DEFAULT_MAX_PACKETS,
+                 stack: NetworkStack = None):
+        """
+        @param batch_size - the max number of frames passed to the stack at once
+        @param max_packets - the max number of frames waiting in the queue of this adapter
+        @param stack - the stack this adapter passes its frames to. the global stack if not given
+        """
+        super().__init__()
+        self._mac = mac
+        self._ip = ip
+        self._netmask = netmask
+        self._gateway = gateway
+        self.batch_size = batch_size
+        self.max_packets = max_packets
+        self.stack = stack if stack is not None else default_stack
+        self.peer = None  # type: Optional[WireNetworkAdapter]
+        self._queue = deque()  # type: Deque[bytes]
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self.dropped_packets = 0
+        self._receive_task = self.create_task(self.handle_packets())
+
+    @classmethod
+    def pair(cls, first: dict, second: dict, **options) -> Tuple[WireNetworkAdapter, WireNetworkAdapter]:
+        """
+        Create two adapters connected to each other.
+        first and second are the arguments of every adapter, and options are passed to both of them
+        """
+        first = cls(**first, **options)
+        second = cls(**second, **options)
+        first.connect(second)
+        return first, second
+
+    def connect(self, peer: WireNetworkAdapter):
+        self.peer = peer
+        peer.peer = self
+
+    async def handle_packets(self):
+        """
+        A task for packet processing
+        Passes the queued frames to the stack, a batch at a time
+        """
+        while True:
+            if not self._queue:
+                self._not_empty.clear()
+                await self._not_empty.wait()
+
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            self._not_full.set()
+            await self.stack.handle_packets(batch, self)
+
+    async def _push(self, packets: List[bytes]):
+        """
+        Called by the peer to queue the frames it sent
+        """
+        for packet in packets:
+            while len(self._queue) >= self.max_packets:
+                self._not_full.clear()
+                await self._not_full.wait()
+            self._queue.append(packet)
+            self._not_empty.set()
+
+    def _push_nowait(self, packets: List[bytes]) -> int:
+        """
+        Called by the peer to queue the frames it sent, without waiting for room.
+        Returns the number of frames that were dropped since the queue is full
+        """
+        room = max(self.max_packets - len(self._queue), 0)
+        self._queue.extend(packets[:room])
+        if room:
+            self._not_empty.set()
+        return max(len(packets) - room, 0)
+
+    @property
+    def mac(self) -> str:
+        return self._mac
+
+    @property
+    def ip(self) -> IPAddress:
+        return self._ip
+
+    @property
+    def netmask(self) -> IPAddress:
+        return self._netmask
+
+    @property
+    def gateway(self) -> Optional[IPAddress]:
+        return self._gateway
+
+    async def send(self, packet: bytes):
+        await self.send_many([packet])
+
+    async def send_many(self, packets: List[bytes]):
+        # a wire that isn't connected loses everything sent on it
+        if self.peer is None:
+            return
+        if asyncio.current_task() is not self._receive_task:
+            await self.peer._push(packets)
+            return
+
+        dropped = self.peer._push_nowait(packets)
+        if dropped:
+            self.dropped_packets += dropped
+            self.stack.adapter_counters(self).drop(DropReason.QUEUE_FULL, dropped)
+
+    def close(self):
+        if self.peer is not None:
+            self.peer.peer = None
+            self.peer = None
+        for task in list(self.tasks):
+            task.cancel()